@@ -7,21 +7,24 @@ from django.contrib.contenttypes import generic
 from django.core.exceptions import PermissionDenied
 from django.core.urlresolvers import reverse
 from django.forms.widgets import Media
-from django.http import HttpResponseRedirect
+from django.http import Http404, HttpResponseRedirect
 from django.utils.encoding import force_unicode
 
-from pagemanager import PageAdmin
-from pagemanager.app_settings import PAGEMANAGER_PAGE_MODEL, \
-    PAGEMANAGER_PAGE_MODELADMIN
+from pagemanager.app_settings import PAGEMANAGER_PAGE_MODEL
 from pagemanager.forms import PageAdminFormMixin
-from pagemanager.models import Page, PlaceholderPage, RedirectPage
+from pagemanager.grants import can_place_under, is_granted
+from pagemanager.models import Page, PageGrant, PlaceholderPage, \
+    RedirectPage
 from pagemanager import signals
+from pagemanager.options import PageAdmin
 from pagemanager.sites import pagemanager_site
 from pagemanager.permissions import get_permissions, get_lookup_function
+from pagemanager.util import get_pagemanager_modeladmin
 
 
-# PageAdmin located in pagemanager.init to prevent a circular import
-admin.site.register(PAGEMANAGER_PAGE_MODEL, PAGEMANAGER_PAGE_MODELADMIN)
+# PageAdmin lives in pagemanager.options, so that it can be imported without
+# registering anything.
+admin.site.register(PAGEMANAGER_PAGE_MODEL, get_pagemanager_modeladmin())
 
 # Register stock pagemanager layouts
 pagemanager_site.register([PlaceholderPage, RedirectPage])
@@ -62,6 +65,43 @@ class PageLayoutAdmin(admin.ModelAdmin):
     verbose_name_meta = None
     readonly_fields = []
 
+    def __init__(self, model, admin_site):
+        """
+        Applies the overrides provided in the layout's PageManagerMeta class
+        to this instance, so that settings from one layout never bleed
+        through to the next.
+        """
+        meta = model._meta
+        pm_meta = model._pagemanager_meta
+        if pm_meta.formfield_overrides:
+            self.formfield_overrides = dict(self.formfield_overrides,
+                **pm_meta.formfield_overrides)
+        if pm_meta.fieldsets:
+            self.fieldsets = pm_meta.fieldsets
+        if meta.verbose_name:
+            self.verbose_name = meta.verbose_name
+        if meta.verbose_name_plural:
+            self.verbose_name_plural = meta.verbose_name_plural
+        if pm_meta.inlines:
+            self.inlines = PageLayoutAdmin.inlines + pm_meta.inlines
+        if pm_meta.readonly_fields:
+            self.readonly_fields = pm_meta.readonly_fields
+        if pm_meta.exclude:
+            self.exclude = PageLayoutAdmin.exclude + pm_meta.exclude
+        super(PageLayoutAdmin, self).__init__(model, admin_site)
+
+    @property
+    def media(self):
+        media = super(PageLayoutAdmin, self).media
+        pm_meta = self.model._pagemanager_meta
+        # Add a ``Media`` for ``admin_media_js`` or ``admin_media_css``.
+        if pm_meta.admin_media_js or pm_meta.admin_media_css:
+            media = media + Media(
+                css=pm_meta.admin_media_css or {},
+                js=pm_meta.admin_media_js or ()
+            )
+        return media
+
     def changelist_view(self, request, extra_context=None):
         """
         Redirect the PageLayout changelist_view to the Page changelist_view
@@ -74,6 +114,35 @@ class PageLayoutAdmin(admin.ModelAdmin):
                 return fs
         return None
 
+    def get_object(self, request, object_id):
+        """
+        Returns the layout being changed, fetching it only once per request:
+        ``change_view`` needs it before Django's own ``change_view`` asks for
+        it again.
+        """
+        objects = request.__dict__.setdefault('_pagemanager_objects', {})
+        key = (self.model, object_id)
+        if key not in objects:
+            objects[key] = super(PageLayoutAdmin, self).get_object(
+                request, object_id
+            )
+        return objects[key]
+
+    def get_page(self, obj):
+        """
+        Returns the single page of a layout, cached on the layout.
+        """
+        if not hasattr(obj, '_pagemanager_page'):
+            obj_pages = obj.page.all()
+            if len(obj_pages) != 1:
+                val = obj_pages and "Multiple" or "Zero"
+                raise ValueError((
+                    "%s pages relate to this layout. Only one page can "
+                    "relate to this layout and at least one page must do so."
+                )% val)
+            obj._pagemanager_page = obj_pages[0]
+        return obj._pagemanager_page
+
     def change_view(self, request, object_id, extra_context=None):
         """
         Adds some initial permissions checks to ensure that users can't:
@@ -82,17 +151,18 @@ class PageLayoutAdmin(admin.ModelAdmin):
             2. change item's publication status without needed permissions
             3. change item's visibility status without needed permissions
 
+        The submitted status and visibility are read straight from the POST
+        data, so that the forms are only built and validated once, by
+        Django's ``change_view``.
         """
         obj = self.get_object(request, unquote(object_id))
-        obj_pages = obj.page.all()
-        if len(obj_pages) == 1:
-            page = obj_pages[0]
-        else:
-            val = obj_pages and "Multiple" or "Zero"
-            raise ValueError((
-                "%s pages relate to this layout. Only one page can "
-                "relate to this layout and at least one page must do so."
-            )% val) 
+        if obj is None:
+            raise Http404("Layout not found.")
+        page = self.get_page(obj)
+
+        # Reject users limited to other sections of the site.
+        if not is_granted(request.user, page):
+            raise PermissionDenied
 
         lookup_perm = get_lookup_function(request.user, get_permissions())
         # Reject users who don't have permission to view the page becuase
@@ -115,9 +185,7 @@ class PageLayoutAdmin(admin.ModelAdmin):
 
             formset = self._get_page_formset(request)
             prefix = formset.get_default_prefix()
-            ModelForm = self.get_form(request, obj)
-            form = ModelForm(request.POST, request.FILES)
-            changed_data = form.data
+            changed_data = request.POST
             opts = self.model._meta
             this_url = reverse(
                 "admin:%s_%s_change" % (opts.app_label, opts.module_name),
@@ -156,16 +224,42 @@ class PageLayoutAdmin(admin.ModelAdmin):
                     )
                     messages.add_message(request, messages.ERROR, message)
                     return HttpResponseRedirect(this_url)
-            # Fire the custom signal for page editing in the admin.
-            signals.page_edited.send(sender=self, page=page, created=False)
 
-        # All permissions checks have passed.
+        # All permissions checks have passed. Hand the page, the layout and
+        # the page's ancestors, with their layouts, to the templates, so that
+        # the template tags don't need to fetch them again.
+        page.page_layout = obj
+        context = {
+            'page': page,
+            'obj': obj,
+            'page_ancestors': page.get_ancestor_list(),
+        }
+        context.update(extra_context or {})
         return super(PageLayoutAdmin, self).change_view(
             request,
             object_id,
-            extra_context=None
+            extra_context=context
         )
 
+    def save_formset(self, request, form, formset, change):
+        """
+        Keeps the page cached on the layout current, and fires the custom
+        signal for page editing in the admin once the page has been saved.
+        Users with page grants can't move the page out of their sections.
+        """
+        if issubclass(formset.model, Page):
+            for page_form in formset.forms:
+                if 'parent' in page_form.changed_data and not \
+                    can_place_under(request.user,
+                        page_form.cleaned_data.get('parent')):
+                    raise PermissionDenied
+        super(PageLayoutAdmin, self).save_formset(request, form, formset,
+            change)
+        if change and issubclass(formset.model, Page) and formset.forms:
+            page = formset.forms[0].instance
+            form.instance._pagemanager_page = page
+            signals.page_edited.send(sender=self, page=page, created=False)
+
     def add_view(self, request, form_url='', extra_context=None):
         """
         Redirect the PageLayout add_view to the Page add_view
@@ -199,7 +293,7 @@ class PageLayoutAdmin(admin.ModelAdmin):
 
         msg = 'The page "%(obj)s" was changed successfully.' % {
             'name': force_unicode(verbose_name),
-            'obj': force_unicode(obj.page.all()[0])
+            'obj': force_unicode(self.get_page(obj))
         }
         if "_continue" in request.POST:
             self.message_user(request, msg + ' ' + \
@@ -215,44 +309,45 @@ class PageLayoutAdmin(admin.ModelAdmin):
             url = self.get_default_response_change_url()
             return HttpResponseRedirect(url)
 
-# Dynamically register admins for each registered PageLayout subclass
-for page_layout in pagemanager_site._registry:
-    # Overrides provided in the PageLayout subclass' PageManagerMeta class
-    meta = page_layout._meta
-    pm_meta = page_layout._pagemanager_meta
-    # Dynamically create a subclass of PageLayoutAdmin for this
-    # particular layout. The reason we do this is that we don't want
-    # to pollute PageLayoutAdmin with layout-sepcific settings. Otherwise
-    # settings from one layout might bleed through to the next.
-    class_body_dict = dict(PageLayoutAdmin.__dict__)
-    if pm_meta.admin_mixin_dict:
-        class_body_dict.update(pm_meta.admin_mixin_dict)
-    # Create a ``Media`` class for ``admin_media_js`` or ``admin_media_css``
-    # fields and attach to the Admin class.
-    if pm_meta.admin_media_js or pm_meta.admin_media_css:
-        css = pm_meta.admin_media_css or {}
-        js = pm_meta.admin_media_js or ()
-        class_body_dict['media'] = Media(css=css, js=js)
-    # Create an Admin class dynamically.
-    layoutadmin_cls = type(
-        PageLayoutAdmin.__name__,
-        (PageLayoutAdmin,),
-        class_body_dict
-    )
-    
-    if pm_meta.formfield_overrides:
-        layoutadmin_cls.formfield_overrides.update(pm_meta.formfield_overrides)
-    if pm_meta.fieldsets:
-        layoutadmin_cls.fieldsets = pm_meta.fieldsets
-    if meta.verbose_name:
-        layoutadmin_cls.verbose_name = meta.verbose_name
-    if meta.verbose_name_plural:
-        layoutadmin_cls.verbose_name_plural = meta.verbose_name_plural
-    if pm_meta.inlines:
-        layoutadmin_cls.inlines = PageLayoutAdmin.inlines + pm_meta.inlines
-    if pm_meta.readonly_fields:
-        layoutadmin_cls.readonly_fields = pm_meta.readonly_fields
-    if pm_meta.exclude:
-        layoutadmin_cls.exclude = PageLayoutAdmin.exclude + pm_meta.exclude
-
-    admin.site.register(page_layout, layoutadmin_cls)
+class PageGrantAdmin(admin.ModelAdmin):
+    list_display = ('page', 'user', 'group')
+    list_filter = ('group',)
+    raw_id_fields = ('page', 'user')
+
+admin.site.register(PageGrant, PageGrantAdmin)
+
+
+def get_layout_admin(page_layout):
+    """
+    Returns the admin class for a PageLayout subclass: PageLayoutAdmin, or,
+    if the layout has an ``admin_mixin_dict``, a subclass of it with the
+    dictionary as its body, so that methods, properties and other
+    descriptors behave as if they had been defined on the class.
+    """
+    mixin_dict = page_layout._pagemanager_meta.admin_mixin_dict
+    if not mixin_dict:
+        return PageLayoutAdmin
+    return type('%sAdmin' % page_layout.__name__, (PageLayoutAdmin,),
+        dict(mixin_dict))
+
+
+def register_layout_admins(site=admin.site):
+    """
+    Registers an admin with the admin site for each registered PageLayout
+    subclass that doesn't have one yet.
+    """
+    for page_layout in pagemanager_site._registry:
+        if page_layout not in site._registry:
+            site.register(page_layout, get_layout_admin(page_layout))
+
+
+def _get_urls_with_layouts(get_urls):
+    def get_urls_with_layouts():
+        register_layout_admins()
+        return get_urls()
+    return get_urls_with_layouts
+
+# The layout admins are built when the admin site first builds its URLs,
+# which it does before it serves anything, rather than when this module is
+# imported.
+admin.site.get_urls = _get_urls_with_layouts(admin.site.get_urls)
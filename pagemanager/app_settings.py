@@ -1,11 +1,19 @@
 from django.conf import settings
 from django.db.models import get_model
 
-from pagemanager.util import get_pagemanager_model, get_pagemanager_modeladmin
-
 PAGEMANAGER_DEFAULT_TEMPLATE = getattr(settings,
     'PAGEMANAGER_DEFAULT_TEMPLATE',
     'base.html'
 )
+
+# How long, in seconds, rendered navigation fragments are kept in the cache.
+# Fragments are invalidated whenever the page tree changes, so this only
+# bounds how long an orphaned entry lingers.
+PAGEMANAGER_CACHE_TIMEOUT = getattr(settings,
+    'PAGEMANAGER_CACHE_TIMEOUT',
+    60 * 60 * 24
+)
+
+from pagemanager.util import get_pagemanager_model
+
 PAGEMANAGER_PAGE_MODEL = get_pagemanager_model()
-PAGEMANAGER_PAGE_MODELADMIN = get_pagemanager_modeladmin()
\ No newline at end of file
@@ -0,0 +1,597 @@
+"""
+Benchmarks of pagemanager's hot paths: query counts and timings for each
+operation, run against a synthetic page tree. Run them with the
+``benchmark_pagemanager`` management command, which sets up a throwaway test
+database and writes the results as JSON, so that they can be compared across
+versions.
+"""
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+from itertools import count
+
+import django
+from django.contrib import admin
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.core.signals import request_started
+from django.db import DatabaseError, connection, reset_queries, transaction
+from django.test.client import Client, RequestFactory
+
+from pagemanager.app_settings import PAGEMANAGER_PAGE_MODEL
+from pagemanager.models import PlaceholderPage, RedirectPage
+from pagemanager.permissions import get_public_visibility_name
+from pagemanager.transfer import FORMAT_NAME, FORMAT_VERSION, load_pages
+from pagemanager.tree import get_tree_backend
+from pagemanager.util import get_page_from_path
+
+BENCHMARK_TEMPLATE = 'pagemanager/benchmarks/page.html'
+
+BENCHMARKS = []
+
+
+def benchmark(name, repeat=None):
+    """
+    Registers the decorated function as a benchmark. It is passed the
+    ``SyntheticTree`` being benchmarked and returns a callable, which is
+    timed, along with the number of operations each call performs.
+
+    Benchmarks whose operations cannot be repeated against the same data
+    pass ``repeat=1``.
+    """
+    def decorator(func):
+        BENCHMARKS.append((name, func, repeat))
+        return func
+    return decorator
+
+
+class QueryCounter(object):
+    """
+    A context manager that counts the queries run, and the time spent, inside
+    it. The queries themselves are kept in ``captured``.
+
+    Django clears the query log as each request starts, which would lose
+    the queries of test client requests, so that is suspended meanwhile.
+    """
+    def __enter__(self):
+        self.old_debug_cursor = connection.use_debug_cursor
+        connection.use_debug_cursor = True
+        request_started.disconnect(reset_queries)
+        self.start_queries = len(connection.queries)
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.seconds = time.time() - self.start
+        self.captured = connection.queries[self.start_queries:]
+        self.queries = len(self.captured)
+        connection.use_debug_cursor = self.old_debug_cursor
+        request_started.connect(reset_queries)
+
+
+def _sample_fields(model):
+    """
+    Returns values for the required fields of a layout model, so that
+    arbitrary layouts can be included in the synthetic tree.
+    """
+    from django.db import models
+    fields = {}
+    for field in model._meta.local_fields:
+        if isinstance(field, models.AutoField) or field.null or \
+            field.has_default() or isinstance(field, models.ForeignKey):
+            continue
+        if isinstance(field, models.URLField):
+            fields[field.name] = 'http://example.com/'
+        elif isinstance(field, (models.CharField, models.TextField)):
+            fields[field.name] = 'Lorem ipsum'
+        elif isinstance(field, (models.IntegerField, models.FloatField,
+            models.DecimalField)):
+            fields[field.name] = 0
+    return fields
+
+
+class SyntheticTree(object):
+    """
+    A generated tree of pages of roughly ``size`` pages, ``depth`` levels
+    deep, whose layouts are drawn from ``layouts`` in turn.
+    """
+    def __init__(self, size=1000, depth=4, layouts=None, seed=0):
+        self.size = size
+        self.depth = depth
+        self.layouts = layouts or [PlaceholderPage, RedirectPage]
+        self.random = random.Random(seed)
+        # The smallest branching factor that reaches the requested size.
+        self.branching = 1
+        while sum([self.branching ** level
+            for level in range(1, depth + 1)]) < size:
+            self.branching += 1
+
+    def iter_lines(self):
+        yield json.dumps({'format': FORMAT_NAME, 'version': FORMAT_VERSION})
+        pks = count(1)
+        remaining = [self.size]
+        layout_fields = [(layout, _sample_fields(layout))
+            for layout in self.layouts]
+
+        def walk(parent, level):
+            for index in range(self.branching):
+                if not remaining[0]:
+                    return
+                remaining[0] -= 1
+                pk = pks.next()
+                layout, fields = layout_fields[pk % len(layout_fields)]
+                yield json.dumps({
+                    'pk': pk,
+                    'parent': parent,
+                    'copy_of': None,
+                    'fields': {
+                        'title': 'Page %d' % pk,
+                        'slug': 'page-%d' % pk,
+                        'order': index,
+                        'status': 'published',
+                        'visibility': 'public',
+                    },
+                    'layout': {
+                        'model': '%s.%s' % (layout._meta.app_label,
+                            layout._meta.module_name),
+                        'fields': fields,
+                    },
+                })
+                if level < self.depth:
+                    for line in walk(pk, level + 1):
+                        yield line
+
+        while remaining[0]:
+            for line in walk(None, 1):
+                yield line
+
+    def create(self):
+        load_pages(self.iter_lines())
+        self.refresh()
+
+    def refresh(self):
+        """
+        Reads the pages again, after benchmarks have added or moved some.
+        """
+        self.pages = list(PAGEMANAGER_PAGE_MODEL.objects.order_by('lft'))
+        self.max_level = max([page.level for page in self.pages])
+
+    def sample(self, n=20, **filters):
+        """
+        Returns up to ``n`` pages, chosen from the deepest level of the tree
+        unless other filters are passed.
+        """
+        pages = [page for page in self.pages
+            if all([getattr(page, k) == v for k, v in filters.items()])]
+        if not filters:
+            pages = [page for page in pages if page.level == self.max_level]
+        return self.random.sample(pages, min(n, len(pages)))
+
+
+def get_superuser():
+    try:
+        return User.objects.get(username='benchmark')
+    except User.DoesNotExist:
+        return User.objects.create_superuser('benchmark',
+            'benchmark@example.com', 'benchmark')
+
+
+def get_page_admin():
+    # Importing pagemanager.admin registers the page admin, which the
+    # package no longer imports on its own.
+    import pagemanager.admin
+    return admin.site._registry[PAGEMANAGER_PAGE_MODEL]
+
+
+@benchmark('get_page_from_path')
+def bench_get_page_from_path(tree):
+    paths = [page.materialized_path for page in tree.sample()]
+
+    def run():
+        for path in paths:
+            get_page_from_path(path)
+    return run, len(paths)
+
+
+@benchmark('page_view')
+def bench_page_view(tree):
+    from pagemanager.views import PageView
+    factory = RequestFactory()
+    placeholder_type = ContentType.objects.get_for_model(PlaceholderPage)
+    pages = tree.sample(layout_type_id=placeholder_type.pk)
+    view = PageView.as_view()
+    user = get_superuser()
+    # Layouts without a template of their own are rendered with a minimal
+    # one, only while the benchmark runs.
+    untemplated = [(layout._pagemanager_meta,
+        layout._pagemanager_meta.template_file) for layout in tree.layouts
+        if not layout._pagemanager_meta.template_file]
+
+    def run():
+        for meta, template_file in untemplated:
+            meta.template_file = BENCHMARK_TEMPLATE
+        try:
+            for page in pages:
+                request = factory.get('/%s/' % page.materialized_path)
+                request.user = user
+                response = view(request, path=page.materialized_path)
+                if hasattr(response, 'render'):
+                    response.render()
+        finally:
+            for meta, template_file in untemplated:
+                meta.template_file = template_file
+    return run, len(pages)
+
+
+@benchmark('admin_index')
+def bench_admin_index(tree):
+    from django.core.urlresolvers import reverse
+    client = Client()
+    get_superuser()
+    client.login(username='benchmark', password='benchmark')
+    url = reverse('admin:index')
+
+    def run():
+        client.get(url)
+    return run, 1
+
+
+@benchmark('parents_orders_view')
+def bench_parents_orders_view(tree):
+    factory = RequestFactory()
+    page_admin = get_page_admin()
+    # The client posts the parent and sibling position of every page.
+    data = {}
+    for page in tree.pages:
+        data[str(page.pk)] = '%s,%s' % (page.parent_id or '', page.order)
+    moved = tree.sample(1)[0]
+    new_parent = tree.sample(1, level=1)[0]
+    user = get_superuser()
+    # Every run moves the page, alternately to the first child of another
+    # page and back to where it was.
+    positions = ['%s,%s' % (new_parent.pk, 0), data[str(moved.pk)]]
+
+    def run():
+        post = dict(data)
+        post[str(moved.pk)] = positions[0]
+        request = factory.post('/', post)
+        request.user = user
+        page_admin.parents_orders_view(request)
+        positions.reverse()
+    return run, 1
+
+
+def sample_uncopied(tree, n):
+    """
+    Returns up to ``n`` pages of the tree, with layouts, that don't have a
+    draft copy yet.
+    """
+    copied = set(PAGEMANAGER_PAGE_MODEL.objects.filter(
+        copy_of__isnull=False).values_list('copy_of', flat=True))
+    pages = [page for page in tree.pages
+        if page.layout_type_id and page.pk not in copied]
+    return tree.random.sample(pages, min(n, len(pages)))
+
+
+@benchmark('copy_page', repeat=1)
+def bench_copy_page(tree):
+    page_admin = get_page_admin()
+    pages = sample_uncopied(tree, 5)
+
+    def run():
+        for page in pages:
+            page = PAGEMANAGER_PAGE_MODEL.objects.get(pk=page.pk)
+            page_admin._copy_page(page)
+    return run, len(pages)
+
+
+@benchmark('merge_item', repeat=1)
+def bench_merge_item(tree):
+    page_admin = get_page_admin()
+    # The copies to merge are made here, so that they aren't measured.
+    copies = []
+    for page in sample_uncopied(tree, 5):
+        page = PAGEMANAGER_PAGE_MODEL.objects.get(pk=page.pk)
+        copies.append((page.pk, page_admin._copy_page(page).pk))
+    operations = len(copies)
+
+    def run():
+        while copies:
+            original_pk, copy_pk = copies.pop()
+            original = PAGEMANAGER_PAGE_MODEL.objects.get(pk=original_pk)
+            copy = PAGEMANAGER_PAGE_MODEL.objects.get(pk=copy_pk)
+            page_admin._merge_item(original, copy)
+    return run, operations
+
+
+@benchmark('insert_page')
+def bench_insert_page(tree):
+    parents = tree.sample(10)
+    counter = count()
+
+    def run():
+        for parent in parents:
+            number = counter.next()
+            PAGEMANAGER_PAGE_MODEL.objects.create(
+                title='Inserted %d' % number,
+                slug='inserted-%d' % number,
+                parent=parent,
+            )
+    return run, len(parents)
+
+
+@benchmark('move_page')
+def bench_move_page(tree):
+    # Moves branches back and forth between the first and last roots, as
+    # the admin's drag and drop does.
+    roots = sorted([page.pk for page in tree.pages if page.level == 0])
+    first, last = roots[0], roots[-1]
+    pages = [page for page in tree.pages if page.level == 1 and
+        page.parent_id in (first, last)]
+    pages = tree.random.sample(pages, min(10, len(pages)))
+
+    def run():
+        for page in pages:
+            page = PAGEMANAGER_PAGE_MODEL.objects.get(pk=page.pk)
+            # The target's tree fields change with every move.
+            page.parent = PAGEMANAGER_PAGE_MODEL.objects.get(
+                pk=page.parent_id == first and last or first)
+            page.save()
+    return run, len(pages)
+
+
+@benchmark('recalculate_mp')
+def bench_recalculate_mp(tree):
+    from StringIO import StringIO
+    from django.core.management import call_command
+
+    def run():
+        call_command('recalculate_mp', stdout=StringIO())
+    return run, 1
+
+
+# Representative queries, each built from a tree, whose plans and timings are
+# recorded with ``--plans``.
+PLAN_QUERIES = (
+    ('path_lookup', lambda tree: PAGEMANAGER_PAGE_MODEL.objects.filter(
+        materialized_path=tree.sample(1)[0].materialized_path)),
+    ('descendants', lambda tree: PAGEMANAGER_PAGE_MODEL.objects.filter(
+        materialized_path__startswith=tree.sample(1, level=1)[0]
+            .materialized_path + '/')),
+    ('child_by_slug', lambda tree: (lambda page:
+        PAGEMANAGER_PAGE_MODEL.objects.filter(parent=page.parent_id,
+            slug=page.slug))(tree.sample(1)[0])),
+    ('children_in_order', lambda tree: PAGEMANAGER_PAGE_MODEL.objects.filter(
+        parent=tree.sample(1, level=1)[0].pk).order_by('order')),
+    ('homepage', lambda tree: PAGEMANAGER_PAGE_MODEL.objects.filter(
+        is_homepage=True)),
+    ('draft_copy', lambda tree: PAGEMANAGER_PAGE_MODEL.objects.filter(
+        copy_of=tree.sample(1)[0].pk)),
+    ('layout_page', lambda tree: (lambda page:
+        PAGEMANAGER_PAGE_MODEL.objects.filter(layout_type=page.layout_type_id,
+            object_id=page.object_id))(tree.sample(1)[0])),
+    ('published_public', lambda tree: PAGEMANAGER_PAGE_MODEL.objects
+        .published().filter(visibility=get_public_visibility_name())[:50]),
+)
+
+EXPLAIN_PREFIXES = {
+    'postgresql': 'EXPLAIN ANALYZE ',
+    'mysql': 'EXPLAIN ',
+    'sqlite': 'EXPLAIN QUERY PLAN ',
+}
+
+QUERY_INDEX_TABLE = 'pagemanager_page'
+
+
+def get_query_indexes():
+    """
+    Returns the name and definition of each of the indexes that migrations
+    0005, 0007 and 0009 add for pagemanager's query patterns, as they create
+    them on the current database.
+    """
+    qn = connection.ops.quote_name
+    path_column = {
+        'postgresql': '"materialized_path" text_pattern_ops',
+        'mysql': '`materialized_path`(255)',
+    }.get(connection.vendor, qn('materialized_path'))
+    sort_path_column = {
+        'mysql': '`sort_path`(255)',
+    }.get(connection.vendor, qn('sort_path'))
+    homepage_condition = {
+        'postgresql': ' WHERE "is_homepage"',
+        'sqlite': ' WHERE "is_homepage" = 1',
+    }.get(connection.vendor, '')
+    return [
+        ('pagemanager_page_materialized_path', path_column, ''),
+        ('pagemanager_page_sort_path', sort_path_column, ''),
+        ('pagemanager_page_layout_type_id_object_id',
+            '%s, %s' % (qn('layout_type_id'), qn('object_id')), ''),
+        ('pagemanager_page_status_visibility',
+            '%s, %s' % (qn('status'), qn('visibility')), ''),
+        ('pagemanager_page_parent_id_order',
+            '%s, %s' % (qn('parent_id'), qn('order')), ''),
+        ('pagemanager_page_is_homepage', qn('is_homepage'),
+            homepage_condition),
+    ]
+
+
+@transaction.commit_on_success
+def _execute_index_statements(statements):
+    # Statements for indexes that already exist, or don't, fail; each runs
+    # in a savepoint so that the failure doesn't abort the others.
+    cursor = connection.cursor()
+    executed = []
+    for name, sql in statements:
+        sid = transaction.savepoint()
+        try:
+            cursor.execute(sql)
+        except DatabaseError:
+            transaction.savepoint_rollback(sid)
+        else:
+            transaction.savepoint_commit(sid)
+            executed.append(name)
+    return executed
+
+
+def create_query_indexes():
+    """
+    Creates the indexes added for pagemanager's query patterns, which a
+    synced rather than migrated database lacks. Returns the names of the
+    indexes created; those that exist already are skipped.
+    """
+    qn = connection.ops.quote_name
+    return _execute_index_statements([
+        (name, 'CREATE INDEX %s ON %s (%s)%s' % (qn(name),
+            qn(QUERY_INDEX_TABLE), columns, condition))
+        for name, columns, condition in get_query_indexes()
+    ])
+
+
+def drop_query_indexes():
+    """
+    Drops the indexes added for pagemanager's query patterns, so that plans
+    can be compared with and without them. Returns the names of the indexes
+    dropped.
+    """
+    qn = connection.ops.quote_name
+    if connection.vendor == 'mysql':
+        template = 'DROP INDEX %s ON ' + qn(QUERY_INDEX_TABLE)
+    else:
+        template = 'DROP INDEX %s'
+    return _execute_index_statements([(name, template % qn(name))
+        for name, columns, condition in get_query_indexes()])
+
+
+def explain(queryset):
+    """
+    Returns the database's plan for a queryset as a list of lines, or None
+    if the database isn't known to support EXPLAIN.
+    """
+    prefix = EXPLAIN_PREFIXES.get(connection.vendor)
+    if prefix is None:
+        return None
+    sql, params = queryset.query.sql_with_params()
+    cursor = connection.cursor()
+    if connection.vendor == 'sqlite':
+        # The sqlite3 module caches statements by their SQL, and a cached
+        # EXPLAIN is not prepared again after indexes are created or
+        # dropped, so the schema version is added to the SQL.
+        cursor.execute('PRAGMA schema_version')
+        sql += ' -- schema %d' % cursor.fetchone()[0]
+    cursor.execute(prefix + sql, params)
+    return [' '.join([unicode(column) for column in row])
+        for row in cursor.fetchall()]
+
+
+def measure_query_plans(tree, repeat=3):
+    """
+    Returns the plan and best time of each of the PLAN_QUERIES against the
+    passed tree.
+    """
+    results = {}
+    for name, build in PLAN_QUERIES:
+        queryset = build(tree)
+        timings = []
+        for i in range(repeat):
+            start = time.time()
+            list(queryset.all())
+            timings.append(time.time() - start)
+        results[name] = {
+            'plan': explain(queryset),
+            'seconds': min(timings),
+        }
+    return results
+
+
+IMPORT_MODULES = ('pagemanager.app_settings', 'pagemanager.views',
+    'pagemanager.admin')
+
+IMPORT_SCRIPT = (
+    'import sys, time; start = time.time(); import %s; '
+    'sys.stdout.write("%%f %%d" %% (time.time() - start, '
+    '"pagemanager.options" in sys.modules))'
+)
+
+
+def measure_import(module_name):
+    """
+    Imports a module in a fresh interpreter, using the current settings, and
+    returns how long the import took and whether it loaded the page admin.
+    """
+    output = subprocess.Popen(
+        [sys.executable, '-c', IMPORT_SCRIPT % module_name],
+        stdout=subprocess.PIPE,
+        env=dict(os.environ),
+    ).communicate()[0]
+    seconds, loaded_admin = output.split()
+    return float(seconds), bool(int(loaded_admin))
+
+
+def measure_imports(module_names=IMPORT_MODULES, repeat=3):
+    """
+    Returns the best import time of each module, each in its own interpreter,
+    and whether importing it loads the page admin.
+    """
+    results = {}
+    for module_name in module_names:
+        timings = [measure_import(module_name) for i in range(repeat)]
+        results[module_name] = {
+            'seconds': min([seconds for seconds, admin in timings]),
+            'loads_admin': timings[0][1],
+        }
+    return results
+
+
+def run_benchmarks(tree, names=None, repeat=3):
+    """
+    Runs the registered benchmarks (or only those named) against the passed
+    tree, which must already have been created, and returns the results.
+    Benchmarks that find nothing to operate on in the tree, such as the
+    page view when no sampled page has a placeholder layout, are reported
+    with null measurements.
+    """
+    results = {}
+    for name, setup, benchmark_repeat in BENCHMARKS:
+        if names and name not in names:
+            continue
+        run, operations = setup(tree)
+        if not operations:
+            results[name] = {
+                'operations': 0,
+                'queries_per_operation': None,
+                'seconds_per_operation': None,
+                'seconds_mean': None,
+            }
+            continue
+        timings = []
+        for i in range(benchmark_repeat or repeat):
+            with QueryCounter() as counter:
+                run()
+            timings.append(counter.seconds)
+        results[name] = {
+            'operations': operations,
+            'queries_per_operation': float(counter.queries) / operations,
+            'seconds_per_operation': min(timings) / operations,
+            'seconds_mean': sum(timings) / len(timings) / operations,
+        }
+    return results
+
+
+def describe_environment(tree):
+    return {
+        'python': sys.version.split()[0],
+        'django': django.get_version(),
+        'database': connection.vendor,
+        'tree_backend': get_tree_backend().name,
+        'tree': {
+            'size': len(tree.pages),
+            'depth': tree.depth,
+            'branching': tree.branching,
+            'layouts': ['%s.%s' % (layout._meta.app_label,
+                layout._meta.module_name) for layout in tree.layouts],
+        },
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
@@ -0,0 +1,66 @@
+import time
+
+from django.core.cache import cache
+
+from pagemanager import app_settings, instrumentation
+
+GENERATION_KEY = 'pagemanager:generation:%s'
+
+
+def get_generation(namespace):
+    """
+    Returns the current generation number for the given cache namespace.
+
+    Rather than keeping track of every key written, each cached value is
+    stored under a key that includes this number; bumping it orphans all of
+    the existing keys at once. Generations are seeded from the clock, so a
+    generation key that has been evicted never brings stale entries back.
+    """
+    key = GENERATION_KEY % namespace
+    generation = cache.get(key)
+    if generation is None:
+        generation = int(time.time())
+        cache.add(key, generation, app_settings.PAGEMANAGER_CACHE_TIMEOUT)
+        generation = cache.get(key, generation)
+    return generation
+
+
+def invalidate(namespace):
+    """
+    Invalidates every value cached in the given namespace.
+    """
+    key = GENERATION_KEY % namespace
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, int(time.time()),
+            app_settings.PAGEMANAGER_CACHE_TIMEOUT)
+
+
+def make_key(namespace, *parts):
+    """
+    Builds a cache key for the given namespace from the passed parts, bound
+    to the current generation of that namespace.
+    """
+    return 'pagemanager:%s:%s:%s' % (
+        namespace,
+        get_generation(namespace),
+        ':'.join([unicode(part) for part in parts]),
+    )
+
+
+def get_or_render(key, render):
+    """
+    Returns the value cached under ``key``, calling ``render`` and caching
+    its result if it is missing. Hits and misses are counted while
+    instrumentation totals are being collected.
+    """
+    value = cache.get(key)
+    if value is None:
+        start = time.time()
+        value = render()
+        cache.set(key, value, app_settings.PAGEMANAGER_CACHE_TIMEOUT)
+        instrumentation.record('cache_miss', time.time() - start)
+    else:
+        instrumentation.record('cache_hit', 0.0)
+    return value
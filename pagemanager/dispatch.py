@@ -0,0 +1,215 @@
+"""
+Deferred dispatch of pagemanager's signals.
+
+Receivers of ``page_edited`` and ``page_moved`` that are connected with
+``deferred_receiver`` declare that they are safe to run later, on another
+thread. When the PAGEMANAGER_DEFERRED_SIGNALS setting is true, they are not
+run while the signal is sent; the event is recorded instead, and repeated
+events are coalesced: the branch ids and paths of every move are merged into
+a single event, and a page edited several times is handled once. Other
+events, such as the purges following saves in ``pagemanager.purge``, are
+recorded through ``record`` directly.
+
+``pagemanager.middleware.DeferredSignalsMiddleware`` hands the recorded
+events to the queue once the response is complete, after the view's
+transaction has been committed; it should be listed above
+TransactionMiddleware, if that is used. Outside of a request, code that
+writes pages in a transaction, such as the ``import_pages`` and
+``recalculate_mp`` commands, wraps it in ``recording``, which hands the
+events over when the block exits. Other events recorded outside of a request
+are handed over as soon as they are sent. Events are handed over even if
+the request or block failed, since running a receiver too often is harmless
+where missing a change is not.
+
+The queue is the class named in PAGEMANAGER_SIGNAL_QUEUE. The default,
+``ThreadPoolQueue``, runs events on PAGEMANAGER_SIGNAL_WORKERS threads, from
+a queue holding up to PAGEMANAGER_SIGNAL_QUEUE_SIZE events (1000 by
+default). When it is full, the thread handing events over waits for room,
+so that a burst of writes slows down rather than piling up events in
+memory. The queue is drained when the process exits, so that no event is
+ever dropped. ``SyncQueue`` runs events in the calling thread.
+"""
+import atexit
+import logging
+import threading
+import Queue
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import partial
+
+from django.conf import settings
+from django.db import close_connection
+from django.utils.importlib import import_module
+
+from pagemanager.signals import page_edited, page_moved
+
+ENABLED = getattr(settings, 'PAGEMANAGER_DEFERRED_SIGNALS', False)
+
+WORKERS = getattr(settings, 'PAGEMANAGER_SIGNAL_WORKERS', 2)
+
+QUEUE_SIZE = getattr(settings, 'PAGEMANAGER_SIGNAL_QUEUE_SIZE', 1000)
+
+logger = logging.getLogger('pagemanager.dispatch')
+
+_state = threading.local()
+
+
+def _run(receiver, sender, kwargs):
+    try:
+        receiver(sender=sender, **kwargs)
+    except Exception:
+        logger.exception('Deferred receiver %r failed' % receiver)
+
+
+class SyncQueue(object):
+    """
+    Runs every event right away, in the thread that hands it over.
+    """
+    def put(self, job):
+        job()
+
+
+class ThreadPoolQueue(object):
+    """
+    Runs events on a fixed number of worker threads, from a bounded queue.
+    """
+    def __init__(self, workers=None, size=None):
+        self.queue = Queue.Queue(size or QUEUE_SIZE)
+        for i in range(workers or WORKERS):
+            thread = threading.Thread(target=self.work)
+            thread.daemon = True
+            thread.start()
+        # Worker threads are daemons, so the process waits for the queue to
+        # be drained before exiting.
+        atexit.register(self.queue.join)
+
+    def put(self, job):
+        # Blocks while the queue is full.
+        self.queue.put(job)
+
+    def work(self):
+        # Events that the workers' own jobs record are run right away, since
+        # a worker waiting for room in the queue might never get it.
+        _state.in_worker = True
+        while True:
+            job = self.queue.get()
+            try:
+                job()
+            finally:
+                # Each worker has its own database connection.
+                close_connection()
+                self.queue.task_done()
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_queue():
+    global _queue
+    if _queue is None:
+        with _queue_lock:
+            if _queue is None:
+                path = getattr(settings, 'PAGEMANAGER_SIGNAL_QUEUE',
+                    'pagemanager.dispatch.ThreadPoolQueue')
+                module_name, class_name = path.rsplit('.', 1)
+                _queue = getattr(import_module(module_name), class_name)()
+    return _queue
+
+
+def begin():
+    """
+    Starts recording events in the current thread, until ``flush``.
+    """
+    flush()
+    _state.pending = OrderedDict()
+
+
+def flush():
+    """
+    Hands the events recorded in the current thread to the queue, and stops
+    recording.
+    """
+    pending = getattr(_state, 'pending', None)
+    _state.pending = None
+    if pending:
+        queue = get_queue()
+        for (receiver, key), (sender, kwargs) in pending.items():
+            queue.put(partial(_run, receiver, sender, kwargs))
+
+
+@contextmanager
+def recording():
+    """
+    A context manager that records the events sent inside it, and hands them
+    to the queue when it exits. Example usage:
+
+        with dispatch.recording():
+            import_pages()
+
+    where ``import_pages`` commits its transaction before it returns, so
+    that receivers never see uncommitted rows. Inside a request handled by
+    ``DeferredSignalsMiddleware``, or another ``recording`` block, events are
+    already being recorded, and are handed over with the rest.
+    """
+    if not ENABLED or getattr(_state, 'pending', None) is not None:
+        yield
+        return
+    begin()
+    try:
+        yield
+    finally:
+        flush()
+
+
+def record(signal, receiver, sender, kwargs):
+    """
+    Records an event for a deferred receiver, merging it into an earlier
+    event for the same receiver and branch or page where there is one.
+    """
+    pending = getattr(_state, 'pending', None)
+    if pending is None:
+        if getattr(_state, 'in_worker', False):
+            _run(receiver, sender, kwargs)
+        else:
+            get_queue().put(partial(_run, receiver, sender, kwargs))
+        return
+    if signal is page_moved:
+        key = (receiver, None)
+        branch_ids = set(kwargs['branch_ids'])
+        paths = {}
+        for name in ('old_paths', 'new_paths'):
+            paths[name] = dict(kwargs.get(name) or {})
+        if key in pending:
+            earlier = pending[key][1]
+            branch_ids.update(earlier['branch_ids'])
+            # A branch keeps the path it had before its first move, and
+            # takes the one it has after its last.
+            paths['old_paths'].update(earlier['old_paths'])
+            for pk, path in earlier['new_paths'].items():
+                paths['new_paths'].setdefault(pk, path)
+        pending[key] = (sender, dict(kwargs, branch_ids=branch_ids, **paths))
+    elif signal is page_edited:
+        key = (receiver, kwargs['page'].pk)
+        created = kwargs.get('created', False)
+        if key in pending:
+            created = created or pending[key][1].get('created', False)
+        pending[key] = (sender, dict(kwargs, created=created))
+    else:
+        pending[(receiver, len(pending))] = (sender, kwargs)
+
+
+def deferred_receiver(signal, dispatch_uid):
+    """
+    A decorator that connects a receiver which may be run after the
+    transaction has been committed, on another thread. Unless deferred
+    dispatch is enabled, it is run when the signal is sent, like any other.
+    """
+    def decorator(func):
+        def dispatch(sender, **kwargs):
+            if ENABLED:
+                record(signal, func, sender, kwargs)
+            else:
+                func(sender=sender, **kwargs)
+        signal.connect(dispatch, weak=False, dispatch_uid=dispatch_uid)
+        return func
+    return decorator
@@ -0,0 +1,127 @@
+"""
+Subtree-scoped permissions.
+
+A PageGrant limits a user, or every member of a group, to the subtree below
+(and including) a page. A user with grants keeps their model permissions,
+such as ``change_page``, but only within the granted subtrees. Superusers
+and users without any grants keep the site-wide scope of their
+permissions, so grants only ever narrow what a user can do.
+
+Each user's grants are cached as a short list of granted roots, each as a
+tuple of its primary key, its materialized path and its ancestor ids. A
+page is checked against the list in memory, through its own ancestor ids,
+so checking every node of the admin tree costs no queries; a queryset is
+limited to the granted subtrees with a single query on indexed paths.
+The cached lists are invalidated when pages, grants or group memberships
+change, and when users or groups are deleted.
+"""
+from django.contrib.auth.models import Group, User
+from django.db.models import Q
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from pagemanager import cache
+from pagemanager.models import Page, PageGrant
+from pagemanager.signals import page_moved
+from pagemanager.tree import split_ids
+
+
+def get_granted_roots(user):
+    """
+    Returns the roots of the subtrees the user is limited to, or None if the
+    user is not limited at all. The list is cached across requests, and on
+    the user object for the rest of the request.
+    """
+    if user is None or not user.is_authenticated() or user.is_superuser:
+        return None
+    if not hasattr(user, '_pagemanager_grants'):
+        def render():
+            grants = PageGrant.objects.filter(
+                Q(user=user) | Q(group__in=user.groups.all())
+            ).values_list('page', 'page__materialized_path',
+                'page__ancestor_ids').distinct()
+            # An empty list is a valid result, so it is wrapped to tell it
+            # apart from a cache miss.
+            return {'roots': list(grants)}
+        roots = cache.get_or_render(cache.make_key('grants', user.pk),
+            render)['roots']
+        user._pagemanager_grants = roots or None
+    return user._pagemanager_grants
+
+
+def is_granted(user, page):
+    """
+    Returns True if the user may work on the page: it is unlimited, or the
+    page is one of its granted roots or below one of them.
+    """
+    roots = get_granted_roots(user)
+    if roots is None:
+        return True
+    root_pks = set([pk for pk, path, ancestor_ids in roots])
+    if page.pk in root_pks:
+        return True
+    return bool(root_pks.intersection(page.get_ancestor_ids()))
+
+
+def can_place_under(user, parent):
+    """
+    Returns True if the user may add or move pages below ``parent``, or at
+    the root of the site if it is None.
+    """
+    if parent is None:
+        return get_granted_roots(user) is None
+    return is_granted(user, parent)
+
+
+def filter_granted(queryset, user, include_ancestors=False):
+    """
+    Limits a queryset of pages to the subtrees the user is limited to, if
+    any. If ``include_ancestors`` is true, the ancestors of the granted roots
+    are kept too, so that the tree leading to them can be displayed.
+    """
+    roots = get_granted_roots(user)
+    if roots is None:
+        return queryset
+    q = Q()
+    for pk, path, ancestor_ids in roots:
+        q |= Q(materialized_path=path) | \
+            Q(materialized_path__startswith=path + '/')
+        if include_ancestors and ancestor_ids:
+            q |= Q(pk__in=split_ids(ancestor_ids))
+    return queryset.filter(q)
+
+
+@receiver(post_save, dispatch_uid='pm_grants_save')
+@receiver(post_delete, dispatch_uid='pm_grants_delete')
+def invalidate_grants(sender, instance, **kwargs):
+    """
+    Granted roots are cached with their paths and ancestors, so the cache is
+    invalidated whenever grants or pages change.
+    """
+    if isinstance(instance, (Page, PageGrant)):
+        cache.invalidate('grants')
+
+
+@receiver(post_delete, sender=User, dispatch_uid='pm_grants_user_delete')
+@receiver(post_delete, sender=Group, dispatch_uid='pm_grants_group_delete')
+def invalidate_grants_on_account_delete(sender, **kwargs):
+    """
+    Deleting a group removes its members without sending ``m2m_changed``.
+    """
+    cache.invalidate('grants')
+
+
+@receiver(m2m_changed, sender=User.groups.through,
+    dispatch_uid='pm_grants_membership')
+def invalidate_grants_on_membership(sender, action, **kwargs):
+    """
+    A user's grants include those of their groups, so they change as users
+    join and leave groups.
+    """
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        cache.invalidate('grants')
+
+
+@receiver(page_moved, dispatch_uid='pm_grants_moved')
+def invalidate_grants_on_move(sender, **kwargs):
+    cache.invalidate('grants')
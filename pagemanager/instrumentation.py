@@ -0,0 +1,150 @@
+"""
+Opt-in instrumentation of the work pagemanager does while serving a request.
+
+When the PAGEMANAGER_INSTRUMENTATION setting is true, each instrumented
+operation records how often it ran and how long it took, and
+``pagemanager.middleware.InstrumentationMiddleware`` hands the totals for
+each request to the sinks listed in PAGEMANAGER_INSTRUMENTATION_SINKS.
+
+When it is false (the default), ``instrumented`` returns functions untouched
+and ``measure`` returns a shared no-op context manager, so instrumented code
+pays next to nothing.
+"""
+import logging
+import threading
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.utils.importlib import import_module
+
+ENABLED = getattr(settings, 'PAGEMANAGER_INSTRUMENTATION', False)
+
+logger = logging.getLogger('pagemanager.instrumentation')
+
+_local = threading.local()
+
+
+class NullTimer(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+NULL_TIMER = NullTimer()
+
+
+class Timer(object):
+    def __init__(self, operation):
+        self.operation = operation
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *exc_info):
+        record(self.operation, time.time() - self.start)
+        return False
+
+
+def record(operation, seconds):
+    """
+    Adds a single run of ``operation`` to the totals of the current request.
+    Outside of a request being collected, this does nothing.
+    """
+    stats = getattr(_local, 'stats', None)
+    if stats is not None:
+        totals = stats.setdefault(operation, [0, 0.0])
+        totals[0] += 1
+        totals[1] += seconds
+
+
+def measure(operation):
+    """
+    Returns a context manager that records the time spent inside it under
+    the passed operation name. Example usage:
+
+        with measure('layout_loading'):
+            layout = page.page_layout
+
+    """
+    if not ENABLED:
+        return NULL_TIMER
+    return Timer(operation)
+
+
+def instrumented(operation):
+    """
+    A decorator that records every call of the decorated function under the
+    passed operation name.
+    """
+    def decorator(func):
+        if not ENABLED:
+            return func
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with Timer(operation):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def start_collection():
+    _local.stats = {}
+
+
+def stop_collection():
+    """
+    Stops collecting for the current request and returns its totals, as a
+    dictionary mapping operation names to (count, seconds) lists.
+    """
+    stats = getattr(_local, 'stats', None) or {}
+    _local.stats = None
+    return stats
+
+
+def logging_sink(request, response, stats):
+    """
+    Logs the totals of each request at the DEBUG level.
+    """
+    if stats:
+        logger.debug('%s %s' % (request.path, ', '.join([
+            '%s: %d in %.1fms' % (operation, calls, seconds * 1000)
+            for operation, (calls, seconds) in sorted(stats.items())
+        ])))
+
+
+def header_sink(request, response, stats):
+    """
+    Adds the totals of each request to the response as X-Pagemanager-*
+    headers. Only active when DEBUG is true.
+    """
+    if settings.DEBUG:
+        for operation, (calls, seconds) in stats.items():
+            header = 'X-Pagemanager-%s' % operation.replace('_', '-').title()
+            response[header] = '%d;%.1fms' % (calls, seconds * 1000)
+
+SINK_ALIASES = {
+    'logging': logging_sink,
+    'headers': header_sink,
+}
+
+
+def get_sinks():
+    """
+    Returns the callables named in the PAGEMANAGER_INSTRUMENTATION_SINKS
+    setting. Each is either one of the aliases "logging" or "headers", or the
+    dotted path to a function taking the request, the response and the
+    totals.
+    """
+    sinks = []
+    for name in getattr(settings, 'PAGEMANAGER_INSTRUMENTATION_SINKS',
+        ('logging',)):
+        if name in SINK_ALIASES:
+            sinks.append(SINK_ALIASES[name])
+        else:
+            module_name, func_name = name.rsplit('.', 1)
+            sinks.append(getattr(import_module(module_name), func_name))
+    return sinks
@@ -0,0 +1,114 @@
+import json
+from optparse import make_option
+
+from django.core import management
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import get_model
+from django.test.utils import setup_test_environment, \
+    teardown_test_environment
+
+from pagemanager.benchmarks import SyntheticTree, run_benchmarks, \
+    create_query_indexes, describe_environment, drop_query_indexes, \
+    measure_imports, measure_query_plans, BENCHMARKS
+from pagemanager.tree import set_tree_backend
+
+
+class Command(BaseCommand):
+    args = ''
+    help = (
+        'Measures query counts and timings of pagemanager operations against '
+        'a synthetic page tree, in a throwaway test database.'
+    )
+    option_list = BaseCommand.option_list + (
+        make_option('--size', dest='size', type='int', default=1000,
+            help='Number of pages in the synthetic tree.'),
+        make_option('--depth', dest='depth', type='int', default=4,
+            help='Number of levels in the synthetic tree.'),
+        make_option('--layouts', dest='layouts', default='',
+            help='Comma-separated app_label.model names of the layouts to '
+                'use, in turn. Defaults to placeholders and redirects.'),
+        make_option('--only', dest='only', default='',
+            help='Comma-separated names of the benchmarks to run.'),
+        make_option('--repeat', dest='repeat', type='int', default=3,
+            help='Number of times each benchmark is repeated.'),
+        make_option('--tree-backend', dest='tree_backend', default=None,
+            help='Tree backend to benchmark, "mptt" or "path"; defaults to '
+                'the PAGEMANAGER_TREE_BACKEND setting.'),
+        make_option('--plans', dest='plans', action='store_true',
+            default=False,
+            help='Record the plans and timings of representative queries. '
+                'Use a large --size, such as 100000, for realistic plans.'),
+        make_option('--drop-indexes', dest='drop_indexes',
+            action='store_true', default=False,
+            help="Then drop pagemanager's query indexes and measure again, "
+                'to compare results and plans with and without them.'),
+        make_option('--skip-imports', dest='skip_imports',
+            action='store_true', default=False,
+            help="Don't measure module import times."),
+        make_option('--output', dest='output', default=None,
+            help='File to write the JSON results to; defaults to standard '
+                'output.'),
+    )
+
+    def handle(self, *args, **options):
+        layouts = []
+        for label in filter(bool, options['layouts'].split(',')):
+            model = get_model(*label.split('.'))
+            if model is None:
+                raise CommandError('Unknown layout model "%s".' % label)
+            layouts.append(model)
+        names = filter(bool, options['only'].split(','))
+        known_names = [name for name, setup, repeat in BENCHMARKS]
+        for name in names:
+            if name not in known_names:
+                raise CommandError('Unknown benchmark "%s".' % name)
+
+        if options['tree_backend']:
+            try:
+                set_tree_backend(options['tree_backend'])
+            except ImproperlyConfigured, e:
+                raise CommandError(e)
+
+        # The test database is created with Django's own syncdb even where
+        # South is installed, as South's test runner does, and the indexes
+        # the migrations would have added are created afterwards, so that
+        # every run measures the same schema.
+        management.get_commands()
+        management._commands['syncdb'] = 'django.core'
+        setup_test_environment()
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0)
+        try:
+            tree = SyntheticTree(size=options['size'],
+                depth=options['depth'], layouts=layouts)
+            tree.create()
+            report = describe_environment(tree)
+            report['created_indexes'] = create_query_indexes()
+            report['results'] = run_benchmarks(tree, names=names,
+                repeat=options['repeat'])
+            if options['plans']:
+                report['plans'] = measure_query_plans(tree,
+                    repeat=options['repeat'])
+            if options['drop_indexes']:
+                report['dropped_indexes'] = drop_query_indexes()
+                tree.refresh()
+                report['results_without_indexes'] = run_benchmarks(tree,
+                    names=names, repeat=options['repeat'])
+                if options['plans']:
+                    report['plans_without_indexes'] = measure_query_plans(
+                        tree, repeat=options['repeat'])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+        if not options['skip_imports']:
+            report['imports'] = measure_imports(repeat=options['repeat'])
+
+        output = json.dumps(report, indent=4, sort_keys=True) + '\n'
+        if options['output']:
+            stream = open(options['output'], 'w')
+            stream.write(output)
+            stream.close()
+        else:
+            self.stdout.write(output)
@@ -0,0 +1,48 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from pagemanager.sitemaps import get_index_queryset, iter_tree, \
+    iter_sitemap_xml, iter_page_index_jsonl
+
+FORMATS = {
+    'xml': iter_sitemap_xml,
+    'jsonl': iter_page_index_jsonl,
+}
+
+
+class Command(BaseCommand):
+    args = ''
+    help = (
+        'Writes an index of all public pages, either as an XML sitemap or as '
+        'JSON Lines.'
+    )
+    option_list = BaseCommand.option_list + (
+        make_option('--format', dest='format', default='xml',
+            help='Output format: "xml" (default) or "jsonl".'),
+        make_option('--base-url', dest='base_url', default='',
+            help='Protocol and domain to prepend to every URL, e.g. '
+                '"http://example.com".'),
+        make_option('--output', dest='output', default=None,
+            help='File to write to; defaults to standard output.'),
+        make_option('--chunk-size', dest='chunk_size', type='int',
+            default=1000, help='Number of pages fetched per query.'),
+    )
+
+    def handle(self, *args, **options):
+        try:
+            serializer = FORMATS[options['format']]
+        except KeyError:
+            raise CommandError('Unknown format "%s".' % options['format'])
+        pages = iter_tree(get_index_queryset(),
+            chunk_size=options['chunk_size'])
+        if options['output']:
+            stream = open(options['output'], 'w')
+        else:
+            stream = self.stdout
+        try:
+            for chunk in serializer(pages, options['base_url'].rstrip('/')):
+                stream.write(chunk.encode('utf-8'))
+        finally:
+            if options['output']:
+                stream.close()
@@ -0,0 +1,40 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from django.http import Http404
+
+from pagemanager.app_settings import PAGEMANAGER_PAGE_MODEL
+from pagemanager.transfer import iter_export
+from pagemanager.util import get_page_from_path
+
+
+class Command(BaseCommand):
+    args = '[path path ...]'
+    help = (
+        'Exports the pages at the given paths, with all of their descendants '
+        'and layouts, as JSON Lines. Exports the whole site if no paths are '
+        'given.'
+    )
+    option_list = BaseCommand.option_list + (
+        make_option('--output', dest='output', default=None,
+            help='File to write to; defaults to standard output.'),
+    )
+
+    def handle(self, *paths, **options):
+        if paths:
+            try:
+                roots = [get_page_from_path(path) for path in paths]
+            except Http404:
+                raise CommandError('No page exists at one of the given paths.')
+        else:
+            roots = PAGEMANAGER_PAGE_MODEL._tree_manager.root_nodes()
+        if options['output']:
+            stream = open(options['output'], 'w')
+        else:
+            stream = self.stdout
+        try:
+            for line in iter_export(roots):
+                stream.write(line)
+        finally:
+            if options['output']:
+                stream.close()
@@ -0,0 +1,61 @@
+import sys
+import time
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.http import Http404
+
+from pagemanager import dispatch
+from pagemanager.transfer import load_pages, TransferError
+from pagemanager.util import get_page_from_path
+
+
+class Command(BaseCommand):
+    args = '<file>'
+    help = (
+        'Imports pages exported with export_pages. Use "-" to read from '
+        'standard input.'
+    )
+    option_list = BaseCommand.option_list + (
+        make_option('--parent', dest='parent', default=None,
+            help='Path of the page to import under. By default, imported '
+                'subtrees become new root pages.'),
+        make_option('--batch-size', dest='batch_size', type='int',
+            default=1000, help='Number of rows per INSERT statement.'),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) != 1:
+            raise CommandError('Exactly one file to import must be given.')
+        parent = None
+        if options['parent']:
+            try:
+                parent = get_page_from_path(options['parent'])
+            except Http404:
+                raise CommandError(
+                    'No page exists at "%s".' % options['parent']
+                )
+        if args[0] == '-':
+            stream = sys.stdin
+        else:
+            stream = open(args[0])
+
+        @transaction.commit_on_success
+        def import_pages():
+            return load_pages(stream, parent=parent,
+                batch_size=options['batch_size'])
+
+        start = time.time()
+        try:
+            # Deferred receivers run once the import has been committed.
+            with dispatch.recording():
+                num_pages = import_pages()
+        except TransferError, e:
+            raise CommandError(unicode(e))
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+        self.stdout.write('Imported %d pages in %.2f seconds.\n' % (
+            num_pages, time.time() - start
+        ))
@@ -0,0 +1,33 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from pagemanager.prerender import prerender
+
+
+class Command(BaseCommand):
+    args = '<output directory>'
+    help = (
+        'Renders every public page to static HTML files below the passed '
+        'directory, and writes a map of redirect pages.'
+    )
+    option_list = BaseCommand.option_list + (
+        make_option('--processes', dest='processes', type='int',
+            default=None, help='Number of worker processes; defaults to the '
+                'number of CPUs.'),
+        make_option('--incremental', dest='incremental', action='store_true',
+            default=False, help='Only render pages modified since the last '
+                'run into the same directory, and their descendants.'),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) != 1:
+            raise CommandError('Pass the output directory.')
+        rendered, errors = prerender(args[0],
+            processes=options['processes'],
+            incremental=options['incremental'])
+        for page_pk, error in errors:
+            self.stderr.write('Page %s: %s\n' % (page_pk, error))
+        self.stdout.write('Rendered %d pages.\n' % rendered)
+        if errors:
+            raise CommandError('%d pages failed to render.' % len(errors))
@@ -0,0 +1,48 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from pagemanager.models import Page, PageSearchEntry, attach_generics
+from pagemanager.search import get_search_entry_values
+from pagemanager.sitemaps import iter_tree
+
+
+class Command(BaseCommand):
+    args = ''
+    help = 'Rebuilds the search index of page content from scratch.'
+    option_list = BaseCommand.option_list + (
+        make_option('--chunk-size', dest='chunk_size', type='int',
+            default=500, help='Number of pages indexed per batch.'),
+    )
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+
+        @transaction.commit_on_success
+        def rebuild():
+            PageSearchEntry.objects.all().delete()
+            count = 0
+            chunk = []
+            for page in iter_tree(Page.objects.all(), chunk_size=chunk_size):
+                chunk.append(page)
+                if len(chunk) == chunk_size:
+                    count += self.index_chunk(chunk)
+                    chunk = []
+            return count + self.index_chunk(chunk)
+
+        count = rebuild()
+        self.stdout.write('Indexed %d pages.\n' % count)
+
+    def index_chunk(self, pages):
+        """
+        Indexes a chunk of pages, fetching their layouts in bulk and writing
+        all of their entries in a single statement.
+        """
+        attach_generics([page for page in pages if page.layout_type_id])
+        PageSearchEntry.objects.bulk_create([
+            PageSearchEntry(page=page, **get_search_entry_values(
+                page, getattr(page, 'page_layout', None)
+            )) for page in pages
+        ])
+        return len(pages)
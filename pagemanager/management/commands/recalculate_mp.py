@@ -2,7 +2,9 @@ from django.core.management.base import BaseCommand
 from django.db import transaction
 from django.utils.encoding import smart_str
 
+from pagemanager import dispatch
 from pagemanager.models import Page
+from pagemanager.tree import recalculate_tree_paths
 
 
 class Command(BaseCommand):
@@ -20,13 +22,19 @@ class Command(BaseCommand):
             self.stdout.write('Recalculating materialized paths...\n')
             results = map(self.repair_page, Page.objects.all())
             num_fixed = len(filter(bool, results))
+            # Then check ancestor ids, levels and tree ids against the
+            # parent of every page.
+            self.stdout.write('Recalculating ancestor ids...\n')
+            num_fixed += recalculate_tree_paths(Page)
             if num_fixed:
                 return "\n%d pages were fixed.\n" % num_fixed
             else:
                 return "\nEverything looks OK!\n"
         
         try:
-            result_message = repair_pages(self)
+            # Deferred receivers run once the repairs have been committed.
+            with dispatch.recording():
+                result_message = repair_pages(self)
         except Exception, e:
             self.stdout.write("An error occured, database rolled back to existsing state.\n")
             self.stdout.write(unicode(e) + "\n")
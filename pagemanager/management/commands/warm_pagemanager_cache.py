@@ -0,0 +1,49 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from pagemanager.warmup import get_top_paths, warm
+
+
+class Command(BaseCommand):
+    help = (
+        'Renders the public pages to fill the cached navigation fragments, '
+        'fills the cached grants of users with page grants, and reports how '
+        'many cache lookups hit afterwards.'
+    )
+    option_list = BaseCommand.option_list + (
+        make_option('--log', dest='log', default=None,
+            help='Only warm the pages requested most often in this access '
+                'log, in the common or combined format.'),
+        make_option('--top', dest='top', type='int', default=1000,
+            help='Number of paths to take from the log; defaults to 1000.'),
+        make_option('--concurrency', dest='concurrency', type='int',
+            default=4, help='Number of pages to render at a time; defaults '
+                'to 4.'),
+        make_option('--sample', dest='sample', type='int', default=20,
+            help='Number of pages to render again to measure readiness; '
+                'defaults to 20.'),
+    )
+
+    def handle(self, *args, **options):
+        paths = None
+        if options['log']:
+            log_file = open(options['log'])
+            try:
+                paths = get_top_paths(log_file, options['top'])
+            finally:
+                log_file.close()
+        result = warm(paths, concurrency=options['concurrency'],
+            sample=options['sample'])
+        for page_pk, error in result['errors']:
+            self.stderr.write('Page %s: %s\n' % (page_pk, error))
+        self.stdout.write('Rendered %d pages and cached the grants of %d '
+            'users.\n' % (result['rendered'], result['users']))
+        lookups = result['hits'] + result['misses']
+        if lookups:
+            self.stdout.write('Readiness: %d of %d cache lookups hit '
+                '(%.1f%%).\n' % (result['hits'], lookups,
+                100.0 * result['hits'] / lookups))
+        if result['errors']:
+            raise CommandError('%d pages failed to render.' %
+                len(result['errors']))
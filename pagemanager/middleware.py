@@ -0,0 +1,123 @@
+from django.contrib.contenttypes.models import ContentType
+from django.core.exceptions import MiddlewareNotUsed
+from django.core.urlresolvers import NoReverseMatch
+from django.http import HttpResponseRedirect
+
+from pagemanager import cache, dispatch, instrumentation, replicas
+from pagemanager.app_settings import PAGEMANAGER_PAGE_MODEL
+from pagemanager.models import RedirectPage
+from pagemanager.permissions import get_public_visibility_name
+from pagemanager.sitemaps import get_url_prefix
+
+
+class InstrumentationMiddleware(object):
+    """
+    Collects the pagemanager instrumentation totals of each request and
+    passes them to the configured sinks. Removes itself from the middleware
+    stack unless PAGEMANAGER_INSTRUMENTATION is true.
+    """
+    def __init__(self):
+        if not instrumentation.ENABLED:
+            raise MiddlewareNotUsed
+        self.sinks = instrumentation.get_sinks()
+
+    def process_request(self, request):
+        instrumentation.start_collection()
+
+    def process_response(self, request, response):
+        stats = instrumentation.stop_collection()
+        for sink in self.sinks:
+            sink(request, response, stats)
+        return response
+
+
+class DeferredSignalsMiddleware(object):
+    """
+    Records the events of deferred signal receivers during each request, and
+    hands them to the queue once the response is complete. List it above
+    TransactionMiddleware, so that the events are handed over after the
+    transaction has been committed. Removes itself from the middleware stack
+    unless PAGEMANAGER_DEFERRED_SIGNALS is true.
+    """
+    def __init__(self):
+        if not dispatch.ENABLED:
+            raise MiddlewareNotUsed
+
+    def process_request(self, request):
+        dispatch.begin()
+
+    def process_response(self, request, response):
+        dispatch.flush()
+        return response
+
+
+class ReadDatabaseMiddleware(object):
+    """
+    Has pages resolved from the PAGEMANAGER_READ_DATABASE during each request,
+    unless the user recently changed pages; see ``pagemanager.replicas``.
+    Removes itself from the middleware stack unless the setting is given.
+    """
+    def __init__(self):
+        if replicas.READ_DATABASE is None:
+            raise MiddlewareNotUsed
+
+    def process_request(self, request):
+        replicas.begin(request)
+
+    def process_response(self, request, response):
+        replicas.finish(request)
+        return response
+
+
+def get_redirect_map():
+    """
+    Returns a dictionary mapping the materialized path of every public
+    redirect page to the URL it redirects to.
+    """
+    pages = PAGEMANAGER_PAGE_MODEL.objects.published().filter(
+        visibility=get_public_visibility_name(),
+        copy_of__isnull=True,
+        layout_type=ContentType.objects.get_for_model(RedirectPage),
+    ).values_list('materialized_path', 'object_id')
+    layouts = RedirectPage.objects.in_bulk([pk for path, pk in pages])
+    return dict([(path, layouts[pk].url) for path, pk in pages
+        if pk in layouts])
+
+
+class RedirectMiddleware(object):
+    """
+    Answers requests for public redirect pages from an in-memory map,
+    without reaching the page views.
+
+    The map is built on the first request and rebuilt whenever the "redirects"
+    cache generation changes, which happens as pages, redirects or the tree
+    change; checking it is a single cache lookup.
+    """
+    def __init__(self):
+        self.generation = None
+        self.redirects = {}
+
+    def get_redirects(self):
+        generation = cache.get_generation('redirects')
+        if generation != self.generation:
+            try:
+                self.prefix = get_url_prefix()
+            except NoReverseMatch:
+                # The pagemanager URL patterns are not mounted, so there are
+                # no page URLs to answer.
+                self.redirects = {}
+            else:
+                self.redirects = get_redirect_map()
+            self.generation = generation
+        return self.redirects
+
+    def process_request(self, request):
+        if request.method not in ('GET', 'HEAD'):
+            return None
+        redirects = self.get_redirects()
+        if not redirects or not request.path_info.startswith(self.prefix):
+            return None
+        url = redirects.get(request.path_info[len(self.prefix):].strip('/'))
+        if url:
+            return HttpResponseRedirect(url)
+        return None
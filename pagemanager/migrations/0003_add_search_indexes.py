@@ -0,0 +1,77 @@
+# encoding: utf-8
+import datetime
+from south.db import db
+from south.v2 import SchemaMigration
+from django.db import models
+
+class Migration(SchemaMigration):
+
+    def forwards(self, orm):
+        
+        # Adding index on 'Page', fields ['title']
+        db.create_index('pagemanager_page', ['title'])
+
+        # On PostgreSQL, add trigram indexes so that substring searches of
+        # the admin page tree don't need a sequential scan. These match the
+        # UPPER(...) LIKE UPPER(...) clauses generated for ``icontains``.
+        # Creating the extension requires sufficient database privileges.
+        if db.backend_name == 'postgres':
+            db.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+            db.execute(
+                'CREATE INDEX "pagemanager_page_title_trgm" ON '
+                '"pagemanager_page" USING gin '
+                '(UPPER("title"::text) gin_trgm_ops)'
+            )
+
+
+    def backwards(self, orm):
+        
+        if db.backend_name == 'postgres':
+            db.execute('DROP INDEX "pagemanager_page_title_trgm"')
+
+        # Removing index on 'Page', fields ['title']
+        db.delete_index('pagemanager_page', ['title'])
+
+
+    models = {
+        'contenttypes.contenttype': {
+            'Meta': {'ordering': "('name',)", 'unique_together': "(('app_label', 'model'),)", 'object_name': 'ContentType', 'db_table': "'django_content_type'"},
+            'app_label': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'model': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '100'})
+        },
+        'pagemanager.page': {
+            'Meta': {'unique_together': "(('parent', 'slug'),)", 'object_name': 'Page'},
+            'copy_of': ('django.db.models.fields.related.OneToOneField', [], {'to': "orm['pagemanager.Page']", 'unique': 'True', 'null': 'True', 'blank': 'True'}),
+            'date_created': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+            'date_modified': ('django.db.models.fields.DateTimeField', [], {'auto_now': 'True', 'blank': 'True'}),
+            'description': ('django.db.models.fields.TextField', [], {'null': 'True', 'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'is_homepage': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'layout_type': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['contenttypes.ContentType']", 'null': 'True', 'blank': 'True'}),
+            'level': ('django.db.models.fields.PositiveIntegerField', [], {'db_index': 'True'}),
+            'lft': ('django.db.models.fields.PositiveIntegerField', [], {'db_index': 'True'}),
+            'materialized_path': ('django.db.models.fields.TextField', [], {'blank': 'True'}),
+            'object_id': ('django.db.models.fields.PositiveIntegerField', [], {'null': 'True', 'blank': 'True'}),
+            'order': ('django.db.models.fields.IntegerField', [], {'default': '99999', 'null': 'True', 'blank': 'True'}),
+            'parent': ('mptt.fields.TreeForeignKey', [], {'blank': 'True', 'related_name': "'children'", 'null': 'True', 'to': "orm['pagemanager.Page']"}),
+            'rght': ('django.db.models.fields.PositiveIntegerField', [], {'db_index': 'True'}),
+            'slug': ('django.db.models.fields.SlugField', [], {'max_length': '32', 'db_index': 'True'}),
+            'status': ('django.db.models.fields.CharField', [], {'default': "'draft'", 'max_length': '32'}),
+            'title': ('django.db.models.fields.CharField', [], {'max_length': '256', 'db_index': 'True'}),
+            'tree_id': ('django.db.models.fields.PositiveIntegerField', [], {'db_index': 'True'}),
+            'visibility': ('django.db.models.fields.CharField', [], {'default': "'public'", 'max_length': '32'})
+        },
+        'pagemanager.placeholderpage': {
+            'Meta': {'object_name': 'PlaceholderPage'},
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'})
+        },
+        'pagemanager.redirectpage': {
+            'Meta': {'object_name': 'RedirectPage'},
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'url': ('django.db.models.fields.URLField', [], {'max_length': '200'})
+        }
+    }
+
+    complete_apps = ['pagemanager']
@@ -0,0 +1,139 @@
+# encoding: utf-8
+import datetime
+from south.db import db
+from south.v2 import SchemaMigration
+from django.db import models
+
+FTS_TABLE = 'pagemanager_pagesearchentry_fts'
+
+
+class Migration(SchemaMigration):
+
+    def forwards(self, orm):
+        
+        # Adding model 'PageSearchEntry'
+        db.create_table('pagemanager_pagesearchentry', (
+            ('id', self.gf('django.db.models.fields.AutoField')(primary_key=True)),
+            ('page', self.gf('django.db.models.fields.related.OneToOneField')(related_name='search_entry', unique=True, to=orm['pagemanager.Page'])),
+            ('title', self.gf('django.db.models.fields.CharField')(max_length=256)),
+            ('text', self.gf('django.db.models.fields.TextField')(blank=True)),
+            ('is_public', self.gf('django.db.models.fields.BooleanField')(default=False, db_index=True)),
+        ))
+        db.send_create_signal('pagemanager', ['PageSearchEntry'])
+
+        if db.backend_name == 'postgres':
+            # A tsvector column, maintained by a trigger, with a GIN index.
+            db.execute(
+                'ALTER TABLE "pagemanager_pagesearchentry" '
+                'ADD COLUMN "document" tsvector'
+            )
+            db.execute(
+                'CREATE INDEX "pagemanager_pagesearchentry_document" ON '
+                '"pagemanager_pagesearchentry" USING gin ("document")'
+            )
+            db.execute(
+                'CREATE TRIGGER "pagemanager_pagesearchentry_document" '
+                'BEFORE INSERT OR UPDATE ON "pagemanager_pagesearchentry" '
+                'FOR EACH ROW EXECUTE PROCEDURE tsvector_update_trigger('
+                '"document", \'pg_catalog.english\', "title", "text")'
+            )
+        elif db.backend_name == 'sqlite3':
+            # An external content FTS5 table, kept in sync by triggers. If
+            # SQLite was built without FTS5, searches fall back to substring
+            # matching.
+            try:
+                db.execute(
+                    'CREATE VIRTUAL TABLE ' + FTS_TABLE + ' USING fts5('
+                    'title, text, content=\'pagemanager_pagesearchentry\', '
+                    'content_rowid=\'id\')'
+                )
+            except Exception:
+                return
+            db.execute(
+                'CREATE TRIGGER pagemanager_pagesearchentry_ai AFTER INSERT '
+                'ON pagemanager_pagesearchentry BEGIN '
+                'INSERT INTO ' + FTS_TABLE + '(rowid, title, text) '
+                'VALUES (new.id, new.title, new.text); END'
+            )
+            db.execute(
+                'CREATE TRIGGER pagemanager_pagesearchentry_ad AFTER DELETE '
+                'ON pagemanager_pagesearchentry BEGIN '
+                'INSERT INTO ' + FTS_TABLE + '(' + FTS_TABLE + ', rowid, '
+                'title, text) VALUES (\'delete\', old.id, old.title, '
+                'old.text); END'
+            )
+            db.execute(
+                'CREATE TRIGGER pagemanager_pagesearchentry_au AFTER UPDATE '
+                'ON pagemanager_pagesearchentry BEGIN '
+                'INSERT INTO ' + FTS_TABLE + '(' + FTS_TABLE + ', rowid, '
+                'title, text) VALUES (\'delete\', old.id, old.title, '
+                'old.text); '
+                'INSERT INTO ' + FTS_TABLE + '(rowid, title, text) '
+                'VALUES (new.id, new.title, new.text); END'
+            )
+
+
+    def backwards(self, orm):
+        
+        if db.backend_name == 'sqlite3':
+            for trigger in ('ai', 'ad', 'au'):
+                db.execute(
+                    'DROP TRIGGER IF EXISTS pagemanager_pagesearchentry_%s'
+                    % trigger
+                )
+            db.execute('DROP TABLE IF EXISTS ' + FTS_TABLE)
+
+        # Deleting model 'PageSearchEntry'
+        db.delete_table('pagemanager_pagesearchentry')
+
+
+    models = {
+        'contenttypes.contenttype': {
+            'Meta': {'ordering': "('name',)", 'unique_together': "(('app_label', 'model'),)", 'object_name': 'ContentType', 'db_table': "'django_content_type'"},
+            'app_label': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'model': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '100'})
+        },
+        'pagemanager.page': {
+            'Meta': {'unique_together': "(('parent', 'slug'),)", 'object_name': 'Page'},
+            'copy_of': ('django.db.models.fields.related.OneToOneField', [], {'to': "orm['pagemanager.Page']", 'unique': 'True', 'null': 'True', 'blank': 'True'}),
+            'date_created': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+            'date_modified': ('django.db.models.fields.DateTimeField', [], {'auto_now': 'True', 'blank': 'True'}),
+            'description': ('django.db.models.fields.TextField', [], {'null': 'True', 'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'is_homepage': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'layout_type': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['contenttypes.ContentType']", 'null': 'True', 'blank': 'True'}),
+            'level': ('django.db.models.fields.PositiveIntegerField', [], {'db_index': 'True'}),
+            'lft': ('django.db.models.fields.PositiveIntegerField', [], {'db_index': 'True'}),
+            'materialized_path': ('django.db.models.fields.TextField', [], {'blank': 'True'}),
+            'object_id': ('django.db.models.fields.PositiveIntegerField', [], {'null': 'True', 'blank': 'True'}),
+            'order': ('django.db.models.fields.IntegerField', [], {'default': '99999', 'null': 'True', 'blank': 'True'}),
+            'parent': ('mptt.fields.TreeForeignKey', [], {'blank': 'True', 'related_name': "'children'", 'null': 'True', 'to': "orm['pagemanager.Page']"}),
+            'rght': ('django.db.models.fields.PositiveIntegerField', [], {'db_index': 'True'}),
+            'slug': ('django.db.models.fields.SlugField', [], {'max_length': '32', 'db_index': 'True'}),
+            'status': ('django.db.models.fields.CharField', [], {'default': "'draft'", 'max_length': '32'}),
+            'title': ('django.db.models.fields.CharField', [], {'max_length': '256', 'db_index': 'True'}),
+            'tree_id': ('django.db.models.fields.PositiveIntegerField', [], {'db_index': 'True'}),
+            'visibility': ('django.db.models.fields.CharField', [], {'default': "'public'", 'max_length': '32'})
+        },
+        'pagemanager.pagesearchentry': {
+            'Meta': {'object_name': 'PageSearchEntry'},
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'is_public': ('django.db.models.fields.BooleanField', [], {'default': 'False', 'db_index': 'True'}),
+            'page': ('django.db.models.fields.related.OneToOneField', [], {'related_name': "'search_entry'", 'unique': 'True', 'to': "orm['pagemanager.Page']"}),
+            'text': ('django.db.models.fields.TextField', [], {'blank': 'True'}),
+            'title': ('django.db.models.fields.CharField', [], {'max_length': '256'})
+        },
+        'pagemanager.placeholderpage': {
+            'Meta': {'object_name': 'PlaceholderPage'},
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'})
+        },
+        'pagemanager.redirectpage': {
+            'Meta': {'object_name': 'RedirectPage'},
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'url': ('django.db.models.fields.URLField', [], {'max_length': '200'})
+        }
+    }
+
+    complete_apps = ['pagemanager']
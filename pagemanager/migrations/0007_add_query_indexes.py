@@ -0,0 +1,104 @@
+# encoding: utf-8
+import datetime
+from south.db import db
+from south.v2 import SchemaMigration
+from django.db import models
+
+HOMEPAGE_INDEX = 'pagemanager_page_is_homepage'
+
+
+class Migration(SchemaMigration):
+
+    def forwards(self, orm):
+        
+        # The reverse generic relation from a layout to its page.
+        db.create_index('pagemanager_page', ['layout_type_id', 'object_id'])
+
+        # ``published()``, ``public()`` and their combinations.
+        db.create_index('pagemanager_page', ['status', 'visibility'])
+
+        # Children in sibling order, and the last sibling of new pages.
+        db.create_index('pagemanager_page', ['parent_id', 'order'])
+
+        # Only a single row is ever marked as the homepage, so where partial
+        # indexes are supported, only that row is indexed.
+        if db.backend_name == 'postgres':
+            db.execute(
+                'CREATE INDEX "' + HOMEPAGE_INDEX + '" ON "pagemanager_page" '
+                '("is_homepage") WHERE "is_homepage"'
+            )
+        elif db.backend_name == 'sqlite3':
+            db.execute(
+                'CREATE INDEX "' + HOMEPAGE_INDEX + '" ON "pagemanager_page" '
+                '("is_homepage") WHERE "is_homepage" = 1'
+            )
+        else:
+            db.create_index('pagemanager_page', ['is_homepage'])
+
+        # The materialized path was indexed in 0005, ``copy_of`` is unique
+        # and (parent, slug) is unique together, so those are covered
+        # already.
+
+
+    def backwards(self, orm):
+        
+        if db.backend_name in ('postgres', 'sqlite3'):
+            db.execute('DROP INDEX "' + HOMEPAGE_INDEX + '"')
+        else:
+            db.delete_index('pagemanager_page', ['is_homepage'])
+        db.delete_index('pagemanager_page', ['parent_id', 'order'])
+        db.delete_index('pagemanager_page', ['status', 'visibility'])
+        db.delete_index('pagemanager_page', ['layout_type_id', 'object_id'])
+
+
+    models = {
+        'contenttypes.contenttype': {
+            'Meta': {'ordering': "('name',)", 'unique_together': "(('app_label', 'model'),)", 'object_name': 'ContentType', 'db_table': "'django_content_type'"},
+            'app_label': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'model': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '100'})
+        },
+        'pagemanager.page': {
+            'Meta': {'unique_together': "(('parent', 'slug'),)", 'object_name': 'Page'},
+            'copy_of': ('django.db.models.fields.related.OneToOneField', [], {'to': "orm['pagemanager.Page']", 'unique': 'True', 'null': 'True', 'blank': 'True'}),
+            'date_created': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+            'date_modified': ('django.db.models.fields.DateTimeField', [], {'auto_now': 'True', 'blank': 'True'}),
+            'description': ('django.db.models.fields.TextField', [], {'null': 'True', 'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'is_homepage': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'layout_type': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['contenttypes.ContentType']", 'null': 'True', 'blank': 'True'}),
+            'level': ('django.db.models.fields.PositiveIntegerField', [], {'db_index': 'True'}),
+            'lft': ('django.db.models.fields.PositiveIntegerField', [], {'db_index': 'True'}),
+            'ancestor_ids': ('django.db.models.fields.TextField', [], {'default': "''", 'blank': 'True'}),
+            'materialized_path': ('django.db.models.fields.TextField', [], {'blank': 'True'}),
+            'object_id': ('django.db.models.fields.PositiveIntegerField', [], {'null': 'True', 'blank': 'True'}),
+            'order': ('django.db.models.fields.IntegerField', [], {'default': '99999', 'null': 'True', 'blank': 'True'}),
+            'parent': ('mptt.fields.TreeForeignKey', [], {'blank': 'True', 'related_name': "'children'", 'null': 'True', 'to': "orm['pagemanager.Page']"}),
+            'rght': ('django.db.models.fields.PositiveIntegerField', [], {'db_index': 'True'}),
+            'slug': ('django.db.models.fields.SlugField', [], {'max_length': '32', 'db_index': 'True'}),
+            'status': ('django.db.models.fields.CharField', [], {'default': "'draft'", 'max_length': '32'}),
+            'title': ('django.db.models.fields.CharField', [], {'max_length': '256', 'db_index': 'True'}),
+            'tree_id': ('django.db.models.fields.PositiveIntegerField', [], {'db_index': 'True'}),
+            'visibility': ('django.db.models.fields.CharField', [], {'default': "'public'", 'max_length': '32'})
+        },
+        'pagemanager.pagesearchentry': {
+            'Meta': {'object_name': 'PageSearchEntry'},
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'is_public': ('django.db.models.fields.BooleanField', [], {'default': 'False', 'db_index': 'True'}),
+            'page': ('django.db.models.fields.related.OneToOneField', [], {'related_name': "'search_entry'", 'unique': 'True', 'to': "orm['pagemanager.Page']"}),
+            'text': ('django.db.models.fields.TextField', [], {'blank': 'True'}),
+            'title': ('django.db.models.fields.CharField', [], {'max_length': '256'})
+        },
+        'pagemanager.placeholderpage': {
+            'Meta': {'object_name': 'PlaceholderPage'},
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'})
+        },
+        'pagemanager.redirectpage': {
+            'Meta': {'object_name': 'RedirectPage'},
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'url': ('django.db.models.fields.URLField', [], {'max_length': '200'})
+        }
+    }
+
+    complete_apps = ['pagemanager']
@@ -1,3 +1,4 @@
+from django.contrib.auth.models import Group, User
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.contenttypes import generic
 from django.core.exceptions import ValidationError
@@ -12,6 +13,8 @@ from mptt.models import MPTTModel
 from pagemanager.permissions import get_published_status_name, \
     get_public_visibility_name
 from pagemanager.managers import PageManager
+from pagemanager.tree import DEFAULT_ORDER, get_next_order, \
+    get_tree_backend
 
 
 def attach_generics(queryset):
@@ -21,7 +24,10 @@ def attach_generics(queryset):
     """
     generics = {}
     for item in queryset:
-        # create a dictionary of object ids per content type id
+        # create a dictionary of object ids per content type id; pages
+        # without a layout are left alone
+        if item.layout_type_id is None:
+            continue
         generics.setdefault(item.layout_type_id, set()).add(item.object_id)
     # fetch all associated content types with the queryset
     content_types = ContentType.objects.in_bulk(generics.keys())
@@ -31,6 +37,8 @@ def attach_generics(queryset):
         ct_model = content_types[ct].model_class()
         relations[ct] = ct_model.objects.in_bulk(list(fk_list))
     for item in queryset:
+        if item.layout_type_id is None:
+            continue
         setattr(
             item, 'page_layout', relations[item.layout_type_id][item.object_id]
         )
@@ -45,8 +53,8 @@ class Page(MPTTModel):
     """
     parent = TreeForeignKey('self', null=True, blank=True,
         related_name='children')
-    order = models.IntegerField(null=True, blank=True, default=99999)
-    title = models.CharField(max_length=256)
+    order = models.IntegerField(null=True, blank=True, default=DEFAULT_ORDER)
+    title = models.CharField(max_length=256, db_index=True)
     description = models.TextField(null=True, blank=True)
     slug = models.SlugField(max_length=32)
     status = models.CharField(max_length=32, default='draft', choices=(
@@ -73,7 +81,15 @@ class Page(MPTTModel):
     layout_type = models.ForeignKey(ContentType, blank=True, null=True)
     object_id = models.PositiveIntegerField(blank=True, null=True)
     page_layout = generic.GenericForeignKey('layout_type', 'object_id')
+    # Indexed by a migration, since the index differs between databases.
     materialized_path = models.TextField(blank=True)
+    # The primary keys of the page's ancestors, root first, separated by
+    # commas; maintained along with the materialized path.
+    ancestor_ids = models.TextField(blank=True, default='')
+    # The ``order`` keys and primary keys of the page's ancestors and of the
+    # page itself, which sort as text in tree order; maintained along with
+    # the materialized path. Indexed by a migration, like the path.
+    sort_path = models.TextField(blank=True, default='')
 
     objects = PageManager()
 
@@ -111,11 +127,100 @@ class Page(MPTTModel):
                     old_homepage.save()
         return super(Page, self).clean()
 
+    # The tree is read and written through the configured backend; see
+    # ``pagemanager.tree``.
+
+    def save(self, *args, **kwargs):
+        # New pages go after their siblings, unless placed explicitly.
+        if self.pk is None and self.order in (None, DEFAULT_ORDER):
+            self.order = get_next_order(self)
+        return get_tree_backend().save(self, *args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        return get_tree_backend().delete(self, *args, **kwargs)
+
+    def move_to(self, target, position='first-child'):
+        return get_tree_backend().move_to(self, target, position)
+
+    def get_ancestors(self, ascending=False, include_self=False):
+        return get_tree_backend().get_ancestors(self, ascending=ascending,
+            include_self=include_self)
+
+    def get_descendants(self, include_self=False):
+        return get_tree_backend().get_descendants(self,
+            include_self=include_self)
+
     def get_children(self):
-        kids = super(Page, self).get_children()
+        kids = get_tree_backend().get_children(self)
         attach_generics(kids)
         return kids
 
+    def get_root(self):
+        return get_tree_backend().get_root(self)
+
+    def get_siblings(self, include_self=False):
+        return get_tree_backend().get_siblings(self,
+            include_self=include_self)
+
+    def get_next_sibling(self, **filters):
+        return get_tree_backend().get_next_sibling(self, **filters)
+
+    def get_previous_sibling(self, **filters):
+        return get_tree_backend().get_previous_sibling(self, **filters)
+
+    def get_leafnodes(self, include_self=False):
+        return get_tree_backend().get_leafnodes(self,
+            include_self=include_self)
+
+    def get_descendant_count(self):
+        return get_tree_backend().get_descendant_count(self)
+
+    def insert_at(self, target, position='first-child', save=False,
+        allow_existing_pk=False):
+        return get_tree_backend().insert_at(self, target, position, save,
+            allow_existing_pk=allow_existing_pk)
+
+    def is_leaf_node(self):
+        return get_tree_backend().is_leaf_node(self)
+
+    def get_ancestor_ids(self):
+        """
+        Returns the primary keys of the page's ancestors, root first. They
+        are read from the stored ``ancestor_ids`` unless those disagree with
+        the page's parent, as after moving it in memory, in which case the
+        parent's are read from the database.
+        """
+        ancestor_ids = [int(pk) for pk in self.ancestor_ids.split(',') if pk]
+        if not self.parent_id:
+            return []
+        if not ancestor_ids or ancestor_ids[-1] != self.parent_id:
+            parent_ids = self.__class__._default_manager.filter(
+                pk=self.parent_id).values_list('ancestor_ids', flat=True)
+            ancestor_ids = [int(pk) for pk in ''.join(parent_ids).split(',')
+                if pk] + [self.parent_id]
+        return ancestor_ids
+
+    def get_ancestor_list(self):
+        """
+        Returns the page's ancestors, root first, with their layouts, using a
+        single ``in_bulk`` query for the pages.
+        """
+        ancestor_ids = self.get_ancestor_ids()
+        if not ancestor_ids:
+            return []
+        pages = self.__class__._default_manager.in_bulk(ancestor_ids)
+        ancestors = [pages[pk] for pk in ancestor_ids if pk in pages]
+        attach_generics(ancestors)
+        return ancestors
+
+    def is_descendant_of(self, other, include_self=False):
+        if include_self and other.pk == self.pk:
+            return True
+        return other.pk in self.get_ancestor_ids()
+
+    def is_ancestor_of(self, other, include_self=False):
+        return other.is_descendant_of(self, include_self=include_self)
+
     @models.permalink
     def get_absolute_url(self):
         return ('pagemanager_page', (), {'path': self.materialized_path})
@@ -159,12 +264,12 @@ class Page(MPTTModel):
         Return a string consiting of the current page slug, followed by
         the slug values of its ancestors, separated by a "/".
         """
-        page_chain =  [a.slug for a in self.get_ancestors()]
-        page_chain.append(self.slug)
-        return '/'.join(page_chain)
+        return get_tree_backend().get_materialized_path(self)
 
     @property
     def path_prefix(self):
+        if self.materialized_path:
+            return self.materialized_path.rpartition('/')[0]
         return '/'.join([ancestor.slug for ancestor in \
             self.get_ancestors()])
 
@@ -245,6 +350,7 @@ class PageLayoutMeta(object):
     admin_mixin_dict = None
     admin_media_js = None
     admin_media_css = None
+    search_fields = None
 
     def __init__(self, opts, **kwargs):
         if opts:
@@ -383,6 +489,57 @@ class PageLayout(models.Model):
         return slugify(self._pagemanager_meta.name)
 
 
+class PageSearchEntry(models.Model):
+    """
+    The searchable text of a page, gathered from its title, description and
+    the ``search_fields`` declared in its layout's PageManagerMeta. Entries
+    are kept up to date by ``pagemanager.search``; database-specific full
+    text indexes are built on top of this table by its migration.
+    """
+    page = models.OneToOneField(Page, related_name='search_entry')
+    title = models.CharField(max_length=256)
+    text = models.TextField(blank=True)
+    is_public = models.BooleanField(default=False, db_index=True)
+
+    class Meta:
+        verbose_name = 'page search entry'
+        verbose_name_plural = 'page search entries'
+
+    def __unicode__(self):
+        return self.title
+
+    @classmethod
+    def hide_from_applist(cls):
+        return True
+
+
+class PageGrant(models.Model):
+    """
+    Limits a user, or every member of a group, to the subtree below (and
+    including) a page. Users with no grants keep the site-wide scope of
+    their permissions; see ``pagemanager.grants``.
+    """
+    page = models.ForeignKey(Page, related_name='grants')
+    user = models.ForeignKey(User, blank=True, null=True,
+        related_name='pagemanager_grants')
+    group = models.ForeignKey(Group, blank=True, null=True,
+        related_name='pagemanager_grants')
+
+    class Meta:
+        verbose_name = 'page grant'
+        verbose_name_plural = 'page grants'
+
+    def __unicode__(self):
+        return u'%s: %s' % (self.user or self.group, self.page)
+
+    def clean(self):
+        """
+        Requires exactly one of a user or a group.
+        """
+        if bool(self.user_id) == bool(self.group_id):
+            raise ValidationError(_('Choose either a user or a group.'))
+
+
 class PlaceholderPage(PageLayout):
     """
     Completely null page layout; typically used for pages that need to live in
@@ -414,3 +571,8 @@ class RedirectPage(PageLayout):
 
     def get_redirect_url(self):
         return self.url
+
+
+# Connect the receivers that keep the search index and downstream caches
+# current.
+from pagemanager import grants, purge, replicas, search
@@ -0,0 +1,238 @@
+"""
+Pre-rendering of the public site to static HTML files, for disaster recovery
+or to offload a CDN's origin.
+
+Pages are rendered through the same views that serve them, as an anonymous
+user, in a pool of worker processes. Each page is written to
+``<materialized path>/index.html`` below the output directory, and redirect
+pages are collected into a redirect map rather than rendered.
+
+The file and redirect written for every page are recorded in a state file
+in the output directory, so that later runs can remove the output of pages
+that were deleted, unpublished, made private or moved since.
+"""
+import datetime
+import json
+import multiprocessing
+import os
+
+from django.contrib.auth.models import AnonymousUser
+from django.contrib.contenttypes.models import ContentType
+from django.db import connection
+from django.test.client import RequestFactory
+
+from pagemanager.app_settings import PAGEMANAGER_PAGE_MODEL
+from pagemanager.models import RedirectPage
+from pagemanager.permissions import get_public_visibility_name
+from pagemanager.sitemaps import get_url_prefix, get_page_url, iter_tree
+from pagemanager.tree import get_tree_backend
+
+STATE_FILE = '.pagemanager-prerender.json'
+REDIRECTS_FILE = '_redirects.json'
+
+
+def get_public_pages():
+    return PAGEMANAGER_PAGE_MODEL.objects.published().filter(
+        visibility=get_public_visibility_name(),
+        copy_of__isnull=True,
+    )
+
+
+def get_changed_pages(since, chunk_size=100):
+    """
+    Returns the public pages that were modified after ``since``, along with
+    all of their descendants, whose rendering may depend on their ancestors.
+    """
+    backend = get_tree_backend()
+    changed = list(get_public_pages().filter(date_modified__gt=since)
+        .only('tree_id', 'lft', 'rght', 'materialized_path'))
+    pages = {}
+    for start in range(0, len(changed), chunk_size):
+        subtrees = backend.subtree_filter(changed[start:start + chunk_size])
+        for page in get_public_pages().filter(subtrees):
+            pages[page.pk] = page
+    first, second = backend.iteration_fields
+    return sorted(pages.values(),
+        key=lambda page: (getattr(page, first), getattr(page, second)))
+
+
+def get_output_file(output_dir, page):
+    if page.is_homepage:
+        directory = output_dir
+    else:
+        directory = os.path.join(output_dir,
+            *page.materialized_path.split('/'))
+    return os.path.join(directory, 'index.html')
+
+
+def render_page(url, path, is_homepage=False):
+    """
+    Renders the page at the passed materialized path through its view, as an
+    anonymous user, and returns the response.
+    """
+    from pagemanager.views import HomepageView, PageView
+    request = RequestFactory().get(url)
+    request.user = AnonymousUser()
+    if is_homepage:
+        response = HomepageView.as_view()(request)
+    else:
+        response = PageView.as_view()(request, path=path)
+    if hasattr(response, 'render'):
+        response.render()
+    return response
+
+
+def _init_worker():
+    # Connections must not be shared with the parent process.
+    connection.close()
+
+
+def _render_to_file(job):
+    page_pk, url, path, is_homepage, filename = job
+    try:
+        response = render_page(url, path, is_homepage)
+    except Exception, e:
+        return page_pk, False, unicode(e)
+    if response.status_code != 200:
+        return page_pk, False, 'Status code %d' % response.status_code
+    directory = os.path.dirname(filename)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    output = open(filename, 'wb')
+    output.write(response.content)
+    output.close()
+    return page_pk, True, None
+
+
+def _remove_output_file(output_dir, filename):
+    """
+    Removes a rendered file, along with the directories that held nothing
+    else.
+    """
+    if os.path.exists(filename):
+        os.remove(filename)
+    directory = os.path.dirname(filename)
+    while os.path.abspath(directory) != os.path.abspath(output_dir):
+        try:
+            os.rmdir(directory)
+        except OSError:
+            break
+        directory = os.path.dirname(directory)
+
+
+def prerender(output_dir, processes=None, incremental=False, chunk_size=500):
+    """
+    Renders the public site into ``output_dir``, and returns a tuple of the
+    number of pages rendered and a list of (page pk, error) tuples for pages
+    that failed.
+
+    If ``incremental`` is true and the site was rendered into the same
+    directory before, only the pages modified since (and their descendants)
+    are rendered again. Either way, the files and redirects of pages that
+    are no longer public, or have moved, are removed.
+    """
+    started = datetime.datetime.now()
+    state_file = os.path.join(output_dir, STATE_FILE)
+    state = {}
+    if os.path.exists(state_file):
+        state = json.load(open(state_file))
+    since = None
+    if incremental and 'last_run' in state:
+        since = datetime.datetime.strptime(state['last_run'],
+            '%Y-%m-%dT%H:%M:%S.%f')
+    if since is None:
+        pages = iter_tree(get_public_pages(), chunk_size=chunk_size)
+    else:
+        pages = get_changed_pages(since)
+    # Files are recorded relative to the output directory, so that it can be
+    # moved between runs.
+    files = dict([(int(pk), filename)
+        for pk, filename in state.get('files', {}).items()])
+    redirects = dict([(int(pk), url)
+        for pk, url in state.get('redirects', {}).items()])
+
+    prefix = get_url_prefix()
+    redirect_type = ContentType.objects.get_for_model(RedirectPage)
+    jobs = []
+    redirect_ids = {}
+    stale_files = set()
+    stale_urls = set()
+    for page in pages:
+        url = get_page_url(page, prefix)
+        if page.layout_type_id == redirect_type.pk:
+            redirect_ids[page.object_id] = url
+            if redirects.get(page.pk, url) != url:
+                stale_urls.add(redirects[page.pk])
+            redirects[page.pk] = url
+        else:
+            filename = get_output_file(output_dir, page)
+            jobs.append((page.pk, url, page.materialized_path,
+                page.is_homepage, filename))
+            if page.pk in files and \
+                os.path.join(output_dir, files[page.pk]) != filename:
+                stale_files.add(files.pop(page.pk))
+
+    public_pks = set(get_public_pages().values_list('pk', flat=True))
+    for pk in set(files) - public_pks:
+        stale_files.add(files.pop(pk))
+    for pk in set(redirects) - public_pks:
+        stale_urls.add(redirects.pop(pk))
+    write_redirects(output_dir, redirect_ids, replace=since is None,
+        remove_urls=stale_urls)
+
+    # The parent's connection is closed before forking; each worker opens
+    # its own.
+    connection.close()
+    pool = multiprocessing.Pool(processes, initializer=_init_worker)
+    filenames = dict([(job[0], job[4]) for job in jobs])
+    rendered = 0
+    errors = []
+    try:
+        for page_pk, success, error in pool.imap_unordered(_render_to_file,
+            jobs, chunksize=10):
+            if success:
+                rendered += 1
+                files[page_pk] = os.path.relpath(filenames[page_pk],
+                    output_dir)
+            else:
+                errors.append((page_pk, error))
+    finally:
+        pool.close()
+        pool.join()
+
+    # Remove the deepest files first, so that emptied directories go too.
+    for filename in sorted(stale_files - set(files.values()), reverse=True):
+        _remove_output_file(output_dir, os.path.join(output_dir, filename))
+
+    output = open(state_file, 'w')
+    json.dump({
+        'last_run': started.strftime('%Y-%m-%dT%H:%M:%S.%f'),
+        'files': files,
+        'redirects': redirects,
+    }, output)
+    output.close()
+    return rendered, errors
+
+
+def write_redirects(output_dir, redirect_ids, replace=True,
+    remove_urls=()):
+    """
+    Writes a JSON map of redirect page URLs to their targets. Unless
+    ``replace`` is true, the new entries are merged into the existing map,
+    from which the entries of ``remove_urls`` are dropped.
+    """
+    filename = os.path.join(output_dir, REDIRECTS_FILE)
+    redirects = {}
+    if not replace and os.path.exists(filename):
+        redirects = json.load(open(filename))
+        for url in remove_urls:
+            redirects.pop(url, None)
+    layouts = RedirectPage.objects.in_bulk(redirect_ids.keys())
+    for layout_pk, url in redirect_ids.items():
+        if layout_pk in layouts:
+            redirects[url] = layouts[layout_pk].url
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+    output = open(filename, 'w')
+    json.dump(redirects, output, indent=4, sort_keys=True)
+    output.close()
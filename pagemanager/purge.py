@@ -0,0 +1,217 @@
+"""
+Surrogate keys and purging, for sites fronted by a caching proxy or CDN.
+
+When the PAGEMANAGER_SURROGATE_KEYS setting is true, every page response
+carries a header (PAGEMANAGER_SURROGATE_KEY_HEADER, "Surrogate-Key" by
+default) listing keys for the page, for its layout and for the branch of
+every one of its ancestors, as well as its own:
+
+    pm-page-<page pk> pm-layout-<content type pk>-<layout pk>
+    pm-branch-<root pk> ... pm-branch-<page pk>
+
+Purging ``pm-branch-<pk>`` therefore purges a page and all of its
+descendants. As pages and layouts are saved, moved or deleted, the smallest
+set of affected keys is handed to the backend named in the
+PAGEMANAGER_PURGE_BACKEND setting. Since the navigation of a page's parent
+and siblings lists it, their branch is purged as well when a page is added,
+deleted, published, unpublished or hidden. Purges may be deferred until the
+transaction has been committed; see ``pagemanager.dispatch``.
+"""
+import logging
+import urllib2
+
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+from django.utils.importlib import import_module
+
+from pagemanager import dispatch
+from pagemanager.dispatch import deferred_receiver
+from pagemanager.models import Page, PageLayout
+from pagemanager.signals import page_edited, page_moved
+
+ENABLED = getattr(settings, 'PAGEMANAGER_SURROGATE_KEYS', False)
+
+SURROGATE_KEY_HEADER = getattr(settings, 'PAGEMANAGER_SURROGATE_KEY_HEADER',
+    'Surrogate-Key')
+
+logger = logging.getLogger('pagemanager.purge')
+
+
+def page_key(page_pk):
+    return 'pm-page-%s' % page_pk
+
+
+def layout_key(content_type_pk, layout_pk):
+    return 'pm-layout-%s-%s' % (content_type_pk, layout_pk)
+
+
+def branch_key(page_pk):
+    return 'pm-branch-%s' % page_pk
+
+
+def get_surrogate_keys(page):
+    """
+    Returns the surrogate keys of a page, as described above.
+    """
+    keys = [page_key(page.pk)]
+    if page.layout_type_id:
+        keys.append(layout_key(page.layout_type_id, page.object_id))
+    keys.extend([branch_key(pk) for pk in page.get_ancestor_ids()])
+    keys.append(branch_key(page.pk))
+    return keys
+
+
+class NullBackend(object):
+    """
+    Discards every purge; the default.
+    """
+    def purge(self, keys):
+        pass
+
+
+class LocMemBackend(object):
+    """
+    Records the keys of every purge in ``purged``, for use in development
+    and in tests.
+    """
+    def __init__(self):
+        self.purged = []
+
+    def purge(self, keys):
+        self.purged.append(set(keys))
+
+
+class HTTPBackend(object):
+    """
+    Sends the keys to PAGEMANAGER_PURGE_URL, space-separated in the surrogate
+    key header of a PAGEMANAGER_PURGE_METHOD ("PURGE" by default) request,
+    along with any PAGEMANAGER_PURGE_HEADERS, such as an API token. Long key
+    lists are split across several requests.
+    """
+    max_keys = 256
+
+    def __init__(self):
+        self.url = settings.PAGEMANAGER_PURGE_URL
+        self.method = getattr(settings, 'PAGEMANAGER_PURGE_METHOD', 'PURGE')
+        self.headers = getattr(settings, 'PAGEMANAGER_PURGE_HEADERS', {})
+
+    def purge(self, keys):
+        keys = sorted(keys)
+        for start in range(0, len(keys), self.max_keys):
+            request = urllib2.Request(self.url, headers=self.headers)
+            request.get_method = lambda: self.method
+            request.add_header(SURROGATE_KEY_HEADER,
+                ' '.join(keys[start:start + self.max_keys]))
+            urllib2.urlopen(request).close()
+
+_backend = None
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        path = getattr(settings, 'PAGEMANAGER_PURGE_BACKEND',
+            'pagemanager.purge.NullBackend')
+        module_name, class_name = path.rsplit('.', 1)
+        _backend = getattr(import_module(module_name), class_name)()
+    return _backend
+
+
+def purge(keys):
+    """
+    Hands the passed keys to the purge backend. Failures are logged rather
+    than raised, so that an unavailable proxy never prevents saving a page.
+    """
+    keys = set(keys)
+    if not ENABLED or not keys:
+        return
+    try:
+        get_backend().purge(keys)
+    except Exception:
+        logger.exception('Failed to purge %s' % ' '.join(sorted(keys)))
+
+
+def _purge_keys(sender, keys, **kwargs):
+    purge(keys)
+
+
+def purge_after_commit(signal, keys):
+    """
+    Purges the passed keys, after the transaction has been committed if
+    deferred dispatch is enabled, so that the proxy can't fetch a page again
+    before the change is visible.
+    """
+    if dispatch.ENABLED:
+        dispatch.record(signal, _purge_keys, None, {'keys': keys})
+    else:
+        purge(keys)
+
+
+@receiver(pre_save, dispatch_uid='pm_purge_pre_save')
+def remember_stored_fields(sender, instance, raw=False, **kwargs):
+    """
+    Paths are recalculated after every save, on the instance as well, so the
+    stored path, status and visibility are read beforehand to tell which of
+    them changed.
+    """
+    if ENABLED and not raw and isinstance(instance, Page) and instance.pk:
+        instance._pagemanager_stored = list(
+            sender._default_manager.filter(pk=instance.pk).values_list(
+                'materialized_path', 'status', 'visibility')[:1])
+
+
+@receiver(post_save, dispatch_uid='pm_purge_save')
+def purge_on_save(sender, instance, created=False, raw=False, **kwargs):
+    """
+    Purges a saved page, or every page using a saved layout. When a page's
+    path has changed, as after a slug edit, a merge or a move, its whole
+    branch is purged, since the URLs of all of its descendants changed too.
+    When a page is added or its status or visibility changed, the branch of
+    its parent is purged.
+    """
+    if not ENABLED or raw:
+        return
+    if isinstance(instance, Page):
+        # Nothing has cached a page that was just added.
+        keys = not created and [page_key(instance.pk)] or []
+        # The receiver recalculating paths in ``pagemanager.util`` is
+        # connected first, as the models import it through app_settings, so
+        # the instance already holds its new path.
+        stored = getattr(instance, '_pagemanager_stored', None)
+        if not created and stored:
+            path, status, visibility = stored[0]
+            if path != instance.materialized_path:
+                keys.append(branch_key(instance.pk))
+            listed = (status, visibility) != \
+                (instance.status, instance.visibility)
+        else:
+            listed = created
+        if listed and instance.parent_id:
+            keys.append(branch_key(instance.parent_id))
+        if keys:
+            purge_after_commit(post_save, keys)
+    elif isinstance(instance, PageLayout) and not created:
+        content_type = ContentType.objects.get_for_model(instance)
+        purge_after_commit(post_save,
+            [layout_key(content_type.pk, instance.pk)])
+
+
+@receiver(post_delete, dispatch_uid='pm_purge_delete')
+def purge_on_delete(sender, instance, **kwargs):
+    if ENABLED and isinstance(instance, Page):
+        keys = [page_key(instance.pk), branch_key(instance.pk)]
+        if instance.parent_id:
+            keys.append(branch_key(instance.parent_id))
+        purge_after_commit(post_delete, keys)
+
+
+@deferred_receiver(page_edited, dispatch_uid='pm_purge_edited')
+def purge_on_edit(sender, page, **kwargs):
+    purge([page_key(page.pk)])
+
+
+@deferred_receiver(page_moved, dispatch_uid='pm_purge_moved')
+def purge_on_move(sender, branch_ids, **kwargs):
+    purge([branch_key(pk) for pk in branch_ids])
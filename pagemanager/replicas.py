@@ -0,0 +1,88 @@
+"""
+Reading pages from a replica database.
+
+When the PAGEMANAGER_READ_DATABASE setting names a database alias,
+``ReadDatabaseMiddleware`` has the pages of each request resolved from that
+database: path lookups through ``get_page_from_path``, and the homepage.
+Navigation is still read from the default database, since it is cached
+until the tree next changes, and a fragment built from a lagging replica
+would outlive the lag.
+
+Requests that aren't GET or HEAD read from the default database throughout.
+So do a user's requests for PAGEMANAGER_READ_PIN_SECONDS (15 by default)
+after a request in which pages were saved, deleted or moved, so that
+editors see their own changes while the replica catches up. The pin is kept
+in the session, so SessionMiddleware must come before the middleware.
+"""
+import threading
+import time
+
+from django.conf import settings
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from pagemanager.models import Page
+from pagemanager.signals import page_moved
+
+READ_DATABASE = getattr(settings, 'PAGEMANAGER_READ_DATABASE', None)
+
+PIN_SECONDS = getattr(settings, 'PAGEMANAGER_READ_PIN_SECONDS', 15)
+
+SESSION_KEY = 'pagemanager_read_pinned_until'
+
+_state = threading.local()
+
+
+def get_read_database():
+    """
+    Returns the alias of the database to resolve pages from in the current
+    request, or None to use the default routing.
+    """
+    return getattr(_state, 'alias', None)
+
+
+def begin(request):
+    """
+    Chooses the database to read from for the rest of the request.
+    """
+    _state.wrote = False
+    _state.alias = None
+    if READ_DATABASE is None or request.method not in ('GET', 'HEAD'):
+        return
+    session = getattr(request, 'session', None)
+    if session is not None and session.get(SESSION_KEY, 0) > time.time():
+        return
+    _state.alias = READ_DATABASE
+
+
+def finish(request):
+    """
+    Pins the session to the default database if pages were written during
+    the request.
+    """
+    session = getattr(request, 'session', None)
+    if getattr(_state, 'wrote', False) and session is not None:
+        session[SESSION_KEY] = time.time() + PIN_SECONDS
+    _state.wrote = False
+    _state.alias = None
+
+
+def record_write():
+    """
+    Notes that pages were written, so that the rest of the request and the
+    user's next requests read from the default database.
+    """
+    _state.wrote = True
+    _state.alias = None
+
+
+@receiver(post_save, dispatch_uid='pm_replicas_save')
+@receiver(post_delete, dispatch_uid='pm_replicas_delete')
+def record_page_write(sender, instance, **kwargs):
+    if isinstance(instance, Page):
+        record_write()
+
+
+@receiver(page_moved, dispatch_uid='pm_replicas_moved')
+def record_page_move(sender, **kwargs):
+    record_write()
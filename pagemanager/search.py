@@ -0,0 +1,276 @@
+"""
+Searching of pages.
+
+``search_tree`` serves the admin page tree, matching titles, slugs and paths.
+
+``search_pages`` searches the content of pages through the PageSearchEntry
+table, which is kept up to date incrementally when the PAGEMANAGER_SEARCH_INDEX
+setting is true. Each layout declares the fields to include in a
+``search_fields`` attribute of its PageManagerMeta. Queries are ranked by
+relevance in a single statement, using a tsvector column on PostgreSQL and an
+FTS5 table on SQLite, where the migration, or syncdb, was able to create
+them.
+"""
+from django.conf import settings
+from django.db import DatabaseError, DEFAULT_DB_ALIAS, connection, \
+    connections, transaction
+from django.db.models import Q
+from django.db.models.signals import class_prepared, post_save, post_syncdb
+from django.dispatch import receiver
+from django.template.defaultfilters import slugify
+from django.utils.encoding import force_unicode
+from django.utils.html import strip_tags
+
+from pagemanager.app_settings import PAGEMANAGER_PAGE_MODEL
+from pagemanager.dispatch import deferred_receiver
+from pagemanager.models import Page, PageLayout, PageSearchEntry
+from pagemanager.signals import page_edited
+from pagemanager.tree import get_tree_backend
+
+SEARCH_INDEX_ENABLED = getattr(settings, 'PAGEMANAGER_SEARCH_INDEX', False)
+
+FTS_TABLE = 'pagemanager_pagesearchentry_fts'
+
+# The statements of migration 0004, which creates the full text index.
+POSTGRESQL_INDEX_SQL = (
+    'ALTER TABLE "pagemanager_pagesearchentry" '
+    'ADD COLUMN "document" tsvector',
+    'CREATE INDEX "pagemanager_pagesearchentry_document" ON '
+    '"pagemanager_pagesearchentry" USING gin ("document")',
+    'CREATE TRIGGER "pagemanager_pagesearchentry_document" '
+    'BEFORE INSERT OR UPDATE ON "pagemanager_pagesearchentry" '
+    'FOR EACH ROW EXECUTE PROCEDURE tsvector_update_trigger('
+    '"document", \'pg_catalog.english\', "title", "text")',
+)
+
+SQLITE_INDEX_SQL = (
+    'CREATE VIRTUAL TABLE ' + FTS_TABLE + ' USING fts5('
+    'title, text, content=\'pagemanager_pagesearchentry\', '
+    'content_rowid=\'id\')',
+    'CREATE TRIGGER pagemanager_pagesearchentry_ai AFTER INSERT '
+    'ON pagemanager_pagesearchentry BEGIN '
+    'INSERT INTO ' + FTS_TABLE + '(rowid, title, text) '
+    'VALUES (new.id, new.title, new.text); END',
+    'CREATE TRIGGER pagemanager_pagesearchentry_ad AFTER DELETE '
+    'ON pagemanager_pagesearchentry BEGIN '
+    'INSERT INTO ' + FTS_TABLE + '(' + FTS_TABLE + ', rowid, '
+    'title, text) VALUES (\'delete\', old.id, old.title, '
+    'old.text); END',
+    'CREATE TRIGGER pagemanager_pagesearchentry_au AFTER UPDATE '
+    'ON pagemanager_pagesearchentry BEGIN '
+    'INSERT INTO ' + FTS_TABLE + '(' + FTS_TABLE + ', rowid, '
+    'title, text) VALUES (\'delete\', old.id, old.title, '
+    'old.text); '
+    'INSERT INTO ' + FTS_TABLE + '(rowid, title, text) '
+    'VALUES (new.id, new.title, new.text); END',
+)
+
+
+def search_tree(queryset, query, limit=50):
+    """
+    Searches a queryset of pages by title, slug and materialized path, and
+    returns a tuple of the matching pages and of the ancestors of those
+    pages, so that the branches containing them can be opened.
+
+    A query containing a slash is matched as a path prefix. Otherwise, every
+    word of the query must match either the start of the slug or any part of
+    the title. On PostgreSQL the title matches are served by the trigram
+    index; elsewhere no index can serve them, so the pages are scanned.
+    """
+    query = query.strip()
+    if not query:
+        return [], []
+    if '/' in query:
+        queryset = queryset.filter(
+            materialized_path__startswith=query.strip('/')
+        )
+    else:
+        for term in query.split():
+            queryset = queryset.filter(
+                Q(title__icontains=term) |
+                Q(slug__startswith=slugify(term))
+            )
+    backend = get_tree_backend()
+    matches = list(backend.order_by_tree(queryset)[:limit])
+    if not matches:
+        return [], []
+    # Fetch the ancestors of every match in a single query.
+    ancestors = list(backend.order_by_tree(
+        queryset.model._default_manager.filter(
+            backend.ancestors_filter(matches)
+        )
+    ))
+    return matches, ancestors
+
+
+def get_search_text(page, layout=None):
+    """
+    Returns the searchable text of a page: its description followed by the
+    values of its layout's ``search_fields``, with any markup removed.
+    """
+    values = [page.description]
+    if layout is None:
+        layout = page.page_layout
+    if layout is not None:
+        for name in layout._pagemanager_meta.search_fields or ():
+            value = getattr(layout, name, None)
+            if callable(value):
+                value = value()
+            values.append(value)
+    return '\n'.join([strip_tags(force_unicode(value))
+        for value in values if value])
+
+
+def get_search_entry_values(page, layout=None):
+    return {
+        'title': page.title,
+        'text': get_search_text(page, layout),
+        'is_public': page.is_unrestricted() and not page.copy_of_id,
+    }
+
+
+def update_search_entry(page, layout=None):
+    """
+    Creates or updates the search entry of a single page.
+    """
+    values = get_search_entry_values(page, layout)
+    if not PageSearchEntry.objects.filter(page=page).update(**values):
+        PageSearchEntry.objects.create(page=page, **values)
+
+
+def update_search_entry_on_save(sender, instance, raw=False, **kwargs):
+    """
+    Keeps the search index current as pages are saved. Since publishing,
+    changes of visibility and merges of draft copies all save the page, they
+    are covered too; deleted pages take their entries with them.
+    """
+    if SEARCH_INDEX_ENABLED and not raw:
+        update_search_entry(instance)
+
+
+def update_search_entries_on_layout_save(sender, instance, raw=False,
+    **kwargs):
+    """
+    Keeps the search entries of the pages using a layout current as it is
+    saved.
+    """
+    if SEARCH_INDEX_ENABLED and not raw:
+        for page in instance.page.all():
+            update_search_entry(page, instance)
+
+for page_model in set([Page, PAGEMANAGER_PAGE_MODEL]):
+    post_save.connect(update_search_entry_on_save, sender=page_model,
+        dispatch_uid='pm_search_save')
+
+
+def connect_layout(model):
+    if issubclass(model, PageLayout) and not model._meta.abstract:
+        post_save.connect(update_search_entries_on_layout_save, sender=model,
+            dispatch_uid='pm_search_layout_save')
+    for subclass in model.__subclasses__():
+        connect_layout(subclass)
+
+
+@receiver(class_prepared, dispatch_uid='pm_search_class_prepared')
+def connect_layout_on_prepare(sender, **kwargs):
+    connect_layout(sender)
+
+# Layouts defined before this module was imported, such as those of
+# pagemanager.models, have already been prepared.
+connect_layout(PageLayout)
+
+
+@deferred_receiver(page_edited, dispatch_uid='pm_search_edited')
+def update_search_entry_on_edit(sender, page, **kwargs):
+    if SEARCH_INDEX_ENABLED:
+        update_search_entry(page)
+
+
+def _has_fts_table():
+    if not hasattr(connection, '_pagemanager_has_fts'):
+        connection._pagemanager_has_fts = \
+            FTS_TABLE in connection.introspection.table_names()
+    return connection._pagemanager_has_fts
+
+
+def create_full_text_index(connection):
+    """
+    Adds the tsvector column or the FTS5 table that ``search_pages`` uses to
+    the search entry table, unless it has it already.
+    """
+    cursor = connection.cursor()
+    table = PageSearchEntry._meta.db_table
+    if connection.vendor == 'postgresql':
+        columns = [column[0] for column in
+            connection.introspection.get_table_description(cursor, table)]
+        if 'document' in columns:
+            return
+        for sql in POSTGRESQL_INDEX_SQL:
+            cursor.execute(sql)
+    elif connection.vendor == 'sqlite':
+        if FTS_TABLE in connection.introspection.table_names():
+            return
+        try:
+            cursor.execute(SQLITE_INDEX_SQL[0])
+        except DatabaseError:
+            # SQLite was built without FTS5.
+            return
+        for sql in SQLITE_INDEX_SQL[1:]:
+            cursor.execute(sql)
+        connection.__dict__.pop('_pagemanager_has_fts', None)
+    else:
+        return
+    transaction.commit_unless_managed(using=connection.alias)
+
+
+@receiver(post_syncdb, dispatch_uid='pm_search_syncdb')
+def create_full_text_index_on_syncdb(sender, created_models, **kwargs):
+    """
+    Creates the full text index when syncdb, rather than the migration,
+    creates the search entry table.
+    """
+    if PageSearchEntry in created_models:
+        create_full_text_index(connections[kwargs.get('db',
+            DEFAULT_DB_ALIAS)])
+
+
+def search_pages(query, limit=20):
+    """
+    Returns up to ``limit`` public pages whose search entries match the
+    query, most relevant first.
+    """
+    terms = query.split()
+    if not terms:
+        return []
+    if connection.vendor == 'postgresql':
+        return list(Page.objects.raw(
+            'SELECT p.*, ts_rank(e.document, query) AS rank '
+            'FROM pagemanager_page p '
+            'JOIN pagemanager_pagesearchentry e ON e.page_id = p.id, '
+            "plainto_tsquery('english', %s) query "
+            'WHERE e.is_public AND e.document @@ query '
+            'ORDER BY rank DESC LIMIT %s',
+            [query, limit]
+        ))
+    if connection.vendor == 'sqlite' and _has_fts_table():
+        # Quote every term, so that FTS5 syntax in the query is taken
+        # literally.
+        match = ' '.join(['"%s"' % term.replace('"', '""') for term in terms])
+        return list(Page.objects.raw(
+            'SELECT p.*, bm25(' + FTS_TABLE + ') AS rank '
+            'FROM ' + FTS_TABLE + ' '
+            'JOIN pagemanager_pagesearchentry e '
+            'ON e.id = ' + FTS_TABLE + '.rowid '
+            'JOIN pagemanager_page p ON p.id = e.page_id '
+            'WHERE ' + FTS_TABLE + ' MATCH %s AND e.is_public '
+            'ORDER BY rank LIMIT %s',
+            [match, limit]
+        ))
+    # Without a full text index, fall back to substring matches, unranked.
+    queryset = Page.objects.filter(search_entry__is_public=True)
+    for term in terms:
+        queryset = queryset.filter(
+            Q(search_entry__title__icontains=term) |
+            Q(search_entry__text__icontains=term)
+        )
+    return list(queryset[:limit])
@@ -1,6 +1,8 @@
 from django.dispatch import Signal
 
 
-page_moved = Signal(providing_args=["branch_ids"])
+# ``old_paths`` and ``new_paths`` map the pks in ``branch_ids`` to their
+# paths before and after the move, where the sender knows them.
+page_moved = Signal(providing_args=["branch_ids", "old_paths", "new_paths"])
 
 page_edited = Signal(providing_args=["page, created"])
\ No newline at end of file
@@ -0,0 +1,139 @@
+import json
+
+from django.contrib.sitemaps import Sitemap
+from django.core.urlresolvers import reverse
+from django.db.models import Q
+from django.http import HttpResponse
+from django.utils.html import escape
+
+from pagemanager.app_settings import PAGEMANAGER_PAGE_MODEL
+from pagemanager.permissions import get_public_visibility_name
+from pagemanager.tree import get_tree_backend
+
+# Only the columns needed to build an entry are loaded, along with the
+# parent and order, which mptt reads as each page is instantiated.
+INDEX_FIELDS = ('title', 'materialized_path', 'is_homepage',
+    'date_modified', 'tree_id', 'lft', 'sort_path', 'parent', 'order')
+
+
+def get_index_queryset():
+    """
+    Returns the pages that belong in a sitemap -- those that are published,
+    public and not draft copies -- in tree order.
+    """
+    queryset = PAGEMANAGER_PAGE_MODEL.objects.published().filter(
+        visibility=get_public_visibility_name(),
+        copy_of__isnull=True,
+    )
+    return get_tree_backend().order_by_tree(queryset).only(*INDEX_FIELDS)
+
+
+def iter_tree(queryset, chunk_size=1000):
+    """
+    Iterates over a queryset of pages in tree order, fetching ``chunk_size``
+    rows at a time. Each chunk continues from the position of the last page
+    seen in the tree backend's ``iteration_fields`` -- (tree_id, lft) for
+    nested sets, (sort_path, pk) for paths -- so that neither the queryset's
+    result cache nor a large OFFSET is involved, however big the tree gets.
+    """
+    first, second = get_tree_backend().iteration_fields
+    queryset = queryset.order_by(first, second)
+    chunk = queryset
+    while True:
+        page = None
+        for page in chunk[:chunk_size].iterator():
+            yield page
+        if page is None:
+            return
+        chunk = queryset.filter(
+            Q(**{first + '__gt': getattr(page, first)}) |
+            Q(**{first: getattr(page, first),
+                second + '__gt': getattr(page, second)})
+        )
+
+
+def get_url_prefix():
+    """
+    Returns the URL at which the pagemanager URL patterns are mounted. Every
+    page URL is this prefix followed by its materialized path, so it is
+    resolved once rather than reversing a URL for every page.
+    """
+    return reverse('pagemanager_homepage')
+
+
+def get_page_url(page, prefix):
+    if page.is_homepage:
+        return prefix
+    return '%s%s/' % (prefix, page.materialized_path)
+
+
+def iter_sitemap_xml(pages, base_url='', prefix=None):
+    """
+    Yields an XML sitemap for the passed pages piece by piece. ``base_url``
+    is prepended to each location; it should consist of the protocol and
+    domain, e.g. "http://example.com".
+    """
+    if prefix is None:
+        prefix = get_url_prefix()
+    yield ('<?xml version="1.0" encoding="UTF-8"?>\n'
+        '<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n')
+    for page in pages:
+        yield (
+            '<url><loc>%s%s</loc><lastmod>%s</lastmod></url>\n'
+        ) % (
+            escape(base_url),
+            escape(get_page_url(page, prefix)),
+            page.date_modified.strftime('%Y-%m-%d'),
+        )
+    yield '</urlset>\n'
+
+
+def iter_page_index_jsonl(pages, base_url='', prefix=None):
+    """
+    Yields one JSON object per page, each on its own line.
+    """
+    if prefix is None:
+        prefix = get_url_prefix()
+    for page in pages:
+        yield json.dumps({
+            'id': page.pk,
+            'title': page.title,
+            'path': page.materialized_path,
+            'url': base_url + get_page_url(page, prefix),
+            'lastmod': page.date_modified.isoformat(),
+        }) + '\n'
+
+
+def sitemap(request, chunk_size=1000):
+    """
+    Serves an XML sitemap of every public page. The response body is
+    generated while it is being sent, rather than built up in memory.
+    """
+    base_url = '%s://%s' % (
+        request.is_secure() and 'https' or 'http',
+        request.get_host(),
+    )
+    pages = iter_tree(get_index_queryset(), chunk_size=chunk_size)
+    return HttpResponse(iter_sitemap_xml(pages, base_url),
+        mimetype='application/xml')
+
+
+class PageSitemap(Sitemap):
+    """
+    A sitemap for use with ``django.contrib.sitemaps``. It is paginated by
+    that framework, so each page of the sitemap is a single sliced query.
+    For very large trees, the ``sitemap`` view in this module avoids holding
+    even a single sitemap page in memory.
+    """
+    prefix = None
+
+    def items(self):
+        return get_index_queryset()
+
+    def location(self, obj):
+        if self.prefix is None:
+            self.prefix = get_url_prefix()
+        return get_page_url(obj, self.prefix)
+
+    def lastmod(self, obj):
+        return obj.date_modified
@@ -4,10 +4,48 @@ from django.core.exceptions import ImproperlyConfigured
 from pagemanager.exceptions import AlreadyRegistered, NotRegistered
 from pagemanager.models import PageLayout
 
+class RegistrySnapshot(object):
+    """
+    An immutable view of the layouts registered at one point in time, indexed
+    by name, along with the time autodiscovery spent importing each app.
+    """
+    def __init__(self, layouts, timings=()):
+        self._layouts = tuple(layouts)
+        self._by_name = dict([(layout._pagemanager_meta.name, layout)
+            for layout in reversed(self._layouts)])
+        self._timings = tuple(timings)
+
+    def __iter__(self):
+        return iter(self._layouts)
+
+    def __len__(self):
+        return len(self._layouts)
+
+    def __contains__(self, page_layout):
+        return page_layout in self._layouts
+
+    @property
+    def layouts(self):
+        return self._layouts
+
+    @property
+    def timings(self):
+        """
+        A tuple of (app, seconds) tuples, in the order the apps were
+        discovered.
+        """
+        return self._timings
+
+    def get_by_name(self, name):
+        return self._by_name.get(name)
+
+
 class PageManagerSite(object):
 
     def __init__(self):
         self._registry = []
+        self._snapshot = None
+        self.discovery_timings = ()
 
     def __iter__(self):
         return self._registry.__iter__()
@@ -37,6 +75,7 @@ class PageManagerSite(object):
             if page_layout in self._registry:
                 return False
             self._registry.append(page_layout)
+            self._snapshot = None
             return True
 
     def unregister(self, page_layout):
@@ -48,15 +87,25 @@ class PageManagerSite(object):
             raise NotRegistered('The page layout %s cannot be unregistered as '
                 'it has not been registered' % page_layout.__name__)
         self._registry.remove(page_layout)
+        self._snapshot = None
+
+    def snapshot(self):
+        """
+        Returns a ``RegistrySnapshot`` of the current registry. It is built
+        once, and again only after the registry changes.
+        """
+        snapshot = self._snapshot
+        if snapshot is None:
+            snapshot = RegistrySnapshot(self._registry,
+                self.discovery_timings)
+            self._snapshot = snapshot
+        return snapshot
 
     def get_by_name(self, name):
         """
         Returns a PageLayout class from the registry based on a passed name.
         """
-        for layout in self._registry:
-            if layout._pagemanager_meta.name == name:
-                return layout
-        return None
+        return self.snapshot().get_by_name(name)
 
 
 pagemanager_site = PageManagerSite()
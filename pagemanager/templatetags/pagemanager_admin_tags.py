@@ -1,4 +1,5 @@
 from django import template
+from django.contrib.admin.options import ModelAdmin
 from django.contrib.admin.sites import site
 from django.contrib.contenttypes.models import ContentType
 from django.conf import settings
@@ -9,7 +10,9 @@ from django.utils.safestring import mark_safe
 from django.utils.text import capfirst
 
 from pagemanager.app_settings import PAGEMANAGER_PAGE_MODEL
+from pagemanager.grants import filter_granted, is_granted
 from pagemanager.permissions import get_permissions, get_lookup_function
+from pagemanager.tree import get_tree_backend, preorder
 from pagemanager.util import get_pagemanager_model
 
 register = template.Library()
@@ -35,12 +38,18 @@ def render_navigation_list(parser, token):
 class ObjNode(template.Node):
 
     def render(self, context):
+        # ``PageLayoutAdmin.change_view`` passes the objects it has already
+        # loaded; only fetch them when rendered from elsewhere.
+        if 'obj' in context and 'page' in context and \
+            'page_ancestors' in context:
+            return ''
 
         layout_ct = ContentType.objects.get_for_id(context['content_type_id'])
         layout_class = layout_ct.model_class()
 
         context['obj'] = layout_class.objects.get(pk=int(context['object_id']))
         context['page'] = context['obj'].page.all()[0]
+        context['page_ancestors'] = context['page'].get_ancestor_list()
 
         return ''
 
@@ -54,7 +63,18 @@ def load_obj(parser, token):
 
 class PagesNode(template.Node):
     def render(self, context):
-        context['pagemanager_pages'] = PAGEMANAGER_PAGE_MODEL.objects.select_related('parent').all()
+        pages = PAGEMANAGER_PAGE_MODEL.objects.select_related('parent').all()
+        # Users with page grants see their sections, along with the pages
+        # leading to them.
+        if 'request' in context:
+            pages = filter_granted(pages, context['request'].user,
+                include_ancestors=True)
+        backend = get_tree_backend()
+        if backend.name != 'mptt':
+            # ``recursetree`` reorders querysets by nested set, so pages
+            # stored by path are passed as a list already in tree order.
+            pages = preorder(backend.order_by_tree(pages))
+        context['pagemanager_pages'] = pages
         context['pagemanager_page_model'] = PAGEMANAGER_PAGE_MODEL
         return ''
 
@@ -66,6 +86,86 @@ def load_pages(parser, token):
     return PagesNode()
 
 
+# The parts of the app list that don't depend on the user, built once per
+# process and rebuilt only if models are registered later.
+_static_app_list = None
+_static_app_list_models = None
+
+PERMISSION_METHODS = ('get_model_perms', 'has_add_permission',
+    'has_change_permission', 'has_delete_permission')
+
+
+def get_static_app_list():
+    """
+    Returns a list of the apps registered with the admin site, sorted by
+    name, each as a tuple of its name, URL, label and a list of its models
+    sorted by name, each as a tuple of the model, its ModelAdmin, its name,
+    its admin URL and whether ``has_default_permissions`` holds for its
+    ModelAdmin. Models hidden from the app list are left out.
+    """
+    global _static_app_list, _static_app_list_models
+    models = frozenset(site._registry.keys())
+    if _static_app_list is not None and models == _static_app_list_models:
+        return _static_app_list
+    app_dict = {}
+    for model, model_admin in site._registry.items():
+        if hasattr(model, 'hide_from_applist') and model.hide_from_applist():
+            continue
+        # Try to retrieve the __admin_name__ property from the
+        # model's app's __init__.py
+        to_import = '.'.join(model.__module__.split('.')[:-1])
+        try:
+            app_name = __import__(to_import).__APP_NAME__
+        except AttributeError:
+            app_name = model._meta.app_label.title()
+        app_url = model._meta.app_label.lower()
+        app = app_dict.setdefault(app_name,
+            (app_name, app_url + '/', app_url, []))
+        app[3].append((
+            model,
+            model_admin,
+            capfirst(model._meta.verbose_name_plural),
+            mark_safe('%s/%s/' % (app_url, model.__name__.lower())),
+            has_default_permissions(model_admin),
+        ))
+    # Sort the apps alphabetically, then sort models alphabetically within
+    # each app
+    app_list = sorted(app_dict.values(), key=lambda app: app[0])
+    for app in app_list:
+        app[3].sort(key=lambda model: model[2])
+    _static_app_list, _static_app_list_models = app_list, models
+    return app_list
+
+
+def has_default_permissions(model_admin):
+    """
+    Whether the ModelAdmin leaves all of the permission methods used by the
+    app list alone, so that its permissions can be read from the user's
+    permission set.
+    """
+    for name in PERMISSION_METHODS:
+        if getattr(model_admin.__class__, name).im_func is not \
+            getattr(ModelAdmin, name).im_func:
+            return False
+    return True
+
+
+def get_model_perms(model, user_perms):
+    """
+    Returns the permissions a ModelAdmin with the default permission checks
+    would give a user with the passed set of permissions.
+    """
+    opts = model._meta
+    return {
+        'add': '%s.%s' % (opts.app_label, opts.get_add_permission()) in \
+            user_perms,
+        'change': '%s.%s' % (opts.app_label, opts.get_change_permission()) \
+            in user_perms,
+        'delete': '%s.%s' % (opts.app_label, opts.get_delete_permission()) \
+            in user_perms,
+    }
+
+
 class AppListNode(template.Node):
 
     def render(self, context):
@@ -77,53 +177,45 @@ class AppListNode(template.Node):
                 'django.core.context_processors.request'
             )
 
-        app_dict = {}
         request = context['request']
         user = request.user
-        for model, model_admin in site._registry.items():
-
-            # Try to retrieve the __admin_name__ property from the
-            # model's app's __init__.py
-            to_import = '.'.join(model.__module__.split('.')[:-1])
-            try:
-                app_label = __import__(to_import).__APP_NAME__
-            except AttributeError:
-                app_label = model._meta.app_label.title()
-            app_url = model._meta.app_label.lower()
-
-            has_module_perms = user.has_module_perms(
-                model._meta.app_label.lower()
-            )
-            hidden_model = hasattr(model, 'hide_from_applist') and \
-                model.hide_from_applist()
-            if has_module_perms and not hidden_model:
-                perms = model_admin.get_model_perms(request)
+        # Permissions are checked against the user's full permission set,
+        # fetched once, rather than model by model. Superusers have every
+        # permission, and inactive users none.
+        if not user.is_active:
+            user_perms = frozenset()
+        elif user.is_superuser:
+            user_perms = None
+        else:
+            user_perms = user.get_all_permissions()
+        app_labels = set([perm.split('.', 1)[0] for perm in user_perms or ()])
+
+        app_list = []
+        for app_name, app_url, app_label, models in get_static_app_list():
+            has_module_perms = user_perms is None or app_label in app_labels
+            if not has_module_perms:
+                continue
+            model_list = []
+            for model, model_admin, name, admin_url, default in models:
+                if not default:
+                    perms = model_admin.get_model_perms(request)
+                elif user_perms is None:
+                    perms = {'add': True, 'change': True, 'delete': True}
+                else:
+                    perms = get_model_perms(model, user_perms)
                 if True in perms.values():
-
-                    model_dict = {
-                        'name': capfirst(model._meta.verbose_name_plural),
-                        'admin_url': mark_safe('%s/%s/' % (
-                            app_url, 
-                            model.__name__.lower())
-                        ),
+                    model_list.append({
+                        'name': name,
+                        'admin_url': admin_url,
                         'perms': perms,
-                    }
-                    if app_label in app_dict:
-                        app_dict[app_label]['models'].append(model_dict)
-                    else:
-                        app_dict[app_label] = {
-                            'name': app_label,
-                            'app_url': app_url + '/',
-                            'has_module_perms': has_module_perms,
-                            'models': [model_dict],
-                        }
-
-        # Sort the apps alphabetically, then sort models alphabetically within
-        # each app
-        app_list = app_dict.values()
-        app_list.sort(key=lambda x: x['name'])
-        for app in app_list:
-            app['models'].sort(key=lambda x: x['name'])
+                    })
+            if model_list:
+                app_list.append({
+                    'name': app_name,
+                    'app_url': app_url,
+                    'has_module_perms': has_module_perms,
+                    'models': model_list,
+                })
 
         context['app_list'] = app_list
         return ''
@@ -213,11 +305,13 @@ class LookupPermissionsNode(template.Node):
                 (node.is_published() or permissions['view_draft_pages']):
                 permissions['view_page'] = True
 
-        # Determine standard model permissions.
-        for verb in ('add', 'change', 'delete'):
-            permission_name = "%s_%s" % (verb, opts.module_name)
-            if lookup_perm(permission_name):
-                permissions[permission_name] = True
+        # Determine standard model permissions. Outside the sections of a
+        # user with page grants, pages can only be viewed.
+        if node is None or is_granted(user, node):
+            for verb in ('add', 'change', 'delete'):
+                permission_name = "%s_%s" % (verb, opts.module_name)
+                if lookup_perm(permission_name):
+                    permissions[permission_name] = True
         # Commit all permissions to context:
         permissions = self._rename_permissions(permissions, opts.module_name)
         for permission_name, permission in permissions.items():
@@ -0,0 +1,199 @@
+from django import template
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+from pagemanager import cache
+from pagemanager.app_settings import PAGEMANAGER_PAGE_MODEL
+from pagemanager.permissions import get_permissions, get_lookup_function, \
+    get_published_status_name, get_public_visibility_name
+from pagemanager.tree import get_tree_backend
+from pagemanager.util import get_page_from_path
+
+register = template.Library()
+
+
+def get_permission_class(user):
+    """
+    Returns a short string describing which restricted pages the given user
+    may see: "d" for drafts, "p" for private pages. Users with the same
+    permission class see the same navigation, so it is part of the cache key
+    of every rendered fragment.
+    """
+    if user is None or not user.is_authenticated():
+        return 'anon'
+    lookup_perm = get_lookup_function(user, get_permissions())
+    permission_class = ''
+    if lookup_perm('view_draft_pages'):
+        permission_class += 'd'
+    if lookup_perm('view_private_pages'):
+        permission_class += 'p'
+    return permission_class or 'user'
+
+
+def filter_visible(queryset, permission_class):
+    """
+    Restricts a queryset of pages to those visible to users of the passed
+    permission class. Draft copies never appear in navigation.
+    """
+    queryset = queryset.filter(copy_of__isnull=True)
+    if 'd' not in permission_class:
+        queryset = queryset.filter(status=get_published_status_name())
+    if 'p' not in permission_class:
+        queryset = queryset.filter(visibility=get_public_visibility_name())
+    return queryset
+
+
+def build_menu(root, depth, permission_class):
+    """
+    Returns a nested list of menu items for the pages below ``root`` (or for
+    the whole site, if ``root`` is None), at most ``depth`` levels deep. Each
+    item is a dictionary holding the page and a list of its child items.
+
+    The pages are fetched in a single query; any page whose parent was
+    filtered out is hidden along with its whole branch.
+    """
+    if root is None:
+        queryset = PAGEMANAGER_PAGE_MODEL.objects.filter(level__lt=depth)
+        top_level = 0
+    else:
+        queryset = root.get_descendants().filter(
+            level__lte=root.level + depth
+        )
+        top_level = root.level + 1
+    queryset = filter_visible(queryset, permission_class)
+    queryset = get_tree_backend().order_by_tree(queryset)
+
+    menu = []
+    items = {}
+    for page in queryset:
+        item = {
+            'page': page,
+            'depth': page.level - top_level,
+            'children': [],
+        }
+        if page.level == top_level:
+            menu.append(item)
+        elif page.parent_id in items:
+            items[page.parent_id]['children'].append(item)
+        else:
+            continue
+        items[page.pk] = item
+    return menu
+
+
+def build_breadcrumbs(page, permission_class):
+    """
+    Returns the list of visible ancestors of ``page``, followed by the page
+    itself.
+    """
+    ancestor_ids = page.get_ancestor_ids()
+    if not ancestor_ids:
+        return [page]
+    ancestors = dict([(ancestor.pk, ancestor) for ancestor in filter_visible(
+        PAGEMANAGER_PAGE_MODEL.objects.filter(pk__in=ancestor_ids),
+        permission_class
+    )])
+    return [ancestors[pk] for pk in ancestor_ids if pk in ancestors] + [page]
+
+
+def resolve_user(context):
+    if 'request' in context:
+        return getattr(context['request'], 'user', None)
+    return context.get('user', None)
+
+
+class MenuNode(template.Node):
+    template_name = 'pagemanager/menu.html'
+
+    def __init__(self, root_var=None, depth_var=None):
+        self.root_var = root_var and template.Variable(root_var)
+        self.depth_var = depth_var and template.Variable(depth_var)
+
+    def render(self, context):
+        root = None
+        if self.root_var:
+            root = self.root_var.resolve(context)
+            if isinstance(root, basestring):
+                root = get_page_from_path(root)
+        depth = 1
+        if self.depth_var:
+            depth = int(self.depth_var.resolve(context))
+        permission_class = get_permission_class(resolve_user(context))
+
+        def render_menu():
+            return render_to_string(self.template_name, {
+                'menu_items': build_menu(root, depth, permission_class),
+                'menu_template': self.template_name,
+            })
+
+        key = cache.make_key('tree', 'menu', root and root.pk or 'all', depth,
+            permission_class)
+        return mark_safe(cache.get_or_render(key, render_menu))
+
+
+@register.tag
+def pagemanager_menu(parser, token):
+    """
+    Renders a nested list of links to pages, filtered to those the current
+    user is permitted to see. Example usages:
+
+        {% pagemanager_menu %}
+        {% pagemanager_menu depth 2 %}
+        {% pagemanager_menu from page.get_root depth 3 %}
+
+    The optional ``from`` argument is either a page or a path to one; only
+    pages below it are listed. ``depth`` defaults to 1.
+
+    Rendered menus are cached per starting page, depth and class of viewing
+    permissions, and invalidated whenever a page is saved, moved or deleted.
+    """
+    bits = token.split_contents()
+    tag_name, bits = bits[0], bits[1:]
+    options = {}
+    while bits:
+        if len(bits) < 2 or bits[0] not in ('from', 'depth') or \
+            bits[0] in options:
+            raise template.TemplateSyntaxError(
+                "Usage: {%% %s [from <page>] [depth <levels>] %%}" % tag_name
+            )
+        options[bits[0]] = bits[1]
+        bits = bits[2:]
+    return MenuNode(options.get('from'), options.get('depth'))
+
+
+class BreadcrumbsNode(template.Node):
+    template_name = 'pagemanager/breadcrumbs.html'
+
+    def __init__(self, page_var):
+        self.page_var = template.Variable(page_var)
+
+    def render(self, context):
+        page = self.page_var.resolve(context)
+        permission_class = get_permission_class(resolve_user(context))
+
+        def render_breadcrumbs():
+            return render_to_string(self.template_name, {
+                'crumbs': build_breadcrumbs(page, permission_class),
+            })
+
+        key = cache.make_key('tree', 'breadcrumbs', page.pk, permission_class)
+        return mark_safe(cache.get_or_render(key, render_breadcrumbs))
+
+
+@register.tag
+def pagemanager_breadcrumbs(parser, token):
+    """
+    Renders the trail of pages leading to the passed page, leaving out any
+    ancestors the current user is not permitted to see. Example usage:
+
+        {% pagemanager_breadcrumbs page %}
+
+    """
+    try:
+        tag_name, page_var = token.split_contents()
+    except ValueError:
+        raise template.TemplateSyntaxError(
+            "The pagemanager_breadcrumbs tag requires a single argument: "
+            "the page to render the breadcrumbs of."
+        )
+    return BreadcrumbsNode(page_var)
@@ -0,0 +1,52 @@
+"""
+Settings for running pagemanager's tests on their own:
+
+    django-admin.py test pagemanager --settings=pagemanager.test_settings
+
+Besides the default database, a second SQLite database with the alias
+"replica" is defined, from which ReadDatabaseTest reads pages.
+"""
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': ':memory:',
+    },
+    'replica': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': ':memory:',
+    },
+}
+
+INSTALLED_APPS = (
+    'django.contrib.auth',
+    'django.contrib.contenttypes',
+    'django.contrib.sessions',
+    'django.contrib.messages',
+    'django.contrib.admin',
+    'django.contrib.sites',
+    'mptt',
+    'pagemanager',
+)
+
+MIDDLEWARE_CLASSES = (
+    'django.middleware.common.CommonMiddleware',
+    'django.contrib.sessions.middleware.SessionMiddleware',
+    'django.middleware.csrf.CsrfViewMiddleware',
+    'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'django.contrib.messages.middleware.MessageMiddleware',
+)
+
+TEMPLATE_CONTEXT_PROCESSORS = (
+    'django.contrib.auth.context_processors.auth',
+    'django.core.context_processors.request',
+    'django.contrib.messages.context_processors.messages',
+    'django.core.context_processors.static',
+)
+
+ROOT_URLCONF = 'pagemanager.tests'
+
+SITE_ID = 1
+
+SECRET_KEY = 'pagemanager-tests'
+
+STATIC_URL = '/static/'
@@ -1,15 +1,45 @@
+import json
+import os
+import shutil
+import tempfile
+import warnings
+from StringIO import StringIO
+from functools import partial
+
 from django.conf import settings
 from django.contrib.auth import authenticate
-from django.contrib.auth.models import Permission, User
+from django.contrib.auth.models import AnonymousUser, Group, Permission, \
+    User
 from django.contrib.contenttypes.models import ContentType
-from django.core.urlresolvers import reverse
-from django.db import models
-from django.test import TestCase
+from django.core.management import call_command
+from django.core.urlresolvers import reverse, set_urlconf
+from django.conf.urls.defaults import include, patterns, url
+from django.contrib import admin
+from django.db import connection, models
+from django.http import Http404
+from django.template import Context, Template
+from django.test import TestCase, TransactionTestCase
+from django.test.client import RequestFactory
 from django.utils import unittest
 
 import pagemanager
+import pagemanager.admin
+from pagemanager import dispatch, grants, prerender, purge, replicas, \
+    search, tree
+from pagemanager.benchmarks import QueryCounter, create_query_indexes, \
+    drop_query_indexes, explain
 from pagemanager.exceptions import AlreadyRegistered, NotRegistered
-from pagemanager.models import Page, PageLayout
+from pagemanager.middleware import ReadDatabaseMiddleware, \
+    RedirectMiddleware
+from pagemanager.models import Page, PageGrant, PageLayout, \
+    PageSearchEntry, PlaceholderPage, RedirectPage
+from pagemanager.signals import page_moved
+from pagemanager.sitemaps import get_index_queryset, iter_tree
+from pagemanager.transfer import TransferError, iter_export, load_pages
+from pagemanager.tree import deferred_tree_updates
+from pagemanager.urls import pagemanager_urlpatterns
+from pagemanager.util import get_page_from_path
+from pagemanager.warmup import get_top_paths
 
 
 class TestHomepageLayout(PageLayout):
@@ -109,6 +139,48 @@ class PageLayoutModelTest(unittest.TestCase):
             {'foo': 'listing'})
 
 
+class PackageTest(unittest.TestCase):
+    """
+    Test the names that moved out of the package module, and the admins of
+    layouts, which are only built once the admin is used.
+    """
+    def test_moved_names(self):
+        from pagemanager import options
+        for name in ('PageAdmin', 'PageAdminForm', 'DRAFT_POSTFIX'):
+            self.assertTrue(hasattr(options, name))
+            self.assertFalse(hasattr(pagemanager, name))
+
+    def test_layout_admins_are_registered_with_urls(self):
+        pagemanager.sites.pagemanager_site.register(TestListingPageLayout)
+        try:
+            self.assertFalse(TestListingPageLayout in admin.site._registry)
+            admin.site.get_urls()
+            self.assertTrue(TestListingPageLayout in admin.site._registry)
+        finally:
+            pagemanager.sites.pagemanager_site.unregister(
+                TestListingPageLayout)
+            admin.site.unregister(TestListingPageLayout)
+
+    def test_admin_mixin_dict(self):
+        pm_meta = TestListingPageLayout._pagemanager_meta
+        pm_meta.admin_mixin_dict = {
+            'list_per_page': 5,
+            'is_listing': property(lambda self: True),
+            'get_title': lambda self: self.model.__name__,
+        }
+        try:
+            admin_class = pagemanager.admin.get_layout_admin(
+                TestListingPageLayout)
+            layout_admin = admin_class(TestListingPageLayout, admin.site)
+        finally:
+            pm_meta.admin_mixin_dict = None
+        self.assertEqual(layout_admin.list_per_page, 5)
+        self.assertTrue(layout_admin.is_listing)
+        self.assertEqual(layout_admin.get_title(), 'TestListingPageLayout')
+        self.assertTrue(pagemanager.admin.get_layout_admin(
+            TestListingPageLayout) is pagemanager.admin.PageLayoutAdmin)
+
+
 class RegistrationTest(unittest.TestCase):
     
     def setUp(self):
@@ -154,6 +226,23 @@ class RegistrationTest(unittest.TestCase):
             PageLayout
         )
 
+    def test_get_by_name(self):
+        """
+        Verify that layouts are looked up by name in the current registry.
+        """
+        self.assertEqual(self.site.get_by_name('Homepage'), None)
+        self.site.register(self.test_layout)
+        self.assertEqual(self.site.get_by_name('Homepage'), self.test_layout)
+        self.site.unregister(self.test_layout)
+        self.assertEqual(self.site.get_by_name('Homepage'), None)
+
+    def test_autodiscover_is_idempotent(self):
+        """
+        Verify that repeated discovery returns the same snapshot.
+        """
+        snapshot = pagemanager.autodiscover()
+        self.assertTrue(pagemanager.autodiscover() is snapshot)
+
     def test_prevent_unregistration_of_unregistered(self):
         """
         Verify that you can only unregister a class once.
@@ -358,3 +447,942 @@ class TestPageBehaviors(TestCase):
         self.assertEqual(response.context['object'], draft_copy)
         response = self.client.post(merge_url, {'post': 'yes'})
         self.assertTrue(not Page.objects.draft_copies())
+
+
+class NavigationTagTest(TestCase):
+    """
+    Test the front-end navigation template tags.
+    """
+    def create_page(self, slug, parent=None, **kwargs):
+        page = Page(title=slug.title(), slug=slug, parent=parent, **kwargs)
+        page.save()
+        return page
+
+    def render(self, template_string, **context):
+        template = Template('{% load pagemanager_tags %}' + template_string)
+        return template.render(Context(context))
+
+    def test_menu_hides_restricted_branches(self):
+        about = self.create_page('about', status='published')
+        self.create_page('team', parent=about, status='published')
+        secret = self.create_page('secret')
+        self.create_page('plans', parent=secret, status='published')
+        output = self.render('{% pagemanager_menu depth 2 %}',
+            user=AnonymousUser())
+        self.assertTrue('About' in output)
+        self.assertTrue('Team' in output)
+        self.assertFalse('Secret' in output)
+        self.assertFalse('Plans' in output)
+
+    def test_menu_is_invalidated_on_save(self):
+        about = self.create_page('about', status='published')
+        output = self.render('{% pagemanager_menu %}', user=AnonymousUser())
+        self.assertTrue('About' in output)
+        about.title = 'Who We Are'
+        about.save()
+        output = self.render('{% pagemanager_menu %}', user=AnonymousUser())
+        self.assertTrue('Who We Are' in output)
+
+    def test_breadcrumbs(self):
+        about = self.create_page('about', status='published')
+        team = self.create_page('team', parent=about, status='published')
+        output = self.render('{% pagemanager_breadcrumbs page %}',
+            page=team, user=AnonymousUser())
+        self.assertTrue(output.index('About') < output.index('Team'))
+
+
+class SitemapTest(TestCase):
+    """
+    Test that the page index is read in tree order a chunk at a time.
+    """
+    def setUp(self):
+        self.about = Page.objects.create(title='About', slug='about',
+            status='published')
+        self.team = Page.objects.create(title='Team', slug='team',
+            parent=self.about, status='published')
+        self.board = Page.objects.create(title='Board', slug='board',
+            parent=self.about, status='published', visibility='private')
+        self.jobs = Page.objects.create(title='Jobs', slug='jobs',
+            parent=self.team, status='published')
+        self.news = Page.objects.create(title='News', slug='news',
+            status='published')
+        self.archive = Page.objects.create(title='Archive', slug='archive',
+            parent=self.news, status='published')
+
+    def test_iter_tree(self):
+        pks = [page.pk for page in (self.about, self.team, self.jobs,
+            self.news, self.archive)]
+        for chunk_size in (1, 2, 1000):
+            self.assertEqual([page.pk for page in iter_tree(
+                get_index_queryset(), chunk_size=chunk_size)], pks)
+
+    def test_export_page_index(self):
+        stdout = StringIO()
+        call_command('export_page_index', format='jsonl', chunk_size=2,
+            base_url='http://example.com/', stdout=stdout)
+        lines = [json.loads(line) for line in
+            stdout.getvalue().splitlines()]
+        self.assertEqual([line['id'] for line in lines], [self.about.pk,
+            self.team.pk, self.jobs.pk, self.news.pk, self.archive.pk])
+        self.assertEqual(lines[2]['path'], 'about/team/jobs')
+        self.assertEqual(lines[2]['url'],
+            'http://example.com%sabout/team/jobs/' %
+            reverse('pagemanager_homepage'))
+
+
+
+class DeferredTreeUpdatesTest(TestCase):
+    """
+    Test that tree maintenance is batched inside ``deferred_tree_updates``.
+    """
+    def setUp(self):
+        self.moves = []
+        page_moved.connect(self.record_move)
+
+    def tearDown(self):
+        page_moved.disconnect(self.record_move)
+
+    def record_move(self, sender, branch_ids, **kwargs):
+        self.moves.append(set(branch_ids))
+
+    def test_paths_are_calculated_on_exit(self):
+        with deferred_tree_updates():
+            about = Page(title='About', slug='about')
+            about.save()
+            team = Page(title='Team', slug='team', parent=about)
+            team.save()
+            self.assertEqual(
+                Page.objects.get(pk=team.pk).materialized_path, ''
+            )
+        self.assertEqual(
+            Page.objects.get(pk=team.pk).materialized_path, 'about/team'
+        )
+        self.assertEqual(self.moves, [set([about.pk, team.pk])])
+
+    def test_deleted_pages_are_not_moved(self):
+        about = Page.objects.create(title='About', slug='about')
+        team = Page.objects.create(title='Team', slug='team', parent=about)
+        with deferred_tree_updates():
+            Page.objects.get(pk=team.pk).delete()
+            Page.objects.create(title='Jobs', slug='jobs', parent=about)
+        jobs = Page.objects.get(slug='jobs')
+        self.assertEqual(self.moves, [set([jobs.pk])])
+        self.assertEqual(jobs.materialized_path, 'about/jobs')
+
+    def test_changed_trees(self):
+        about = Page.objects.create(title='About', slug='about')
+        team = Page.objects.create(title='Team', slug='team', parent=about)
+        company = Page.objects.create(title='Company', slug='company')
+        self.assertFalse(tree._changed_trees(Page, [about.pk, team.pk]))
+        # As left by a move with django-mptt's updates disabled.
+        Page.objects.filter(pk=team.pk).update(parent=company)
+        self.assertTrue(tree._changed_trees(Page, [team.pk]))
+        Page.objects.filter(pk=team.pk).update(parent=None)
+        self.assertTrue(tree._changed_trees(Page, [team.pk]))
+
+
+class PathTreeBackendTest(TestCase):
+    """
+    Test that the path tree backend maintains paths, levels and tree ids
+    without django-mptt.
+    """
+    def setUp(self):
+        self.backend = tree._backend
+        tree.set_tree_backend('path')
+
+    def tearDown(self):
+        tree._backend = self.backend
+
+    def test_insert_and_move(self):
+        about = Page.objects.create(title='About', slug='about')
+        team = Page.objects.create(title='Team', slug='team', parent=about)
+        lead = Page.objects.create(title='Lead', slug='lead', parent=team)
+        company = Page.objects.create(title='Company', slug='company')
+        self.assertNotEqual(about.tree_id, company.tree_id)
+        self.assertEqual(get_page_from_path('/about/team/lead/'), lead)
+        self.assertEqual(list(lead.get_ancestors()), [about, team])
+        self.assertEqual(list(about.get_descendants()), [team, lead])
+
+        team = Page.objects.get(pk=team.pk)
+        team.parent = company
+        team.save()
+        lead = Page.objects.get(pk=lead.pk)
+        self.assertEqual(lead.materialized_path, 'company/team/lead')
+        self.assertEqual(lead.level, 2)
+        self.assertEqual(lead.tree_id, company.tree_id)
+        self.assertEqual(lead.get_root(), company)
+        self.assertTrue(Page.objects.get(pk=about.pk).is_leaf_node())
+
+    def test_repeated_saves(self):
+        about = Page.objects.create(title='About', slug='about')
+        team = Page.objects.create(title='Team', slug='team', parent=about)
+        about.slug = 'who-we-are'
+        about.save()
+        about.parent = Page.objects.create(title='Company', slug='company')
+        about.save()
+        self.assertEqual(Page.objects.get(pk=team.pk).materialized_path,
+            'company/who-we-are/team')
+        self.assertEqual(about.tree_id, about.parent.tree_id)
+
+    def test_siblings(self):
+        about = Page.objects.create(title='About', slug='about')
+        team = Page.objects.create(title='Team', slug='team', parent=about)
+        jobs = Page.objects.create(title='Jobs', slug='jobs', parent=about)
+        press = Page(title='Press', slug='press')
+        press.insert_at(team, position='right', save=True)
+        self.assertEqual(list(team.get_siblings(include_self=True)),
+            [team, press, jobs])
+        self.assertEqual(team.get_next_sibling(), press)
+        self.assertEqual(jobs.get_previous_sibling(), press)
+        self.assertEqual(about.get_descendant_count(), 3)
+        self.assertEqual(set(about.get_leafnodes()), set([team, press, jobs]))
+
+    def test_imported_roots_have_their_own_trees(self):
+        about = Page.objects.create(title='About', slug='about')
+        Page.objects.create(title='Team', slug='team', parent=about)
+        lines = list(iter_export([about]))
+        about.slug = 'old-about'
+        about.save()
+        self.assertEqual(load_pages(lines), 2)
+        root = Page.objects.get(materialized_path='about')
+        self.assertEqual(root.tree_id, root.pk)
+        team = Page.objects.get(materialized_path='about/team')
+        self.assertEqual(team.tree_id, root.pk)
+        self.assertEqual(team.get_root(), root)
+
+    def test_tree_order(self):
+        about = Page.objects.create(title='About', slug='about')
+        team = Page.objects.create(title='Team', slug='team', parent=about)
+        lead = Page.objects.create(title='Lead', slug='lead', parent=team)
+        deputy = Page.objects.create(title='Deputy', slug='deputy',
+            parent=lead)
+        jobs = Page.objects.create(title='Jobs', slug='jobs', parent=about)
+        # Its path sorts between "about" and "about/team".
+        about_us = Page.objects.create(title='About us', slug='about-us')
+        self.assertEqual(list(about.get_descendants()),
+            [team, lead, deputy, jobs])
+        self.assertEqual(list(iter_tree(Page.objects.all(), chunk_size=2)),
+            [about, team, lead, deputy, jobs, about_us])
+
+        jobs.move_to(team, position='left')
+        self.assertEqual(list(about.get_descendants()),
+            [jobs, team, lead, deputy])
+        about_us.move_to(about, position='left')
+        self.assertEqual(list(tree.get_tree_backend().order_by_tree(
+            Page.objects.all())), [about_us, about, jobs, team, lead, deputy])
+
+    def test_insert_between_crowded_siblings(self):
+        about = Page.objects.create(title='About', slug='about')
+        team = Page.objects.create(title='Team', slug='team', parent=about,
+            order=1024)
+        jobs = Page.objects.create(title='Jobs', slug='jobs', parent=about,
+            order=1025)
+        openings = Page.objects.create(title='Openings', slug='openings',
+            parent=jobs)
+        news = Page.objects.create(title='News', slug='news', parent=about,
+            order=1025)
+        press = Page(title='Press', slug='press')
+        press.insert_at(team, position='right', save=True)
+        board = Page(title='Board', slug='board')
+        board.insert_at(news, position='left', save=True)
+        history = Page(title='History', slug='history')
+        history.insert_at(team, position='left', save=True)
+        self.assertEqual(list(about.get_children()),
+            [history, team, press, jobs, board, news])
+        self.assertEqual(list(about.get_descendants()),
+            [history, team, press, jobs, openings, board, news])
+        orders = [page.order for page in about.get_children()]
+        self.assertEqual(orders, sorted(set(orders)))
+
+
+class AncestorIdsTest(TestCase):
+    """
+    Test that ancestor ids are kept up to date along with paths.
+    """
+    def test_ancestor_ids_follow_moves(self):
+        about = Page.objects.create(title='About', slug='about')
+        team = Page.objects.create(title='Team', slug='team', parent=about)
+        Page.objects.create(title='Lead', slug='lead', parent=team)
+        company = Page.objects.create(title='Company', slug='company')
+        team = Page.objects.get(pk=team.pk)
+        team.parent = company
+        team.save()
+        lead = Page.objects.get(slug='lead')
+        self.assertEqual(lead.get_ancestor_ids(), [company.pk, team.pk])
+        self.assertTrue(lead.is_descendant_of(company))
+        self.assertFalse(lead.is_descendant_of(about))
+        with QueryCounter() as counter:
+            self.assertEqual(lead.get_ancestor_list(), [company, team])
+        self.assertEqual(counter.queries, 1)
+
+    def test_instances_are_kept_current(self):
+        about = Page.objects.create(title='About', slug='about')
+        team = Page.objects.create(title='Team', slug='team', parent=about)
+        self.assertEqual(team.ancestor_ids, str(about.pk))
+        self.assertEqual(team.materialized_path, 'about/team')
+        company = Page.objects.create(title='Company', slug='company')
+        team.parent = company
+        self.assertEqual(team.get_ancestor_ids(), [company.pk])
+        self.assertFalse(team.is_descendant_of(about))
+
+
+class TransferTest(TestCase):
+    """
+    Test that exported branches are imported with consistent tree fields.
+    """
+    def setUp(self):
+        self.about = Page.objects.create(title='About', slug='about',
+            is_homepage=True)
+        self.team = Page.objects.create(title='Team', slug='team',
+            parent=self.about)
+        Page.objects.create(title='Lead', slug='lead', parent=self.team)
+        Page.objects.create(title='Jobs', slug='jobs', parent=self.about)
+        self.company = Page.objects.create(title='Company', slug='company')
+        self.lines = list(iter_export([Page.objects.get(pk=self.about.pk)]))
+
+    def tree_fields(self):
+        return [(page.pk, page.tree_id, page.lft, page.rght, page.level)
+            for page in Page.objects.order_by('pk')]
+
+    def test_round_trip(self):
+        self.assertEqual(load_pages(self.lines, parent=self.company), 4)
+        lead = Page.objects.get(materialized_path='company/about/team/lead')
+        self.assertEqual(lead.get_ancestor_list()[0], self.company)
+        self.assertEqual(Page.objects.filter(is_homepage=True).count(), 1)
+        imported = self.tree_fields()
+        Page._tree_manager.rebuild()
+        self.assertEqual(imported, self.tree_fields())
+
+    def test_small_batches(self):
+        jobs = Page.objects.get(slug='jobs')
+        Page.objects.filter(slug='team').update(copy_of=jobs)
+        lines = list(iter_export([Page.objects.get(pk=self.about.pk)]))
+        self.assertEqual(load_pages(lines, parent=self.company,
+            batch_size=1), 4)
+        team = Page.objects.get(materialized_path='company/about/team')
+        self.assertEqual(team.copy_of.materialized_path, 'company/about/jobs')
+        imported = self.tree_fields()
+        Page._tree_manager.rebuild()
+        self.assertEqual(imported, self.tree_fields())
+
+    def test_slug_clash(self):
+        self.assertRaises(TransferError, load_pages, self.lines)
+        load_pages(self.lines, parent=self.company)
+        self.assertRaises(TransferError, load_pages, self.lines,
+            parent=self.company)
+        self.assertEqual(Page.objects.filter(slug='about').count(), 2)
+
+
+class SearchTest(TestCase):
+    """
+    Test the search entries of pages and the full text searches over them,
+    and the search of the admin page tree.
+    """
+    urls = 'pagemanager.tests'
+
+    def setUp(self):
+        self.enabled = search.SEARCH_INDEX_ENABLED
+        search.SEARCH_INDEX_ENABLED = True
+        self.about = Page.objects.create(title='About', slug='about',
+            description='Our history', status='published')
+        self.team = Page.objects.create(title='Team', slug='team',
+            parent=self.about, description='Our history, in people',
+            status='published')
+        self.board = Page.objects.create(title='Board', slug='board',
+            parent=self.about, description='Our history', status='published',
+            visibility='private')
+
+    def tearDown(self):
+        search.SEARCH_INDEX_ENABLED = self.enabled
+
+    def test_full_text_index(self):
+        if connection.vendor == 'sqlite':
+            self.assertTrue(search._has_fts_table())
+
+    def test_search_pages(self):
+        self.assertEqual(set(search.search_pages('history')),
+            set([self.about, self.team]))
+        self.assertEqual(search.search_pages('people'), [self.team])
+        self.team.description = 'Our staff'
+        self.team.save()
+        self.assertEqual(search.search_pages('people'), [])
+        self.assertEqual(search.search_pages('"history'), [self.about])
+
+    def test_rebuild_search_index(self):
+        PageSearchEntry.objects.all().delete()
+        self.assertEqual(search.search_pages('history'), [])
+        call_command('rebuild_search_index', chunk_size=2,
+            stdout=StringIO())
+        self.assertEqual(PageSearchEntry.objects.count(), 3)
+        self.assertEqual(set(search.search_pages('history')),
+            set([self.about, self.team]))
+
+    def test_search_tree(self):
+        matches, ancestors = search.search_tree(Page.objects.all(), 'tea')
+        self.assertEqual((matches, ancestors), ([self.team], [self.about]))
+        matches, ancestors = search.search_tree(Page.objects.all(), 'OAR')
+        self.assertEqual((matches, ancestors), ([self.board], [self.about]))
+        matches, ancestors = search.search_tree(Page.objects.all(),
+            'about/bo')
+        self.assertEqual(matches, [self.board])
+        self.assertEqual(search.search_tree(Page.objects.all(), 'history'),
+            ([], []))
+
+    def test_search_view(self):
+        User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+        url = reverse('admin:page_search')
+        # Anonymous users are shown the admin login form.
+        self.assertNotEqual(self.client.get(url, {'q': 'tea'})['Content-Type'],
+            'application/json')
+        self.client.login(username='admin', password='admin')
+        response = self.client.get(url, {'q': 'tea'})
+        self.assertEqual(json.loads(response.content), {
+            'matches': [{
+                'id': self.team.pk,
+                'node_id': self.team.node_id(),
+                'title': 'Team',
+                'path': 'about/team',
+            }],
+            'ancestors': [self.about.node_id()],
+        })
+
+
+class SiblingOrderTest(TestCase):
+    """
+    Test that reordering siblings saves only the pages that moved.
+    """
+    urls = 'pagemanager.tests'
+
+    def test_move_saves_one_page(self):
+        about = Page.objects.create(title='About', slug='about')
+        children = [Page.objects.create(title=slug.title(), slug=slug,
+            parent=about) for slug in ('team', 'history', 'jobs', 'press')]
+        self.assertEqual([page.order for page in children],
+            [tree.ORDER_GAP * i for i in range(1, 5)])
+        team, history, jobs, press = children
+        moved = tree.reorder_children(about, [team, press, history, jobs])
+        self.assertEqual([page.pk for page in moved], [press.pk])
+        self.assertEqual(list(about.get_children()),
+            [team, press, history, jobs])
+
+    def test_single_move_sends_single_branch(self):
+        User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+        self.client.login(username='admin', password='admin')
+        about = Page.objects.create(title='About', slug='about')
+        team = Page.objects.create(title='Team', slug='team', parent=about)
+        company = Page.objects.create(title='Company', slug='company')
+        jobs = Page.objects.create(title='Jobs', slug='jobs', parent=company)
+        moves = []
+
+        def record_move(sender, **kwargs):
+            moves.append(kwargs)
+        page_moved.connect(record_move)
+        try:
+            # The client posts the position of every page in the tree.
+            self.client.post('/admin/pagemanager/page/parentsorders/', {
+                str(about.pk): 'None,0',
+                str(team.pk): '%s,0' % about.pk,
+                str(jobs.pk): '%s,1' % about.pk,
+                str(company.pk): 'None,1',
+            })
+        finally:
+            page_moved.disconnect(record_move)
+        self.assertEqual(len(moves), 1)
+        self.assertEqual(moves[0]['branch_ids'], set([jobs.pk]))
+        self.assertEqual(moves[0]['old_paths'], {jobs.pk: 'company/jobs'})
+        self.assertEqual(moves[0]['new_paths'], {jobs.pk: 'about/jobs'})
+
+    def test_malformed_move_is_rejected(self):
+        User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+        self.client.login(username='admin', password='admin')
+        about = Page.objects.create(title='About', slug='about')
+        response = self.client.post('/admin/pagemanager/page/parentsorders/',
+            {str(about.pk): 'None,first'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_exhausted_gap_is_rebalanced(self):
+        pages = [Page(pk=pk, order=pk) for pk in range(1, 4)]
+        pages.insert(1, pages.pop())
+        self.assertEqual(tree.get_order_keys(pages, None),
+            [tree.ORDER_GAP * i for i in range(1, 4)])
+
+
+class PageGrantTest(TestCase):
+    """
+    Test that page grants limit users to their sections of the site.
+    """
+    def setUp(self):
+        self.about = Page.objects.create(title='About', slug='about')
+        self.team = Page.objects.create(title='Team', slug='team',
+            parent=self.about)
+        self.lead = Page.objects.create(title='Lead', slug='lead',
+            parent=self.team)
+        self.news = Page.objects.create(title='News', slug='news')
+        self.editor = User.objects.create_user('editor', 'e@example.com',
+            'editor')
+
+    def test_users_without_grants_are_unlimited(self):
+        self.assertEqual(grants.get_granted_roots(self.editor), None)
+        self.assertTrue(grants.is_granted(self.editor, self.news))
+
+    def test_grants_limit_to_subtrees(self):
+        PageGrant.objects.create(user=self.editor, page=self.team)
+        editor = User.objects.get(pk=self.editor.pk)
+        pages = Page.objects.in_bulk([self.about.pk, self.lead.pk,
+            self.news.pk])
+        grants.get_granted_roots(editor)
+        with QueryCounter() as counter:
+            self.assertTrue(grants.is_granted(editor, pages[self.lead.pk]))
+            self.assertFalse(grants.is_granted(editor, pages[self.news.pk]))
+            self.assertFalse(grants.is_granted(editor, pages[self.about.pk]))
+        self.assertEqual(counter.queries, 0)
+        self.assertEqual(
+            set(grants.filter_granted(Page.objects.all(), editor)),
+            set([self.team, self.lead])
+        )
+        self.assertEqual(
+            set(grants.filter_granted(Page.objects.all(), editor,
+                include_ancestors=True)),
+            set([self.about, self.team, self.lead])
+        )
+
+    def test_group_membership_changes(self):
+        group = Group.objects.create(name='Editors')
+        PageGrant.objects.create(group=group, page=self.team)
+        self.assertEqual(grants.get_granted_roots(
+            User.objects.get(pk=self.editor.pk)), None)
+        self.editor.groups.add(group)
+        roots = grants.get_granted_roots(User.objects.get(pk=self.editor.pk))
+        self.assertEqual([pk for pk, path, ancestor_ids in roots],
+            [self.team.pk])
+        self.editor.groups.remove(group)
+        self.assertEqual(grants.get_granted_roots(
+            User.objects.get(pk=self.editor.pk)), None)
+        self.editor.groups.add(group)
+        grants.get_granted_roots(User.objects.get(pk=self.editor.pk))
+        group.delete()
+        self.assertEqual(grants.get_granted_roots(
+            User.objects.get(pk=self.editor.pk)), None)
+
+
+class PurgeTest(TestCase):
+    """
+    Test that the smallest set of surrogate keys is purged on changes.
+    """
+    def setUp(self):
+        self.enabled = purge.ENABLED
+        purge.ENABLED = True
+        purge._backend = purge.LocMemBackend()
+
+    def tearDown(self):
+        purge.ENABLED = self.enabled
+        purge._backend = None
+
+    def test_surrogate_keys(self):
+        about = Page.objects.create(title='About', slug='about')
+        team = Page.objects.create(title='Team', slug='team', parent=about)
+        team = Page.objects.get(pk=team.pk)
+        self.assertEqual(purge.get_surrogate_keys(team), [
+            purge.page_key(team.pk),
+            purge.branch_key(about.pk),
+            purge.branch_key(team.pk),
+        ])
+
+    def test_title_edit_purges_page(self):
+        about = Page.objects.create(title='About', slug='about')
+        about = Page.objects.get(pk=about.pk)
+        about.title = 'Who We Are'
+        about.save()
+        self.assertEqual(purge._backend.purged,
+            [set([purge.page_key(about.pk)])])
+
+    def test_slug_edit_purges_branch(self):
+        about = Page.objects.create(title='About', slug='about')
+        about = Page.objects.get(pk=about.pk)
+        about.slug = 'who-we-are'
+        about.save()
+        self.assertEqual(purge._backend.purged, [set([
+            purge.page_key(about.pk), purge.branch_key(about.pk)
+        ])])
+
+    def test_new_and_hidden_pages_purge_parent_branch(self):
+        about = Page.objects.create(title='About', slug='about')
+        team = Page.objects.create(title='Team', slug='team', parent=about)
+        self.assertEqual(purge._backend.purged,
+            [set([purge.branch_key(about.pk)])])
+        team.visibility = 'private'
+        team.save()
+        team.title = 'Our Team'
+        team.save()
+        self.assertEqual(purge._backend.purged[1:], [
+            set([purge.page_key(team.pk), purge.branch_key(about.pk)]),
+            set([purge.page_key(team.pk)]),
+        ])
+
+    def test_deferred_save_purges(self):
+        about = Page.objects.create(title='About', slug='about')
+        enabled = dispatch.ENABLED
+        dispatch.ENABLED = True
+        dispatch._queue = dispatch.SyncQueue()
+        try:
+            dispatch.begin()
+            about.title = 'Who We Are'
+            about.save()
+            self.assertEqual(purge._backend.purged, [])
+            dispatch.flush()
+        finally:
+            dispatch.ENABLED = enabled
+            dispatch._queue = None
+        self.assertEqual(purge._backend.purged,
+            [set([purge.page_key(about.pk)])])
+
+    def test_move_purges_branches(self):
+        page_moved.send(sender=self, branch_ids=[1, 2])
+        self.assertEqual(purge._backend.purged, [set([
+            purge.branch_key(1), purge.branch_key(2)
+        ])])
+
+    def test_deferred_moves_are_coalesced(self):
+        enabled = dispatch.ENABLED
+        dispatch.ENABLED = True
+        dispatch._queue = dispatch.SyncQueue()
+        try:
+            dispatch.begin()
+            page_moved.send(sender=self, branch_ids=[1, 2])
+            page_moved.send(sender=self, branch_ids=[2, 3])
+            self.assertEqual(purge._backend.purged, [])
+            dispatch.flush()
+        finally:
+            dispatch.ENABLED = enabled
+            dispatch._queue = None
+        self.assertEqual(purge._backend.purged, [set([
+            purge.branch_key(1), purge.branch_key(2), purge.branch_key(3)
+        ])])
+
+    def test_recording_purges_on_exit(self):
+        enabled = dispatch.ENABLED
+        dispatch.ENABLED = True
+        dispatch._queue = dispatch.SyncQueue()
+        try:
+            with dispatch.recording():
+                page_moved.send(sender=self, branch_ids=[1])
+                with dispatch.recording():
+                    page_moved.send(sender=self, branch_ids=[2])
+                self.assertEqual(purge._backend.purged, [])
+        finally:
+            dispatch.ENABLED = enabled
+            dispatch._queue = None
+        self.assertEqual(purge._backend.purged, [set([
+            purge.branch_key(1), purge.branch_key(2)
+        ])])
+
+    def test_thread_pool_queue_is_bounded(self):
+        queue = dispatch.ThreadPoolQueue(workers=1, size=2)
+        self.assertEqual(queue.queue.maxsize, 2)
+        done = []
+        for i in range(10):
+            queue.put(partial(done.append, i))
+        queue.queue.join()
+        self.assertEqual(done, range(10))
+
+
+class RedirectMiddlewareTest(TestCase):
+    """
+    Test that redirect pages are answered from the middleware's map.
+    """
+    urls = 'pagemanager.tests'
+
+    def create_redirect(self, slug, url, **kwargs):
+        layout = RedirectPage.objects.create(url=url)
+        return Page.objects.create(title=slug.title(), slug=slug,
+            layout_type=ContentType.objects.get_for_model(RedirectPage),
+            object_id=layout.pk, **kwargs)
+
+    def get(self, middleware, path):
+        return middleware.process_request(RequestFactory().get(path))
+
+    def test_redirects_public_pages(self):
+        self.create_redirect('news', 'http://example.com/news/',
+            status='published')
+        self.create_redirect('secret', 'http://example.com/secret/')
+        middleware = RedirectMiddleware()
+        response = self.get(middleware, '/news/')
+        self.assertEqual(response['Location'], 'http://example.com/news/')
+        self.assertEqual(self.get(middleware, '/secret/'), None)
+        self.assertEqual(self.get(middleware, '/other/'), None)
+
+    def test_map_is_rebuilt_on_change(self):
+        page = self.create_redirect('news', 'http://example.com/news/',
+            status='published')
+        middleware = RedirectMiddleware()
+        self.get(middleware, '/news/')
+        layout = page.page_layout
+        layout.url = 'http://example.com/updates/'
+        layout.save()
+        response = self.get(middleware, '/news/')
+        self.assertEqual(response['Location'], 'http://example.com/updates/')
+
+    def test_urlconf_without_pagemanager(self):
+        self.create_redirect('news', 'http://example.com/news/',
+            status='published')
+        set_urlconf('django.contrib.auth.urls')
+        try:
+            self.assertEqual(self.get(RedirectMiddleware(), '/news/'), None)
+        finally:
+            set_urlconf(None)
+
+
+class WarmupTest(TestCase):
+    """
+    Test that the most requested paths are read from an access log.
+    """
+    urls = 'pagemanager.tests'
+
+    def test_top_paths(self):
+        line = ('127.0.0.1 - - [19/Oct/2026:10:00:00 +0000] '
+            '"%s HTTP/1.1" 200 512')
+        log = [line % request for request in (
+            'GET /about/team/', 'GET /about/team/?page=2', 'HEAD /',
+            'GET /about/', 'GET /about/team/', 'POST /about/', 'GET /',
+        )]
+        self.assertEqual(get_top_paths(log), ['about/team', '', 'about'])
+        self.assertEqual(get_top_paths(log, limit=1), ['about/team'])
+
+
+class PrerenderTest(TestCase):
+    """
+    Test that pre-rendering removes the output of pages that are no longer
+    public.
+    """
+    urls = 'pagemanager.tests'
+
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp()
+        self.pm_meta = PlaceholderPage._pagemanager_meta
+        self.template_file = self.pm_meta.template_file
+        self.pm_meta.template_file = 'pagemanager/breadcrumbs.html'
+        placeholder_type = ContentType.objects.get_for_model(PlaceholderPage)
+        self.about, self.team = [Page.objects.create(title=slug.title(),
+            slug=slug, status='published', layout_type=placeholder_type,
+            object_id=PlaceholderPage.objects.create().pk, **kwargs)
+            for slug, kwargs in (('about', {}), ('team', {}))]
+        self.team.parent = self.about
+        self.team.save()
+        self.redirect = Page.objects.create(title='Old', slug='old',
+            status='published',
+            layout_type=ContentType.objects.get_for_model(RedirectPage),
+            object_id=RedirectPage.objects.create(url='/about/').pk)
+
+    def tearDown(self):
+        self.pm_meta.template_file = self.template_file
+        shutil.rmtree(self.output_dir)
+
+    def output_files(self):
+        files = []
+        for directory, dirs, filenames in os.walk(self.output_dir):
+            files.extend([os.path.relpath(os.path.join(directory, filename),
+                self.output_dir) for filename in filenames])
+        return sorted(files)
+
+    def test_incremental_removes_stale_output(self):
+        rendered, errors = prerender.prerender(self.output_dir, processes=1)
+        self.assertEqual((rendered, errors), (2, []))
+        self.assertEqual(self.output_files(), [prerender.STATE_FILE,
+            prerender.REDIRECTS_FILE, 'about/index.html',
+            'about/team/index.html'])
+        self.team.visibility = 'private'
+        self.team.save()
+        self.redirect.delete()
+        prerender.prerender(self.output_dir, processes=1, incremental=True)
+        self.assertEqual(self.output_files(), [prerender.STATE_FILE,
+            prerender.REDIRECTS_FILE, 'about/index.html'])
+        self.assertFalse(os.path.exists(os.path.join(self.output_dir,
+            'about', 'team')))
+        redirects = json.load(open(os.path.join(self.output_dir,
+            prerender.REDIRECTS_FILE)))
+        self.assertEqual(redirects, {})
+
+
+class ReadDatabaseTest(TestCase):
+    """
+    Test that pages are resolved from the read database, except for users
+    who just changed pages. Needs a second database with the alias
+    "replica", which the test leaves empty.
+    """
+    def setUp(self):
+        self.read_database = replicas.READ_DATABASE
+        replicas.READ_DATABASE = 'replica'
+        self.middleware = ReadDatabaseMiddleware()
+        self.session = {}
+
+    def tearDown(self):
+        replicas.READ_DATABASE = self.read_database
+
+    def get_page(self, path):
+        request = RequestFactory().get(path)
+        request.session = self.session
+        self.middleware.process_request(request)
+        try:
+            return get_page_from_path(path)
+        finally:
+            self.middleware.process_response(request, None)
+
+    @unittest.skipUnless('replica' in settings.DATABASES,
+        'Needs a "replica" database.')
+    def test_editors_read_their_writes(self):
+        request = RequestFactory().post('/admin/')
+        request.session = self.session
+        self.middleware.process_request(request)
+        about = Page.objects.create(title='About', slug='about')
+        self.middleware.process_response(request, None)
+        self.assertEqual(self.get_page('/about/'), about)
+        self.session.clear()
+        self.assertRaises(Http404, self.get_page, '/about/')
+
+
+class AppListTest(TestCase):
+    """
+    Test that app list permissions read from the user's permission set match
+    those of the ModelAdmin.
+    """
+    def test_model_perms_match_model_admin(self):
+        from django.contrib.admin import ModelAdmin, site
+        from pagemanager.templatetags.pagemanager_admin_tags import \
+            get_model_perms
+        user = User.objects.create_user('editor', 'editor@example.com', 'x')
+        user.user_permissions.add(Permission.objects.get(
+            content_type__app_label='auth', codename='change_user'
+        ))
+        user = User.objects.get(pk=user.pk)
+        request = RequestFactory().get('/')
+        request.user = user
+        self.assertEqual(
+            get_model_perms(User, user.get_all_permissions()),
+            ModelAdmin(User, site).get_model_perms(request)
+        )
+
+
+# The admin registers the layouts when it builds its URLs, below.
+pagemanager.sites.pagemanager_site.register(TestHomepageLayout)
+
+urlpatterns = patterns('',
+    url(r'^admin/', include(admin.site.urls)),
+) + pagemanager_urlpatterns()
+
+
+class QueryIndexTest(TransactionTestCase):
+    """
+    Test that the benchmarks can create and drop the query indexes, and
+    that query plans reflect them.
+    """
+    def test_create_and_drop(self):
+        queryset = Page.objects.filter(materialized_path='about/team')
+        created = create_query_indexes()
+        try:
+            self.assertTrue('pagemanager_page_materialized_path' in created)
+            self.assertEqual(create_query_indexes(), [])
+            if connection.vendor == 'sqlite':
+                self.assertTrue('pagemanager_page_materialized_path' in
+                    ' '.join(explain(queryset)))
+        finally:
+            self.assertEqual(drop_query_indexes(), created)
+        if connection.vendor == 'sqlite':
+            self.assertFalse('pagemanager_page_materialized_path' in
+                ' '.join(explain(queryset)))
+
+
+class AdminQueryCountTest(TestCase):
+    """
+    Test that admin POSTs fetch each object once.
+    """
+    urls = 'pagemanager.tests'
+
+    def setUp(self):
+        User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+        self.client.login(username='admin', password='admin')
+        self.layout = PlaceholderPage.objects.create()
+        self.page = Page.objects.create(title='About', slug='about',
+            layout_type=ContentType.objects.get_for_model(PlaceholderPage),
+            object_id=self.layout.pk)
+
+    def test_layout_change_post(self):
+        prefix = 'pagemanager-page-layout_type-object_id'
+        data = {
+            prefix + '-TOTAL_FORMS': '1',
+            prefix + '-INITIAL_FORMS': '1',
+            prefix + '-MAX_NUM_FORMS': '1',
+            prefix + '-0-id': str(self.page.pk),
+            prefix + '-0-title': 'Who We Are',
+            prefix + '-0-slug': 'about',
+            prefix + '-0-status': 'draft',
+            prefix + '-0-visibility': 'public',
+            prefix + '-0-parent': '',
+            prefix + '-0-description': '',
+        }
+        url = reverse('admin:pagemanager_placeholderpage_change',
+            args=[self.layout.pk])
+        with QueryCounter() as counter:
+            response = self.client.post(url, data)
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(Page.objects.get(pk=self.page.pk).title, 'Who We Are')
+        layout_table = connection.ops.quote_name(
+            PlaceholderPage._meta.db_table
+        )
+        self.assertEqual(len(self.row_selects(counter, layout_table)), 1)
+
+    def test_page_add_post(self):
+        data = {
+            'title': 'Team',
+            'slug': 'team',
+            'status': 'draft',
+            'visibility': 'public',
+            'parent': str(self.page.pk),
+            'description': '',
+            'layout': 'Placeholder',
+        }
+        with QueryCounter() as counter:
+            response = self.client.post(reverse('admin:pagemanager_page_add'),
+                data)
+        self.assertEqual(response.status_code, 302)
+        team = Page.objects.get(slug='team')
+        self.assertEqual(team.parent, self.page)
+        # The parent is loaded once, by the form, and the permission check
+        # in save_form reuses it.
+        page_table = connection.ops.quote_name(Page._meta.db_table)
+        parent_selects = [query for query in self.row_selects(counter,
+            page_table) if ('WHERE %s."id" = %s ' % (page_table, self.page.pk))
+            in query['sql']]
+        self.assertEqual(len(parent_selects), 1)
+
+    def test_page_add_post_checks_grants(self):
+        editor = User.objects.create_user('editor', 'e@example.com', 'editor')
+        editor.is_staff = True
+        editor.save()
+        for codename in ('add_page', 'change_page', 'change_status',
+            'change_visibility'):
+            editor.user_permissions.add(
+                Permission.objects.get(codename=codename))
+        company = Page.objects.create(title='Company', slug='company')
+        PageGrant.objects.create(page=company, user=editor)
+        self.client.login(username='editor', password='editor')
+        response = self.client.post(reverse('admin:pagemanager_page_add'), {
+            'title': 'Team',
+            'slug': 'team',
+            'status': 'draft',
+            'visibility': 'public',
+            'parent': str(self.page.pk),
+            'description': '',
+            'layout': 'Placeholder',
+        })
+        self.assertEqual(response.status_code, 403)
+        self.assertFalse(Page.objects.filter(slug='team').exists())
+
+    def row_selects(self, counter, table):
+        """
+        Returns the captured queries that load rows from the passed table,
+        leaving out the existence checks ``Model.save`` makes.
+        """
+        return [query for query in counter.captured
+            if query['sql'].startswith('SELECT') and
+            not query['sql'].startswith('SELECT (1) AS') and
+            ('FROM %s' % table) in query['sql']]
@@ -0,0 +1,326 @@
+"""
+Serialization of page subtrees, along with their layouts, for moving content
+between environments.
+
+The format is JSON Lines: a header line, followed by one line per page in
+tree order, so that every page appears after its parent. Exports and imports
+are streamed; neither end needs the whole dump in memory as a single
+document.
+"""
+import json
+
+from django.contrib.contenttypes.models import ContentType
+from django.core import serializers
+from django.core.management.color import no_style
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection
+from django.db.models import F, Max, get_model
+
+from pagemanager.app_settings import PAGEMANAGER_PAGE_MODEL
+from pagemanager.models import attach_generics
+from pagemanager.signals import page_moved
+from pagemanager.sitemaps import iter_tree
+from pagemanager.tree import ORDER_GAP, get_tree_backend, join_ids, \
+    join_sort_path
+
+FORMAT_NAME = 'pagemanager.pages'
+FORMAT_VERSION = 1
+
+# Page fields that describe the page's position in the tree or its layout.
+# These are rebuilt on import rather than copied.
+STRUCTURAL_FIELDS = ('parent', 'lft', 'rght', 'tree_id', 'level',
+    'layout_type', 'object_id', 'materialized_path', 'ancestor_ids',
+    'sort_path', 'copy_of')
+
+
+class TransferError(Exception):
+    pass
+
+
+def _serialize(obj):
+    return serializers.serialize('python', [obj])[0]
+
+
+def iter_export(roots, chunk_size=500):
+    """
+    Yields the lines of an export of the subtrees below (and including) each
+    of the passed root pages.
+    """
+    yield json.dumps({'format': FORMAT_NAME, 'version': FORMAT_VERSION}) + \
+        '\n'
+    for root in roots:
+        pages = iter_tree(
+            root.get_descendants(include_self=True),
+            chunk_size=chunk_size
+        )
+        chunk = []
+        for page in pages:
+            chunk.append(page)
+            if len(chunk) == chunk_size:
+                for line in _export_chunk(chunk, root):
+                    yield line
+                chunk = []
+        for line in _export_chunk(chunk, root):
+            yield line
+
+
+def _export_chunk(pages, root):
+    # Fetch the layouts of the whole chunk at once.
+    attach_generics([page for page in pages if page.layout_type_id])
+    for page in pages:
+        fields = _serialize(page)['fields']
+        for name in STRUCTURAL_FIELDS:
+            fields.pop(name, None)
+        layout = getattr(page, 'page_layout', None)
+        if layout is not None:
+            layout_data = _serialize(layout)
+            layout = {
+                'model': layout_data['model'],
+                'fields': layout_data['fields'],
+            }
+        yield json.dumps({
+            'pk': page.pk,
+            'parent': page.pk != root.pk and page.parent_id or None,
+            'copy_of': page.copy_of_id,
+            'fields': fields,
+            'layout': layout,
+        }, cls=DjangoJSONEncoder) + '\n'
+
+
+def _read_records(lines):
+    lines = iter(lines)
+    try:
+        header = json.loads(next(lines))
+    except (StopIteration, ValueError):
+        raise TransferError('The import does not start with a valid header.')
+    if header.get('format') != FORMAT_NAME or \
+        header.get('version') != FORMAT_VERSION:
+        raise TransferError('Unsupported import format: %r' % header)
+    for line in lines:
+        line = line.strip()
+        if line:
+            yield json.loads(line)
+
+
+def _next_pk(model):
+    return (model._default_manager.aggregate(Max('pk'))['pk__max'] or 0) + 1
+
+
+def load_pages(lines, parent=None, batch_size=1000):
+    """
+    Imports pages from the lines of an export, as new root pages or, if
+    ``parent`` is passed, as the last children of that page. Returns the
+    number of pages created.
+
+    Rather than saving each page, which would trigger a tree update and a
+    materialized path recalculation per row, primary keys, tree fields and
+    paths are computed as the lines are read, and the rows are inserted in
+    bulk, ``batch_size`` pages at a time, so no model signals are sent. Only
+    the map of exported to new primary keys is kept for the whole import. A
+    single ``page_moved`` signal is sent for the imported branches once
+    everything is in place.
+
+    The lines must list every page after its parent and before its parent's
+    next sibling, as ``iter_export`` does. Imported pages never become the
+    homepage. A ``TransferError`` is raised if an imported branch has the
+    slug of a page already at its location.
+
+    This should be run inside a transaction, and, if deferred signals are
+    enabled, inside a ``pagemanager.dispatch.recording`` block around it, so
+    that deferred receivers only run once the transaction is committed.
+    """
+    page_model = PAGEMANAGER_PAGE_MODEL
+    if page_model._meta.parents:
+        raise TransferError(
+            'Pages cannot be bulk loaded into a model using multi-table '
+            'inheritance.'
+        )
+    manager = page_model._default_manager
+    backend = get_tree_backend()
+    # The path backend does not maintain nested sets.
+    nested_sets = backend.name == 'mptt'
+    get_tree_id = backend.get_tree_ids(page_model)
+
+    # The imported branches go after the pages already at their location,
+    # and must not share their slugs.
+    siblings = manager.filter(parent=parent)
+    slugs = set(siblings.values_list('slug', flat=True))
+    last_order = siblings.aggregate(Max('order'))['order__max'] or 0
+
+    first_pk = next_page_pk = _next_pk(page_model)
+    # The pages below this primary key have been inserted.
+    inserted_pk = first_pk
+    page_pks = {}
+    copies = {}
+    layout_models = {}
+    next_layout_pks = {}
+    branch_ids = set()
+    counter = parent is not None and parent.rght or 1
+
+    pages = []
+    layouts = {}
+    m2m = []
+    stack = []
+    for record in _read_records(lines):
+        # Close every open page that is not the parent of this one.
+        while stack and stack[-1][0] != record['parent']:
+            counter = _close(stack.pop()[1], counter,
+                nested_sets and inserted_pk)
+        if record['parent'] is not None and not stack:
+            raise TransferError(
+                'Page %s does not follow its parent.' % record['pk']
+            )
+        page = page_model(pk=next_page_pk)
+        page_pks[record['pk']] = next_page_pk
+        next_page_pk += 1
+        for name, value in record['fields'].items():
+            field = page_model._meta.get_field(name)
+            setattr(page, field.attname, field.to_python(value))
+        # The site already has its homepage.
+        page.is_homepage = False
+        if stack:
+            parent_page = stack[-1][1]
+        else:
+            parent_page = parent
+            if page.slug in slugs:
+                raise TransferError(
+                    'A page with the slug "%s" already exists at the import '
+                    'location.' % page.slug
+                )
+            slugs.add(page.slug)
+            branch_ids.add(page.pk)
+            last_order += ORDER_GAP
+            page.order = last_order
+            if parent is None:
+                counter = 1
+                page.tree_id = get_tree_id(page)
+        if parent_page is not None:
+            page.parent_id = parent_page.pk
+            page.tree_id = parent_page.tree_id
+            page.level = parent_page.level + 1
+            page.materialized_path = '%s/%s' % (
+                parent_page.materialized_path, page.slug
+            )
+            page.ancestor_ids = join_ids(
+                parent_page.get_ancestor_ids() + [parent_page.pk]
+            )
+            page.sort_path = join_sort_path(parent_page.sort_path,
+                page.order, page.pk)
+        else:
+            page.level = 0
+            page.materialized_path = page.slug
+            page.ancestor_ids = ''
+            page.sort_path = join_sort_path('', page.order, page.pk)
+        # ``rght`` is known once the page's descendants have been read.
+        page.lft = counter
+        page.rght = 0
+        counter += 1
+        # Pages copied from a page further on are pointed at it once it has
+        # been inserted.
+        if record['copy_of'] in page_pks:
+            page.copy_of_id = page_pks[record['copy_of']]
+        elif record['copy_of'] is not None:
+            copies.setdefault(record['copy_of'], []).append(page.pk)
+        if record['layout']:
+            label = record['layout']['model']
+            if label not in layout_models:
+                model = get_model(*label.split('.'))
+                if model is None:
+                    raise TransferError('Unknown layout model "%s".' % label)
+                layout_models[label] = model
+                next_layout_pks[label] = _next_pk(model)
+            deserialized = list(serializers.deserialize('python', [{
+                'model': label,
+                'pk': next_layout_pks[label],
+                'fields': record['layout']['fields'],
+            }]))[0]
+            next_layout_pks[label] += 1
+            layouts.setdefault(layout_models[label], []).append(
+                deserialized.object)
+            m2m.append(deserialized)
+            page.layout_type = ContentType.objects.get_for_model(
+                layout_models[label]
+            )
+            page.object_id = deserialized.object.pk
+        pages.append(page)
+        stack.append((record['pk'], page))
+        if len(pages) == batch_size:
+            _insert_batch(page_model, pages, layouts, m2m, batch_size)
+            inserted_pk = next_page_pk
+            pages, layouts, m2m = [], {}, []
+    while stack:
+        counter = _close(stack.pop()[1], counter, nested_sets and inserted_pk)
+    _insert_batch(page_model, pages, layouts, m2m, batch_size)
+    if next_page_pk == first_pk:
+        return 0
+
+    for exported_pk, pks in copies.items():
+        if exported_pk in page_pks:
+            manager.filter(pk__in=pks).update(copy_of=page_pks[exported_pk])
+    if parent is not None and nested_sets:
+        # Make room for the imported pages at the end of the parent, by
+        # moving the pages after them along.
+        size = 2 * (next_page_pk - first_pk)
+        others = manager.filter(tree_id=parent.tree_id, pk__lt=first_pk)
+        others.filter(lft__gte=parent.rght).update(lft=F('lft') + size)
+        others.filter(rght__gte=parent.rght).update(rght=F('rght') + size)
+    _reset_sequences([page_model] + layout_models.values())
+    page_moved.send(sender=load_pages, branch_ids=branch_ids)
+    return next_page_pk - first_pk
+
+
+def _close(page, counter, inserted_pk):
+    """
+    Gives a page whose descendants have all been read its ``rght`` value,
+    updating its row if it has already been inserted. Returns the next
+    nested set number.
+    """
+    page.rght = counter
+    if inserted_pk and page.pk < inserted_pk:
+        page.__class__._default_manager.filter(pk=page.pk).update(
+            rght=counter)
+    return counter + 1
+
+
+def _insert_batch(page_model, pages, layouts, m2m, batch_size):
+    """
+    Inserts a batch of pages, after their layouts.
+    """
+    for model, objs in layouts.items():
+        model._default_manager.bulk_create(objs, batch_size=batch_size)
+    _bulk_create_m2m(m2m, batch_size)
+    page_model._default_manager.bulk_create(pages, batch_size=batch_size)
+
+
+def _bulk_create_m2m(deserialized_objects, batch_size):
+    """
+    Inserts the rows of the auto-created through tables of the layouts'
+    many-to-many fields in bulk.
+    """
+    rows = {}
+    for deserialized in deserialized_objects:
+        obj = deserialized.object
+        for name, pks in deserialized.m2m_data.items():
+            field = obj._meta.get_field(name)
+            through = field.rel.through
+            if not through._meta.auto_created:
+                continue
+            for pk in pks:
+                rows.setdefault(through, []).append(through(**{
+                    '%s_id' % field.m2m_field_name(): obj.pk,
+                    '%s_id' % field.m2m_reverse_field_name(): pk,
+                }))
+    for through, objs in rows.items():
+        through._default_manager.bulk_create(objs, batch_size=batch_size)
+
+
+def _reset_sequences(models):
+    """
+    Since rows were inserted with explicit primary keys, database sequences
+    need to be moved past them.
+    """
+    statements = connection.ops.sequence_reset_sql(no_style(), models)
+    if statements:
+        cursor = connection.cursor()
+        for sql in statements:
+            cursor.execute(sql)
@@ -0,0 +1,889 @@
+"""
+Maintenance of the page tree.
+
+The tree is stored by one of two backends, chosen with the
+PAGEMANAGER_TREE_BACKEND setting:
+
+``"mptt"`` (the default)
+    django-mptt's nested sets. Reading a subtree is a single range query, but
+    every insert or move renumbers ``lft`` and ``rght`` across the tree.
+
+``"path"``
+    The indexed ``materialized_path`` column, along with ``parent``,
+    ``level`` and ``tree_id``. Inserts touch a single row and moves touch
+    only the moved subtree; ``lft`` and ``rght`` are no longer maintained.
+    Ancestors are looked up by path prefix and descendants by a ``LIKE
+    'path/%'`` query. Pages are put in tree order by their ``sort_path``,
+    which holds the order keys of the page and its ancestors.
+
+Both backends provide ``get_ancestors``, ``get_children``,
+``get_descendants``, ``get_descendant_count``, ``get_leafnodes``,
+``get_siblings``, ``get_next_sibling``, ``get_previous_sibling``,
+``get_root``, ``is_leaf_node``, ``insert_at`` and ``move_to`` on pages, so
+templates and views work with either.
+
+Switching from "mptt" to "path" needs no data migration, since paths, sort
+paths, levels and tree ids are already kept current. Switching back from "path" to "mptt"
+requires rebuilding the nested sets, which the ``recalculate_mp`` management
+command does before checking every path.
+"""
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from itertools import count
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db.models import Max, Min, Model, Q
+from django.http import Http404
+
+from pagemanager.signals import page_moved
+
+_deferred = threading.local()
+
+
+def split_ids(value):
+    """
+    Returns the primary keys stored in an ``ancestor_ids`` value.
+    """
+    return [int(pk) for pk in value.split(',') if pk]
+
+
+def join_ids(pks):
+    """
+    Returns the ``ancestor_ids`` value storing the passed primary keys.
+    """
+    return ','.join([str(pk) for pk in pks])
+
+
+# Order keys are offset so that negative ones sort correctly as text.
+SORT_KEY_OFFSET = 2 ** 31
+
+
+def get_sort_key(order, pk):
+    """
+    Returns the part of a ``sort_path`` that places a page among its
+    siblings: its ``order`` key, then its primary key, each padded to a
+    fixed width so that comparing the text compares the numbers.
+    """
+    return '%010d%010d' % ((order or 0) + SORT_KEY_OFFSET, pk)
+
+
+def join_sort_path(parent_sort_path, order, pk):
+    """
+    Returns the ``sort_path`` of a page below a parent with the passed sort
+    path, or of a root page if it is empty. Every page sorts after its
+    parent and before its parent's next sibling, so sort paths put pages in
+    tree order.
+    """
+    if parent_sort_path:
+        return '%s/%s' % (parent_sort_path, get_sort_key(order, pk))
+    return get_sort_key(order, pk)
+
+
+class MPTTBackend(object):
+    """
+    Stores the tree as django-mptt's nested sets.
+    """
+    name = 'mptt'
+
+    # Fields that order pages in tree order and identify each one, so that
+    # they can be paged through with ``iter_tree``.
+    iteration_fields = ('tree_id', 'lft')
+
+    def save(self, page, *args, **kwargs):
+        from mptt.models import MPTTModel
+        return MPTTModel.save(page, *args, **kwargs)
+
+    def delete(self, page, *args, **kwargs):
+        from mptt.models import MPTTModel
+        return MPTTModel.delete(page, *args, **kwargs)
+
+    def move_to(self, page, target, position='first-child'):
+        from mptt.models import MPTTModel
+        return MPTTModel.move_to(page, target, position)
+
+    def get_ancestors(self, page, ascending=False, include_self=False):
+        from mptt.models import MPTTModel
+        return MPTTModel.get_ancestors(page, ascending=ascending,
+            include_self=include_self)
+
+    def get_descendants(self, page, include_self=False):
+        from mptt.models import MPTTModel
+        return MPTTModel.get_descendants(page, include_self=include_self)
+
+    def get_children(self, page):
+        from mptt.models import MPTTModel
+        return MPTTModel.get_children(page)
+
+    def get_root(self, page):
+        from mptt.models import MPTTModel
+        return MPTTModel.get_root(page)
+
+    def is_leaf_node(self, page):
+        from mptt.models import MPTTModel
+        return MPTTModel.is_leaf_node(page)
+
+    def get_siblings(self, page, include_self=False):
+        from mptt.models import MPTTModel
+        return MPTTModel.get_siblings(page, include_self=include_self)
+
+    def get_next_sibling(self, page, **filters):
+        from mptt.models import MPTTModel
+        return MPTTModel.get_next_sibling(page, **filters)
+
+    def get_previous_sibling(self, page, **filters):
+        from mptt.models import MPTTModel
+        return MPTTModel.get_previous_sibling(page, **filters)
+
+    def get_leafnodes(self, page, include_self=False):
+        from mptt.models import MPTTModel
+        return MPTTModel.get_leafnodes(page, include_self=include_self)
+
+    def get_descendant_count(self, page):
+        from mptt.models import MPTTModel
+        return MPTTModel.get_descendant_count(page)
+
+    def insert_at(self, page, target, position='first-child', save=False,
+        allow_existing_pk=False):
+        # django-mptt calls this from ``save`` as well.
+        from mptt.models import MPTTModel
+        return MPTTModel.insert_at(page, target, position=position, save=save,
+            allow_existing_pk=allow_existing_pk)
+
+    def get_tree_ids(self, page_model):
+        """
+        Returns a function that gives each new root page inserted in bulk,
+        bypassing ``save``, its tree id, in the order they are inserted.
+        """
+        tree_ids = count(page_model._tree_manager._get_next_tree_id())
+        return lambda page: next(tree_ids)
+
+    def get_materialized_path(self, page):
+        page_chain = [a.slug for a in page.get_ancestors()]
+        page_chain.append(page.slug)
+        return '/'.join(page_chain)
+
+    def get_by_path(self, page_model, path, using=None):
+        """
+        Returns the page at a path, validating each step of the path from
+        the root down. ``using`` names the database to read from, if not the
+        default one.
+        """
+        manager = page_model.objects.db_manager(using)
+
+        def _validate_path_with_page(parent_obj, child_slug):
+            try:
+                if not parent_obj:
+                    return manager.get(slug=child_slug, parent=None)
+                else:
+                    return manager.get(slug=child_slug, parent=parent_obj)
+            except (page_model.DoesNotExist,
+                page_model.MultipleObjectsReturned):
+                raise Http404("Page not found.")
+
+        path_pieces = filter(bool, path.split("/"))
+        return reduce(_validate_path_with_page, path_pieces, '')
+
+    def update_paths(self, page_model, instance):
+        """
+        Updates the materialized path, ancestor ids and sort path of a saved
+        page, and those of its descendants.
+
+        Note that this must be done through the ``update`` method, as
+        triggering a model's ``save`` function again will create an endless
+        loop.
+        """
+        manager = page_model._default_manager
+        # The instance's nested set values may be stale, as other pages have
+        # moved since it was loaded, so they are read afresh.
+        tree_id, lft, rght = manager.filter(pk=instance.pk).values_list(
+            'tree_id', 'lft', 'rght')[0]
+        ancestors = list(manager.filter(tree_id=tree_id, lft__lt=lft,
+            rght__gt=rght).order_by('lft').values_list('pk', 'slug', 'order'))
+        path = '/'.join([slug for pk, slug, order in ancestors] +
+            [instance.slug])
+        ancestor_ids = [pk for pk, slug, order in ancestors]
+        sort_path = ''
+        for pk, slug, order in ancestors + [
+            (instance.pk, instance.slug, instance.order)]:
+            sort_path = join_sort_path(sort_path, order, pk)
+        manager.filter(pk=instance.pk).update(
+            materialized_path=path,
+            ancestor_ids=join_ids(ancestor_ids),
+            sort_path=sort_path,
+        )
+        instance.materialized_path = path
+        instance.ancestor_ids = join_ids(ancestor_ids)
+        instance.sort_path = sort_path
+        # If the instance is not new, it may have descendants whose paths also
+        # need to be recached. They come in tree order, so every parent is
+        # seen before its children; a row whose parent is not part of the
+        # subtree can only come from an inconsistent tree, and is left alone.
+        chains = {instance.pk: (path, ancestor_ids + [instance.pk],
+            sort_path)}
+        descendants = manager.filter(tree_id=tree_id, lft__gt=lft,
+            rght__lt=rght).order_by('lft').values_list('pk', 'parent', 'slug',
+            'order', 'materialized_path', 'ancestor_ids', 'sort_path')
+        for pk, parent_pk, slug, order, old_path, old_ids, old_sort_path in \
+            descendants:
+            if parent_pk not in chains:
+                continue
+            parent_path, parent_chain, parent_sort_path = chains[parent_pk]
+            path = '%s/%s' % (parent_path, slug)
+            sort_path = join_sort_path(parent_sort_path, order, pk)
+            chains[pk] = (path, parent_chain + [pk], sort_path)
+            if (path, join_ids(parent_chain), sort_path) != \
+                (old_path, old_ids, old_sort_path):
+                manager.filter(pk=pk).update(
+                    materialized_path=path,
+                    ancestor_ids=join_ids(parent_chain),
+                    sort_path=sort_path,
+                )
+
+    def order_by_tree(self, queryset):
+        """
+        Orders a queryset so that parents come before their children and
+        siblings are in their display order.
+        """
+        return queryset.order_by('tree_id', 'lft')
+
+    def ancestors_filter(self, pages):
+        """
+        Returns a ``Q`` object matching the ancestors of all of the passed
+        pages.
+        """
+        q = Q()
+        for page in pages:
+            q |= Q(tree_id=page.tree_id, lft__lt=page.lft, rght__gt=page.rght)
+        return q
+
+    def subtree_filter(self, pages):
+        """
+        Returns a ``Q`` object matching all of the passed pages and their
+        descendants.
+        """
+        q = Q()
+        for page in pages:
+            q |= Q(tree_id=page.tree_id, lft__gte=page.lft,
+                rght__lte=page.rght)
+        return q
+
+
+class PathBackend(MPTTBackend):
+    """
+    Stores the tree as materialized paths, bypassing django-mptt's writes.
+    """
+    name = 'path'
+
+    iteration_fields = ('sort_path', 'pk')
+
+    def save(self, page, *args, **kwargs):
+        old_level = page.level
+        if page.parent_id:
+            parent = page.parent
+            page.level = parent.level + 1
+            page.tree_id = parent.tree_id
+        else:
+            page.level = 0
+            # Pages that become roots get a tree of their own, numbered after
+            # their primary key so that concurrent inserts never share one.
+            # New pages are numbered once they have been inserted.
+            if page.pk is None:
+                page.tree_id = 0
+            elif old_level or not page.tree_id:
+                page.tree_id = page.pk
+        if page.lft is None:
+            page.lft = page.rght = 0
+        result = Model.save(page, *args, **kwargs)
+        if not page.tree_id:
+            page.tree_id = page.pk
+            page.__class__._default_manager.filter(pk=page.pk).update(
+                tree_id=page.pk)
+        return result
+
+    def get_tree_ids(self, page_model):
+        # Roots are numbered after their primary key, as in ``save``.
+        return lambda page: page.pk
+
+    def delete(self, page, *args, **kwargs):
+        # Descendants go along with the page, through the parent foreign key.
+        return Model.delete(page, *args, **kwargs)
+
+    def move_to(self, page, target, position='first-child'):
+        self.insert_at(page, target, position, save=True)
+
+    def insert_at(self, page, target, position='first-child', save=False,
+        allow_existing_pk=False):
+        """
+        Places the page relative to ``target``, giving it an ``order`` key
+        next to the target's, or before or after its children.
+        """
+        manager = page.__class__._default_manager
+        if position in ('first-child', 'last-child'):
+            page.parent = target
+            if position == 'first-child':
+                first = manager.filter(parent=target).exclude(
+                    pk=page.pk).aggregate(Min('order'))['order__min']
+                if first is None:
+                    page.order = ORDER_GAP
+                else:
+                    page.order = first - ORDER_GAP
+            else:
+                page.order = get_next_order(page)
+        else:
+            page.parent = target.parent
+            # The page is given a key between the target's and that of its
+            # neighbour on that side; if there is no room between them, the
+            # siblings are given fresh keys first.
+            siblings = list(manager.filter(parent=target.parent_id).exclude(
+                pk=page.pk).order_by('order', 'pk'))
+            index = [sibling.pk for sibling in siblings].index(target.pk)
+            if position == 'right':
+                index += 1
+            siblings.insert(index, page)
+            page.order = None
+            keys = get_order_keys(siblings, target.parent_id)
+            for sibling, key in zip(siblings, keys):
+                if sibling is not page and sibling.order != key:
+                    sibling.order = key
+                    sibling.save()
+            page.order = keys[index]
+        if save:
+            page.save()
+
+    def get_siblings(self, page, include_self=False):
+        siblings = page.__class__._default_manager.filter(
+            parent=page.parent_id)
+        if not include_self:
+            siblings = siblings.exclude(pk=page.pk)
+        return siblings.order_by('order', 'pk')
+
+    def get_next_sibling(self, page, **filters):
+        siblings = self.get_siblings(page).filter(**filters).filter(
+            Q(order__gt=page.order) | Q(order=page.order, pk__gt=page.pk))
+        try:
+            return siblings[0]
+        except IndexError:
+            return None
+
+    def get_previous_sibling(self, page, **filters):
+        siblings = self.get_siblings(page).filter(**filters).filter(
+            Q(order__lt=page.order) | Q(order=page.order, pk__lt=page.pk))
+        try:
+            return siblings.reverse()[0]
+        except IndexError:
+            return None
+
+    def get_leafnodes(self, page, include_self=False):
+        return self.get_descendants(page, include_self=include_self).filter(
+            children__isnull=True)
+
+    def get_descendant_count(self, page):
+        return self.get_descendants(page).count()
+
+    def get_ancestors(self, page, ascending=False, include_self=False):
+        ancestor_ids = page.get_ancestor_ids()
+        if include_self:
+            ancestor_ids.append(page.pk)
+        manager = page.__class__._default_manager
+        if not ancestor_ids:
+            return manager.none()
+        return manager.filter(pk__in=ancestor_ids) \
+            .order_by(ascending and '-level' or 'level')
+
+    def get_descendants(self, page, include_self=False):
+        q = Q(materialized_path__startswith=page.materialized_path + '/')
+        if include_self:
+            q |= Q(pk=page.pk)
+        return self.order_by_tree(page.__class__._default_manager.filter(q))
+
+    def get_children(self, page):
+        return page.__class__._default_manager.filter(parent=page) \
+            .order_by('order', 'pk')
+
+    def get_root(self, page):
+        ancestor_ids = page.get_ancestor_ids()
+        if not ancestor_ids:
+            return page
+        return page.__class__._default_manager.get(pk=ancestor_ids[0])
+
+    def is_leaf_node(self, page):
+        # ``recursetree`` caches each node's children on it.
+        if hasattr(page, '_cached_children'):
+            return not page._cached_children
+        return not page.__class__._default_manager.filter(
+            parent=page
+        ).exists()
+
+    def get_materialized_path(self, page):
+        # The parent's path is read from the database, since paths are
+        # updated there rather than on instances.
+        if page.parent_id:
+            parent_path = page.__class__._default_manager.filter(
+                pk=page.parent_id
+            ).values_list('materialized_path', flat=True)[0]
+            return '%s/%s' % (parent_path, page.slug)
+        return page.slug
+
+    def get_by_path(self, page_model, path, using=None):
+        """
+        Returns the page at a path with a single indexed lookup.
+        """
+        try:
+            return page_model.objects.db_manager(using).get(
+                materialized_path='/'.join(filter(bool, path.split('/')))
+            )
+        except (page_model.DoesNotExist, page_model.MultipleObjectsReturned):
+            raise Http404("Page not found.")
+
+    def update_paths(self, page_model, instance):
+        """
+        Updates the materialized path, ancestor ids and sort path of a saved
+        page, and the paths, ancestor ids, sort paths, levels and tree ids
+        of its descendants, which are found under the page's previous path.
+        """
+        manager = page_model._default_manager
+        # The stored row still holds the previous path and ancestors, which
+        # the instance may not, if it was saved before or loaded long ago.
+        old_path, old_ids, old_sort_path = manager.filter(
+            pk=instance.pk
+        ).values_list('materialized_path', 'ancestor_ids', 'sort_path')[0]
+        old_chain = split_ids(old_ids) + [instance.pk]
+        if instance.parent_id:
+            parent_path, parent_ids, parent_sort_path = manager.filter(
+                pk=instance.parent_id
+            ).values_list('materialized_path', 'ancestor_ids', 'sort_path')[0]
+            new_path = '%s/%s' % (parent_path, instance.slug)
+            ancestor_ids = split_ids(parent_ids) + [instance.parent_id]
+        else:
+            new_path = instance.slug
+            ancestor_ids = []
+            parent_sort_path = ''
+        sort_path = join_sort_path(parent_sort_path, instance.order,
+            instance.pk)
+        manager.filter(pk=instance.pk).update(
+            materialized_path=new_path,
+            ancestor_ids=join_ids(ancestor_ids),
+            sort_path=sort_path,
+        )
+        instance.materialized_path = new_path
+        instance.ancestor_ids = join_ids(ancestor_ids)
+        instance.sort_path = sort_path
+        new_chain = ancestor_ids + [instance.pk]
+        if not old_path or (old_path, old_chain, old_sort_path) == \
+            (new_path, new_chain, sort_path):
+            return
+        descendants = manager.filter(
+            materialized_path__startswith=old_path + '/'
+        ).values_list('pk', 'materialized_path', 'ancestor_ids', 'sort_path')
+        for pk, path, ids, descendant_sort_path in descendants:
+            path = new_path + path[len(old_path):]
+            manager.filter(pk=pk).update(
+                materialized_path=path,
+                ancestor_ids=join_ids(
+                    new_chain + split_ids(ids)[len(old_chain):]
+                ),
+                sort_path=sort_path +
+                    descendant_sort_path[len(old_sort_path):],
+                level=path.count('/'),
+                tree_id=instance.tree_id,
+            )
+
+    def order_by_tree(self, queryset):
+        return queryset.order_by('sort_path')
+
+    def ancestors_filter(self, pages):
+        ancestor_ids = set()
+        for page in pages:
+            ancestor_ids.update(page.get_ancestor_ids())
+        return Q(pk__in=ancestor_ids)
+
+    def subtree_filter(self, pages):
+        q = Q()
+        for page in pages:
+            q |= Q(materialized_path=page.materialized_path) | \
+                Q(materialized_path__startswith=page.materialized_path + '/')
+        return q
+
+
+def preorder(nodes, get_pk=lambda node: node.pk,
+    get_parent_pk=lambda node: node.parent_id):
+    """
+    Returns a list of the passed nodes in which every node is followed by all
+    of its descendants, as ``recursetree`` and imports expect. Siblings keep
+    their relative order, and nodes whose parent is not among them are taken
+    as roots.
+    """
+    nodes = list(nodes)
+    pks = set([get_pk(node) for node in nodes])
+    children = {}
+    roots = []
+    for node in nodes:
+        parent_pk = get_parent_pk(node)
+        if parent_pk in pks:
+            children.setdefault(parent_pk, []).append(node)
+        else:
+            roots.append(node)
+    ordered = []
+    stack = list(reversed(roots))
+    while stack:
+        node = stack.pop()
+        ordered.append(node)
+        stack.extend(reversed(children.get(get_pk(node), ())))
+    return ordered
+
+
+# Siblings are ordered by sparse ``order`` keys, spaced ORDER_GAP apart, so
+# that a page can be moved between two others by changing its key alone.
+ORDER_GAP = 1024
+
+# The field default, which new pages are given unless an order is set.
+DEFAULT_ORDER = 99999
+
+
+def get_next_order(page):
+    """
+    Returns an ``order`` key that places the passed page after all of its
+    current siblings.
+    """
+    siblings = page.__class__._default_manager.filter(parent=page.parent_id)
+    if page.pk is not None:
+        siblings = siblings.exclude(pk=page.pk)
+    last = siblings.aggregate(Max('order'))['order__max']
+    if last is None:
+        return ORDER_GAP
+    return last + ORDER_GAP
+
+
+def _stable_indices(orders):
+    """
+    Returns the indices of the longest run of the passed orders, not
+    necessarily contiguous, that strictly increases; those pages can keep
+    their keys. None is never part of the run.
+    """
+    tails = []
+    tail_indices = []
+    previous = {}
+    for index, order in enumerate(orders):
+        if order is None:
+            continue
+        position = bisect_left(tails, order)
+        if position == len(tails):
+            tails.append(order)
+            tail_indices.append(index)
+        else:
+            tails[position] = order
+            tail_indices[position] = index
+        if position:
+            previous[index] = tail_indices[position - 1]
+        else:
+            previous[index] = None
+    indices = []
+    index = None
+    if tail_indices:
+        index = tail_indices[-1]
+    while index is not None:
+        indices.append(index)
+        index = previous[index]
+    return set(indices)
+
+
+def _sibling_orders(pages, parent_pk):
+    orders = []
+    for page in pages:
+        if page.parent_id == parent_pk:
+            orders.append(page.order)
+        else:
+            orders.append(None)
+    return orders
+
+
+def get_order_keys(pages, parent_pk):
+    """
+    Returns a list of ``order`` keys for the passed pages, in the order they
+    should appear below the parent with the primary key ``parent_pk``. Pages
+    already below that parent whose keys are still in sequence keep them;
+    the others are given keys in the gaps around them. If a gap has run out,
+    every page is given a fresh, evenly spaced key.
+    """
+    orders = _sibling_orders(pages, parent_pk)
+    stable = _stable_indices(orders)
+    keys = list(orders)
+    start = 0
+    while start < len(pages):
+        if start in stable:
+            start += 1
+            continue
+        end = start
+        while end < len(pages) and end not in stable:
+            end += 1
+        # Pages start to end - 1 need keys between their stable neighbours.
+        count = end - start
+        low = high = None
+        if start:
+            low = keys[start - 1]
+        if end < len(pages):
+            high = keys[end]
+        if low is None and high is None:
+            new_keys = [ORDER_GAP * (i + 1) for i in range(count)]
+        elif low is None:
+            new_keys = [high - ORDER_GAP * (count - i) for i in range(count)]
+        elif high is None:
+            new_keys = [low + ORDER_GAP * (i + 1) for i in range(count)]
+        else:
+            step = (high - low) // (count + 1)
+            if step < 1:
+                return [ORDER_GAP * (i + 1) for i in range(len(pages))]
+            new_keys = [low + step * (i + 1) for i in range(count)]
+        keys[start:end] = new_keys
+        start = end
+    return keys
+
+
+def reorder_children(parent, pages):
+    """
+    Places the passed pages below ``parent`` (or at the root, if it is
+    None), in the order given, which should list all of its children.
+    Only pages whose parent or ``order`` key changes are saved, so moving a
+    single page saves a single page, except when its siblings' keys have to
+    be spread out again. Returns the pages whose position changed; siblings
+    that were only given fresh keys are left out.
+    """
+    parent_pk = parent is not None and parent.pk or None
+    stable = _stable_indices(_sibling_orders(pages, parent_pk))
+    moved = []
+    keys = get_order_keys(pages, parent_pk)
+    for index, (page, key) in enumerate(zip(pages, keys)):
+        if page.parent_id != parent_pk or page.order != key:
+            # Nested set values go stale as other pages move, so the page
+            # and its parent are read afresh before each save.
+            manager = page.__class__._default_manager
+            page = manager.get(pk=page.pk)
+            if parent_pk is not None:
+                page.parent = manager.get(pk=parent_pk)
+            else:
+                page.parent = None
+            page.order = key
+            page.save()
+            if index not in stable:
+                moved.append(page)
+    return moved
+
+
+def get_moved_branches(page_model, old_positions, pks):
+    """
+    Returns the materialized paths of the roots of the moved subtrees, before
+    and after the move, as two dictionaries keyed by primary key. ``pks`` is
+    the set of pages whose position changed, and ``old_positions`` maps each
+    of them to its path and ancestor ids before the move. A page is left out
+    when another of them was its ancestor both before and after the move,
+    since that page's branch covers it.
+    """
+    rows = page_model._default_manager.filter(pk__in=list(pks)).values_list(
+        'pk', 'materialized_path', 'ancestor_ids')
+    old_paths = {}
+    new_paths = {}
+    for pk, path, ancestor_ids in rows:
+        old_path, old_ancestor_ids = old_positions[pk]
+        if pks.intersection(old_ancestor_ids, split_ids(ancestor_ids)):
+            continue
+        old_paths[pk] = old_path
+        new_paths[pk] = path
+    return old_paths, new_paths
+
+
+TREE_BACKENDS = {
+    'mptt': MPTTBackend,
+    'path': PathBackend,
+}
+
+_backend = None
+
+
+def get_tree_backend():
+    """
+    Returns the tree backend named in the PAGEMANAGER_TREE_BACKEND setting.
+    """
+    if _backend is None:
+        set_tree_backend(getattr(settings, 'PAGEMANAGER_TREE_BACKEND', 'mptt'))
+    return _backend
+
+
+def set_tree_backend(name):
+    """
+    Switches the tree backend of the current process, for benchmarks and
+    tests. The stored tree must suit the new backend; see above.
+    """
+    global _backend
+    try:
+        _backend = TREE_BACKENDS[name]()
+    except KeyError:
+        raise ImproperlyConfigured(
+            'PAGEMANAGER_TREE_BACKEND must be one of %s.' %
+            ', '.join(sorted(TREE_BACKENDS))
+        )
+
+
+def record_deferred_change(instance, deleted=False):
+    """
+    If tree updates are currently deferred, records that the passed page was
+    changed, or deleted, and returns True. Otherwise, returns False; the
+    caller is then responsible for performing the updates right away.
+    """
+    changes = getattr(_deferred, 'changes', None)
+    if changes is None:
+        return False
+    changes['pks'].add(instance.pk)
+    changes['tree_ids'].add(getattr(instance, 'tree_id', None))
+    if deleted:
+        changes['deleted'].add(instance.pk)
+    else:
+        # Some databases reuse the primary key of a deleted row.
+        changes['deleted'].discard(instance.pk)
+    return True
+
+
+def _changed_trees(page_model, pks):
+    """
+    Returns whether any of the passed pages now belongs to a tree other
+    than the one stored in its tree id: a page moved under a parent in
+    another tree, or one that became a root and still shares its tree id.
+    """
+    rows = page_model._default_manager.filter(pk__in=pks).values_list(
+        'tree_id', 'parent', 'parent__tree_id')
+    root_tree_ids = set()
+    for tree_id, parent_pk, parent_tree_id in rows:
+        if parent_pk is None:
+            root_tree_ids.add(tree_id)
+        elif tree_id != parent_tree_id:
+            return True
+    return page_model._default_manager.filter(parent__isnull=True,
+        tree_id__in=root_tree_ids).count() > len(root_tree_ids)
+
+
+def recalculate_tree_paths(page_model, tree_id=None):
+    """
+    Recalculates the materialized paths, ancestor ids, sort paths, levels and
+    tree ids of every page in a tree, or in all trees if ``tree_id`` is None,
+    with a single query to read the pages and one update for each page that
+    actually changed. Returns the number of pages updated.
+    """
+    pages = page_model._default_manager.all()
+    if tree_id is not None:
+        pages = pages.filter(tree_id=tree_id)
+    rows = dict([(row[0], row) for row in pages.values_list(
+        'pk', 'parent', 'slug', 'materialized_path', 'ancestor_ids', 'level',
+        'tree_id', 'order', 'sort_path'
+    )])
+    computed = {}
+
+    def compute(pk):
+        # Walk up to the nearest page already computed, or to the root, then
+        # fill in the paths on the way back down.
+        chain = []
+        while pk not in computed:
+            chain.append(pk)
+            parent_pk = rows[pk][1]
+            if parent_pk not in rows:
+                break
+            pk = parent_pk
+        for pk in reversed(chain):
+            parent_pk, slug, tree_id, order = rows[pk][1], rows[pk][2], \
+                rows[pk][6], rows[pk][7]
+            if parent_pk in computed:
+                parent_path, parent_ids, parent_level, tree_id, \
+                    parent_sort_path = computed[parent_pk]
+                computed[pk] = ('%s/%s' % (parent_path, slug),
+                    parent_ids + [parent_pk], parent_level + 1, tree_id,
+                    join_sort_path(parent_sort_path, order, pk))
+            else:
+                computed[pk] = (slug, [], 0, tree_id,
+                    join_sort_path('', order, pk))
+
+    updated = 0
+    for pk, parent_pk, slug, old_path, old_ids, old_level, old_tree_id, \
+        order, old_sort_path in rows.values():
+        if pk not in computed:
+            compute(pk)
+        path, ancestor_ids, level, tree_id, sort_path = computed[pk]
+        ancestor_ids = join_ids(ancestor_ids)
+        if (path, ancestor_ids, level, tree_id, sort_path) != \
+            (old_path, old_ids, old_level, old_tree_id, old_sort_path):
+            page_model._default_manager.filter(pk=pk).update(
+                materialized_path=path, ancestor_ids=ancestor_ids,
+                level=level, tree_id=tree_id, sort_path=sort_path
+            )
+            updated += 1
+    return updated
+
+
+@contextmanager
+def deferred_tree_updates(page_model=None):
+    """
+    A context manager that postpones tree maintenance during batch writes.
+    Example usage:
+
+        with deferred_tree_updates():
+            for data in rows:
+                Page.objects.create(**data)
+
+    While it is active, materialized paths are not recalculated as pages are
+    saved; if the installed version of django-mptt supports it, its own
+    updates of tree fields are suspended as well. On exit, the affected trees
+    are rebuilt and their paths recalculated once each, and a single
+    ``page_moved`` signal is sent for every page that was changed and not
+    deleted. If a page moved to another tree, every tree is rebuilt.
+
+    Nested uses are folded into the outermost one. If an exception is raised
+    inside the block, no maintenance is performed; the caller is expected to
+    roll back the transaction.
+    """
+    if getattr(_deferred, 'changes', None) is not None:
+        yield
+        return
+    if page_model is None:
+        from pagemanager.util import get_pagemanager_model
+        page_model = get_pagemanager_model()
+    uses_mptt = get_tree_backend().name == 'mptt'
+    tree_manager = page_model._tree_manager
+    disable_mptt_updates = uses_mptt and \
+        getattr(tree_manager, 'disable_mptt_updates', None)
+
+    _deferred.changes = {'pks': set(), 'tree_ids': set(), 'deleted': set()}
+    try:
+        if disable_mptt_updates:
+            with disable_mptt_updates():
+                yield
+        else:
+            yield
+        changes = _deferred.changes
+    finally:
+        _deferred.changes = None
+
+    if not changes['pks']:
+        return
+    if not uses_mptt:
+        # Moved pages may have taken their subtrees to other trees, so every
+        # tree is checked.
+        recalculate_tree_paths(page_model)
+    else:
+        if disable_mptt_updates:
+            partial_rebuild = getattr(tree_manager, 'partial_rebuild', None)
+            # Trees can only be rebuilt one at a time when no page left
+            # its tree.
+            if partial_rebuild and all(changes['tree_ids']) and \
+                not _changed_trees(page_model, changes['pks']):
+                for tree_id in changes['tree_ids']:
+                    partial_rebuild(tree_id)
+            else:
+                tree_manager.rebuild()
+        # Rebuilding may have renumbered trees, so they are looked up afresh.
+        tree_ids = page_model._default_manager.filter(
+            pk__in=changes['pks']
+        ).values_list('tree_id', flat=True).distinct()
+        for tree_id in tree_ids:
+            recalculate_tree_paths(page_model, tree_id)
+    branch_ids = changes['pks'] - changes['deleted']
+    if branch_ids:
+        page_moved.send(sender=deferred_tree_updates, branch_ids=branch_ids)
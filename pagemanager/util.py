@@ -1,13 +1,12 @@
-from functools import partial
-
 from django.core.exceptions import ImproperlyConfigured
 from django.conf import settings
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
-from django.http import Http404
 
-from pagemanager import PageAdmin
-from pagemanager.models import Page
+from pagemanager.instrumentation import instrumented
+from pagemanager.models import Page, RedirectPage
+from pagemanager.signals import page_edited, page_moved
+from pagemanager.tree import get_tree_backend, record_deferred_change
 
 
 def get_pagemanager_model():
@@ -28,9 +27,12 @@ def get_pagemanager_model():
 
 def get_pagemanager_modeladmin():
     """
-    Returns the model to be used by pagemanager. It must be either
-    pagemanager.models.Page or a subclass thereof.
+    Returns the ModelAdmin to be used for pages. It must be either
+    pagemanager.options.PageAdmin or a subclass thereof.
+
+    This imports the admin, so it is only called when the admin is set up.
     """
+    from pagemanager.options import PageAdmin
     if hasattr(settings, 'PAGEMANAGER_PAGE_MODELADMIN'):
         if isinstance(settings.PAGEMANAGER_PAGE_MODELADMIN, str):
             from django.utils.importlib import import_module
@@ -50,11 +52,12 @@ def get_pagemanager_modeladmin():
             else:
                 raise ImproperlyConfigured(
                     'PAGEMANAGER_PAGE_MODELADMIN must be a subclass of '
-                    'pagemanager.admin.PageAdmin'
+                    'pagemanager.options.PageAdmin'
                 )
     return PageAdmin
 
 
+@instrumented('path_resolution')
 def get_page_from_path(path):
     """
     Returns the final page in a URL-type path, validating that it lives at the
@@ -66,39 +69,66 @@ def get_page_from_path(path):
     If the path is incorrect, an ``Http404`` exception is raised. If two nodes 
     with the same slug have the same parent, a 404 is also raised.
     
+    Within a request, the page may be read from a replica; see
+    ``pagemanager.replicas``.
     """
-    
-    def _validate_path_with_page(page_model, parent_obj, child_slug):
-        try:
-            if not parent_obj:
-                return page_model.objects.get(slug=child_slug, parent=None)
-            else:
-                return parent_obj.get_children().get(slug=child_slug)
-        except (page_model.DoesNotExist, page_model.MultipleObjectsReturned):
-            raise Http404("Page not found.")
-    
-    path_pieces = filter(bool, path.split("/"))
-    validate_path = partial(_validate_path_with_page, get_pagemanager_model())
-    return reduce(validate_path, path_pieces, '')
+    from pagemanager.replicas import get_read_database
+    return get_tree_backend().get_by_path(get_pagemanager_model(), path,
+        using=get_read_database())
 
 
 @receiver(post_save, sender=get_pagemanager_model(), dispatch_uid="mp_sig")
+@instrumented('path_recalculation')
 def recalculate_materialized_path(sender, instance, created, *args, **kwargs):
     """
     A signal which updated a model's materialized path after it's been saved. It
-    also updated the paths of any descendants.
-    
-    Note that this must be done through the ``update`` method, as triggering a 
-    model's ``save`` function again will create an endless loop.
+    also updated the paths of any descendants, through the tree backend.
+
+    Inside a ``pagemanager.tree.deferred_tree_updates`` block, the page is
+    only recorded and its path is recalculated when the block exits.
+    """
+    if record_deferred_change(instance):
+        return
+    get_tree_backend().update_paths(sender, instance)
+
+
+@receiver(post_delete, sender=get_pagemanager_model(), dispatch_uid="mp_del")
+def record_deferred_delete(sender, instance, *args, **kwargs):
+    """
+    Records deletions made inside a ``deferred_tree_updates`` block, so that
+    the tree they were removed from gets rebuilt.
+    """
+    record_deferred_change(instance, deleted=True)
+
+
+@receiver(post_save, sender=get_pagemanager_model(),
+    dispatch_uid="pm_cache_save")
+@receiver(post_delete, sender=get_pagemanager_model(),
+    dispatch_uid="pm_cache_delete")
+@receiver(page_edited, dispatch_uid="pm_cache_edited")
+@receiver(page_moved, dispatch_uid="pm_cache_moved")
+def invalidate_tree_caches(sender, *args, **kwargs):
+    """
+    Invalidates the cached navigation fragments whenever the page tree
+    changes in any way.
+    """
+    from pagemanager import cache
+    cache.invalidate('tree')
+
+
+@receiver(post_save, sender=get_pagemanager_model(),
+    dispatch_uid="pm_redirects_save")
+@receiver(post_delete, sender=get_pagemanager_model(),
+    dispatch_uid="pm_redirects_delete")
+@receiver(post_save, sender=RedirectPage,
+    dispatch_uid="pm_redirects_layout_save")
+@receiver(post_delete, sender=RedirectPage,
+    dispatch_uid="pm_redirects_layout_delete")
+@receiver(page_moved, dispatch_uid="pm_redirects_moved")
+def invalidate_redirect_map(sender, *args, **kwargs):
+    """
+    Has every ``RedirectMiddleware`` rebuild its redirect map on its next
+    request.
     """
-    materialized_path = instance.get_materialized_path()
-    sender.objects.filter(pk=instance.pk).update(
-        materialized_path=materialized_path
-    )
-    # If the instance is not new, it may have descendants whose paths also need
-    # to be recached.
-    for descendant in instance.get_descendants():
-        materialized_path = descendant.get_materialized_path()
-        sender.objects.filter(pk=descendant.pk).update(
-            materialized_path=materialized_path
-        )    
\ No newline at end of file
+    from pagemanager import cache
+    cache.invalidate('redirects')
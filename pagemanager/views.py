@@ -3,8 +3,10 @@ from django.http import Http404, HttpResponseRedirect
 from django.shortcuts import get_object_or_404, redirect
 from django.views.generic import DetailView
 
-from pagemanager import app_settings
+from pagemanager import app_settings, grants, purge
+from pagemanager.instrumentation import instrumented, measure
 from pagemanager.models import RedirectPage
+from pagemanager.replicas import get_read_database
 from pagemanager.util import get_page_from_path
 
 
@@ -27,6 +29,7 @@ class PageManagerViewMixin(object):
         context['fields'] = context['object'].page_layout
         return context
 
+    @instrumented('view_dispatch')
     def dispatch(self, request, *args, **kwargs):
         response = super(PageManagerViewMixin, self).dispatch(request, *args, \
             **kwargs)
@@ -34,12 +37,18 @@ class PageManagerViewMixin(object):
         if not self.can_view_page(request):
             raise Http404
 
-        redirect_url = self.object.page_layout.get_redirect_url()
+        with measure('layout_loading'):
+            redirect_url = self.object.page_layout.get_redirect_url()
         if redirect_url:
-            return HttpResponseRedirect(redirect_url)
+            response = HttpResponseRedirect(redirect_url)
 
+        if purge.ENABLED:
+            response[purge.SURROGATE_KEY_HEADER] = ' '.join(
+                purge.get_surrogate_keys(self.object)
+            )
         return response
 
+    @instrumented('permission_check')
     def can_view_page(self, request):
         if not hasattr(self, 'object'):
             return False
@@ -49,6 +58,11 @@ class PageManagerViewMixin(object):
         if self.object.visibility == 'private':
             if not request.user.has_perm('pagemanager.view_private_pages'):
                 return False
+        # Users with page grants may only preview restricted pages in their
+        # own sections.
+        if self.object.status == 'draft' or \
+            self.object.visibility == 'private':
+            return grants.is_granted(request.user, self.object)
         return True
 
 
@@ -85,7 +99,8 @@ class HomepageView(PageManagerViewMixin, DetailView):
         if self.content_object:
             return self.content_object
         try:
-            self.content_object = self.model.objects.get(is_homepage=True)
+            self.content_object = self.model.objects.db_manager(
+                get_read_database()).get(is_homepage=True)
             return self.content_object
         except:
             raise Http404
@@ -0,0 +1,155 @@
+"""
+Warming pagemanager's caches after a deploy or a cache flush.
+
+Pages are rendered through the same views that serve them, as an anonymous
+user, which fills the cached menu and breadcrumb fragments their templates
+use; the cached grants of every user with page grants are filled as well.
+The pages can be limited to the most requested paths of an access log.
+
+Readiness is measured by rendering a sample of the warmed pages again and
+counting the cache lookups that hit.
+"""
+import re
+from collections import defaultdict
+from multiprocessing.pool import ThreadPool
+
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.db import close_connection
+from django.db.models import Q
+
+from pagemanager import instrumentation
+from pagemanager.grants import get_granted_roots
+from pagemanager.models import RedirectPage
+from pagemanager.prerender import get_public_pages, render_page
+from pagemanager.sitemaps import get_page_url, get_url_prefix, iter_tree
+
+REQUEST_LINE = re.compile(r'"(?:GET|HEAD) (\S+)')
+
+
+def get_top_paths(log_file, limit=None):
+    """
+    Returns the materialized paths of the pages requested most often in an
+    access log in the common or combined format, most requested first. The
+    homepage is returned as an empty string.
+    """
+    prefix = get_url_prefix()
+    counts = defaultdict(int)
+    for line in log_file:
+        match = REQUEST_LINE.search(line)
+        if match is None:
+            continue
+        url = match.group(1).split('?', 1)[0]
+        if url.startswith(prefix):
+            counts[url[len(prefix):].strip('/')] += 1
+    paths = sorted(counts, key=lambda path: -counts[path])
+    if limit:
+        paths = paths[:limit]
+    return paths
+
+
+def get_pages(paths=None, chunk_size=500):
+    """
+    Returns the public pages to warm: those at the passed materialized paths,
+    in the order given, or else the whole public tree.
+    """
+    if paths is None:
+        return list(iter_tree(get_public_pages(), chunk_size=chunk_size))
+    pages = {}
+    for start in range(0, len(paths), chunk_size):
+        for page in get_public_pages().filter(
+            materialized_path__in=paths[start:start + chunk_size]):
+            pages[page.materialized_path] = page
+    if '' in paths:
+        for page in get_public_pages().filter(is_homepage=True):
+            pages[''] = page
+    return [pages[path] for path in paths if path in pages]
+
+
+def _warm_page(job):
+    page_pk, url, path, is_homepage = job
+    try:
+        response = render_page(url, path, is_homepage)
+    except Exception, e:
+        return page_pk, unicode(e)
+    if response.status_code != 200:
+        return page_pk, 'Status code %d' % response.status_code
+    return page_pk, None
+
+
+def _warm_pages(jobs):
+    try:
+        return map(_warm_page, jobs)
+    finally:
+        # Each thread opens its own database connection.
+        close_connection()
+
+
+def warm_grants():
+    """
+    Fills the cached grants of every user with page grants, and returns the
+    number of users.
+    """
+    users = User.objects.filter(
+        Q(pagemanager_grants__isnull=False) |
+        Q(groups__pagemanager_grants__isnull=False)
+    ).distinct()
+    count = 0
+    for user in users:
+        get_granted_roots(user)
+        count += 1
+    return count
+
+
+def check_readiness(jobs):
+    """
+    Renders the passed pages again, and returns the number of cache lookups
+    that hit and missed.
+    """
+    instrumentation.start_collection()
+    try:
+        for job in jobs:
+            _warm_page(job)
+    finally:
+        stats = instrumentation.stop_collection()
+    return stats.get('cache_hit', [0])[0], stats.get('cache_miss', [0])[0]
+
+
+def warm(paths=None, concurrency=1, sample=20):
+    """
+    Warms the caches for the pages at the passed materialized paths, or for
+    every public page, rendering ``concurrency`` pages at a time. Returns a
+    dictionary holding the number of pages rendered, a list of (page pk,
+    error) tuples for the pages that failed, the number of users whose
+    grants were cached, and the cache hits and misses of rendering up to
+    ``sample`` of the pages again.
+    """
+    prefix = get_url_prefix()
+    redirect_type = ContentType.objects.get_for_model(RedirectPage)
+    # Redirect pages are answered by RedirectMiddleware, whose map lives in
+    # the memory of each server process.
+    jobs = [(page.pk, get_page_url(page, prefix), page.materialized_path,
+        page.is_homepage) for page in get_pages(paths)
+        if page.layout_type_id != redirect_type.pk]
+
+    if concurrency > 1:
+        pool = ThreadPool(concurrency)
+        try:
+            results = sum(pool.map(_warm_pages, [jobs[start::concurrency]
+                for start in range(concurrency)], chunksize=1), [])
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = map(_warm_page, jobs)
+    errors = [(page_pk, error) for page_pk, error in results if error]
+    users = warm_grants()
+
+    hits, misses = check_readiness(jobs[:sample])
+    return {
+        'rendered': len(jobs) - len(errors),
+        'errors': errors,
+        'users': users,
+        'hits': hits,
+        'misses': misses,
+    }
@@ -26,7 +26,7 @@ setup(
     ),
     classifiers=classifiers,
     install_requires=[
-        'django>=1.3',
+        'django>=1.4',
         'django-mptt>=0.4.2',
         'django-reversion>=1.4',
     ],